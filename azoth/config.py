@@ -34,6 +34,12 @@ TERRAIN_DATA_FILE = os.path.join(TERRAIN_DIRECTORY, 'terrain.json')
 # The file containing all the reagent descriptors
 REAGENT_DATA_FILE = os.path.join(OBJECT_DIRECTORY, 'reagents.json')
 
+# The directory to hold compiled maps, keyed by a hash of their source file
+MAP_CACHE_DIRECTORY = os.path.join(BASE_DIRECTORY, 'cache', 'maps')
+
+# The width and height of a World sector in tiles
+SECTOR_SIZE = 31
+
 # The file for libtcod dll's
 DLL_DIRECTORY = os.path.join(BASE_DIRECTORY, 'dll')
 
@@ -44,6 +50,41 @@ MS_PER_FRAME = 1000 // FRAMES_PER_SECOND
 # The seconds to delay between scripted animation frames
 PATHFIND_SECONDS_PER_FRAME = 0.01
 
+# The most locations the player's pathfinding may search per turn, so that
+# long searches do not freeze the screen
+PATHFIND_NODES_PER_TURN = 1000
+
+# The longest path the player's pathfinding will look for
+PATHFIND_MAX_DEPTH = 500
+
+# The pathfinding engine: 'python', or 'libtcod' to hand the searches over
+# uniform-cost ground to libtcod's C A* and Dijkstra (see tcodpath)
+PATH_BACKEND = 'python'
+
+# Log the search statistics of the player's pathfinding, and shade the
+# tiles each search explored on the map
+PATHFIND_STATS = False
+
+# How far from their target followers share a flow field instead of
+# searching for a path of their own
+FOLLOW_RADIUS = 20
+
+# How many turns ahead the followers of a target plan their moves together
+PARTY_WINDOW = 8
+
+# The number of flow fields kept for the followers of different targets
+FLOW_FIELD_CACHE_SIZE = 8
+
+# The number of paths the player has found to keep for reuse, per place
+PATH_CACHE_SIZE = 64
+
+# The field of view algorithm: 'shadowcast', or, where libtcod can be
+# loaded, 'libtcod' or 'libtcod_shadow' (see fov)
+FOV_ALGORITHM = 'shadowcast'
+
+# The number of fields of view the map viewer keeps for reuse
+FOV_CACHE_SIZE = 16
+
 # The log file
 LOG_FILE = os.path.join(BASE_DIRECTORY, 'azoth.log')
 
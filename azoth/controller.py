@@ -17,10 +17,40 @@ class Controller(object):
         self.session = session
         self.path = None
         self.on_end_of_path = None
+        self.planner = None
+        self.search = None
+
+    def __getstate__(self):
+        """ Leave out the search state when saving. """
+        state = dict(self.__dict__)
+        state['planner'] = None
+        state['search'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.planner = None
+        self.search = None
+
+    def get_planner(self, allowed=None):
+        """ Return the path.Replanner over the subject's place, confined to
+        the 'allowed' tiles, making a new one if the subject has changed
+        places or movement modes. """
+        grid = self.session.rules.get_cost_grid(self.subject.mmode,
+                                                self.subject.place)
+        if self.planner is None or self.planner.grid is not grid:
+            self.planner = path.Replanner(grid, allowed)
+        else:
+            self.planner.set_allowed(allowed)
+        return self.planner
 
 
 class Player(Controller):
     """ A controller that lets the player direct the subject. """
+
+    # The path.SearchStats of the last search, if config.PATHFIND_STATS
+    stats = None
+
     def move_or_swap(self, dx, dy):
         """ Try to move; if blocked by an occupant try to swap. """
         try:
@@ -60,6 +90,10 @@ class Player(Controller):
 
     def follow_path(self):
         """ Take the next step along the saved path. """
+        if callable(self.path[0]) and self.search is not None:
+            # Wait at the end of the partial path for the search to reach
+            # the destination.
+            return
         step = self.path.pop(0)
         if callable(step):
             return step()
@@ -71,9 +105,26 @@ class Player(Controller):
         except place.PlaceError:
             self.path = None
         except executor.RuleError:
-            self.path = None
+            if self.search is None:
+                self.path = self.replan(step)
+            else:
+                self.path = [s for s in self.path if callable(s)]
         raise event.Handled()
 
+    def replan(self, blocked):
+        """ Repair the saved path from where the subject stands, avoiding the
+        'blocked' step that failed. Any actions at the end of the path are
+        kept. Returns the new path, or None if there is none. """
+        tiles = [step for step in self.path if not callable(step)]
+        actions = [step for step in self.path if callable(step)]
+        dst = tiles[-1] if tiles else blocked
+        planner = self.get_planner(
+            allowed=self.subject.place.get_explored_mask())
+        steps = planner.find(self.subject.xy, dst, blocked=[blocked])
+        if not steps:
+            return None
+        return steps + actions
+
     def teleport(self, x, y):
         """ Jump to a location. """
         try:
@@ -84,38 +135,81 @@ class Player(Controller):
             return
         raise event.Handled()
         
-    def filter_neighbor(self, pla, x, y):
-        """ Return True iff this tile looks ok for pathfinding. """
-        try:
-            self.session.rules.assert_passable(self.subject, pla, x, y)
-            return pla.get_explored(x, y)
-        except executor.RuleError:
-            return False
-
-    def neighbors(self, loc):
-        """ Enumerate neighbors for pathfinding. """
-        return self.session.rules.get_neighbors(self.subject.place, *loc, 
-                                                filter=self.filter_neighbor)
-
-    def heuristic(self, loc, dst):
-        """ Evaluate the tile for pathfinding. """
-        # use city-block distance; return cost, nearness
-        x, y = loc
-        dx = abs(dst[0] - x)
-        dy = abs(dst[1] - y)
-        nearness = dx + dy
-        pla = self.subject.place
-        mmode = self.subject.mmode
-        cost = self.session.rules.get_movement_cost(mmode, pla, x, y)
-        cost += 1  # XXX: necessary?
-        return nearness, cost
-
     def pathfind_to(self, x, y):
-        """ Find and start following a path to (x, y). """
+        """ Find and start following a path to (x, y) over explored
+        tiles. """
+        pla = self.subject.place
         src = self.subject.xy
-        self.path = path.find(src, (x, y), self.neighbors, self.heuristic)
+        mmode = self.subject.mmode
+        cache = self.session.rules.get_path_cache(pla, config.PATH_CACHE_SIZE)
+        self.planner = None
+        self.search = None
+        self.stats = None
+        self.path = cache.get(src, (x, y), mmode)
+        if self.path is not None:
+            return self.path
+        if not self.session.rules.get_regions(mmode, pla).connected(
+                src, (x, y)):
+            # No amount of searching would find a way.
+            self.path = []
+            return self.path
+        grid = self.session.rules.get_cost_grid(mmode, pla)
+        if config.PATHFIND_STATS:
+            self.stats = path.SearchStats(explored=True)
+        self.search = path.search_on_grid(
+            grid, src, (x, y), allowed=pla.get_explored_mask(),
+            max_depth=config.PATHFIND_MAX_DEPTH,
+            batch=config.PATHFIND_NODES_PER_TURN, stats=self.stats)
+        self.search_key = (src, (x, y), mmode)
+        self.trail = [src]
+        self.path = []
+        # Get far enough to have somewhere to start walking to.
+        while self.search is not None and not self.path:
+            self.continue_search()
         return self.path
 
+    def cancel_path(self):
+        """ Stop following the saved path, and stop any search for one. """
+        self.path = None
+        self.search = None
+
+    def continue_search(self):
+        """ Run the next slice of the search started by pathfind_to(), and
+        switch the saved path over to the best route found so far. """
+        if self.subject.xy != self.trail[-1]:
+            if path.manhattan(self.subject.xy, self.trail[-1]) != 1:
+                # Teleported or moved places; the search is no use now.
+                self.cancel_path()
+                return
+            self.trail.append(self.subject.xy)
+        done, route = next(self.search)
+        actions = [step for step in self.path if callable(step)]
+        if done:
+            self.search = None
+            if self.stats is not None:
+                logger.debug('search {}: {}'.format(self.search_key,
+                                                    self.stats))
+            if not route:
+                self.path = []
+                return
+            src, dst, mmode = self.search_key
+            cache = self.session.rules.get_path_cache(self.subject.place,
+                                                      config.PATH_CACHE_SIZE)
+            cache.put(src, dst, mmode, route)
+        self.path = self.splice(route) + actions
+
+    def splice(self, route):
+        """ Return the steps from where the subject stands onto a route from
+        where the search started: back along the way the subject came until
+        it meets the route, then down it. """
+        tiles = [self.trail[0]] + route
+        index = dict((loc, i) for i, loc in enumerate(tiles))
+        for i in range(len(self.trail) - 1, -1, -1):
+            if self.trail[i] in index:
+                back = self.trail[i:-1]
+                back.reverse()
+                return back + tiles[index[self.trail[i]] + 1:]
+
     def do_turn(self, session):
         session.controller = self
         # Run one check of the event queue to allow the player
@@ -124,17 +218,28 @@ class Player(Controller):
             session.drain_events()
         except event.Handled:
             return
+        if self.search is not None:
+            self.continue_search()
         if self.path:
             try:
                 self.follow_path()
             except event.Handled:
                 time.sleep(config.PATHFIND_SECONDS_PER_FRAME)
                 return
+        if self.search is not None:
+            # Give the viewer its frame and carry on searching next turn.
+            return
         session.handle_events()
 
 
 class Follow(Controller):
-    """ AI that follows a target around. """
+    """ AI that follows a target around. All the followers of a target move
+    as a party, planned together so that they do not get in each other's
+    way. """
+
+    # Where the target was when this follower's party last moved
+    planned_for = None
+
     def __init__(self, target, *args, **kwargs):
         """ 'target' is the object to follow. """
         super(Follow, self).__init__(*args, **kwargs)
@@ -144,46 +249,124 @@ class Follow(Controller):
         # prepend to get in front of rendering
         self.target.on('move', self.on_target_moved, prepend=True)
 
-    def check_neighbor(self, pla, x, y):
-        try:
-            if x != self.target.x and y != self.target.y:
-                self.session.rules.assert_unoccupied(pla, x, y)
-            self.session.rules.assert_passable(self.subject, pla, x, y)
-            return True
-        except executor.RuleError:
-            return False
-
-    def neighbors(self, loc):
-        return self.session.rules.get_neighbors(self.subject.place, *loc, 
-                                                filter=self.check_neighbor)
-
-    def heuristic(self, loc, dst):
-        # use city-block distance; return cost, nearness
-        x, y = loc
-        dx = abs(dst[0] - x)
-        dy = abs(dst[1] - y)
-        nearness = dx + dy
-        pla = self.subject.place
-        cost = self.session.rules.get_movement_cost(self.subject.mmode, pla, x,
-                                                    y)
-        cost += 1  # XXX: necessary?
-        return nearness, cost
+    def blocked(self, pla):
+        """ Return the tiles held by other occupants, which pathfinding
+        should avoid. """
+        return [loc for loc in pla.occupants
+                if loc != self.subject.xy and loc != self.target.xy]
+
+    def party(self, pla):
+        """ Return the controllers on pla following the same target, this one
+        included. """
+        return [actor for actor in pla.actors
+                if isinstance(actor, Follow) and actor.target is self.target]
 
     def do_turn(self, session):
         # Everything is done in on_target_moved
         pass
 
     def on_target_moved(self):
-        p = path.find(self.subject.xy, self.target.xy, self.neighbors,
-                      self.heuristic)
-        logger.debug('xy={}'.format(self.subject.xy))
+        # The first follower to hear of the move moves the whole party.
+        if self.planned_for == self.target.xy:
+            return
+        pla = self.subject.place
+        members = self.party(pla)
+        for member in members:
+            member.planned_for = self.target.xy
+        self.move_party(pla, self.plan_party(pla, members))
+
+    def plan_party(self, pla, members):
+        """ Return a list of (member, loc) next steps for the members that
+        have somewhere to go. Members within range of the target are planned
+        together with WHCA*, nearest first, each steering around the
+        reservations of those before it. """
+        rules = self.session.rules
+        table = path.ReservationTable()
+        ranked = []
+        for i, member in enumerate(members):
+            xy = member.subject.xy
+            # Until they are planned, members might stay put.
+            table.reserve(member, [xy, xy])
+            field = rules.get_flow_field(member.subject.mmode, pla,
+                                         self.target.xy, config.FOLLOW_RADIUS)
+            ranked.append((field.get(*xy), i, member, field))
+        ranked.sort()
+        others = set(pla.occupants).difference(member.subject.xy
+                                               for member in members)
+        moves = []
+        for cost, _, member, field in ranked:
+            xy = member.subject.xy
+            if path.manhattan(xy, self.target.xy) <= 1:
+                continue
+            if cost == path.INFINITY:
+                loc = member.step_alone(pla)
+                if loc is not None:
+                    moves.append((member, loc))
+                continue
+            table.release(member, xy, 1)
+            locs = path.find_in_time(xy, self.neighbors(field.grid, others),
+                                     self.heuristic(field), table, member,
+                                     config.PARTY_WINDOW)
+            table.reserve(member, locs)
+            if len(locs) > 1 and locs[1] != xy:
+                moves.append((member, locs[1]))
+        return moves
+
+    @staticmethod
+    def neighbors(grid, blocked):
+        """ Return the 'neighbors' callback of path.find_in_time() over a cost
+        grid. """
+        def neighbors(loc):
+            for dx, dy in path.directions:
+                x = loc[0] + dx
+                y = loc[1] + dy
+                if grid.passable(x, y) and (x, y) not in blocked:
+                    yield (x, y), grid.costs[y * grid.width + x] + 1
+        return neighbors
+
+    def heuristic(self, field):
+        """ Return the 'heuristic' callback of path.find_in_time(): the cost
+        of getting next to the target, according to its flow field. """
+        dst = self.target.xy
+        arrive = field.grid.costs[dst[1] * field.grid.width + dst[0]] + 1
+        def heuristic(loc):
+            if loc == dst:
+                return path.INFINITY
+            return field.get(*loc) - arrive
+        return heuristic
+
+    def step_alone(self, pla):
+        """ Return the next step toward a target that is out of flow-field
+        range, or None. """
+        regions = self.session.rules.get_regions(self.subject.mmode, pla)
+        if not regions.connected(self.subject.xy, self.target.xy):
+            return None
+        p = self.get_planner().find(self.subject.xy, self.target.xy,
+                                    blocked=self.blocked(pla))
         logger.debug('path={}'.format(p))
-        if len(p) > 1:
-            loc = p[0]
-            dx = loc[0] - self.subject.x
-            dy = loc[1] - self.subject.y
-            logger.debug('move {} {}'.format(dx, dy))
-            try:
-                self.session.hax2.move_being_on_map(self.subject, dx, dy)
-            except executor.Occupied:
-                pass
+        if len(p) < 2:
+            return None
+        return p[0]
+
+    def move_party(self, pla, moves):
+        """ Carry out the moves planned for the party, letting those who are
+        moving out of the way go first. """
+        while moves:
+            blocked = [(member, loc) for member, loc in moves
+                       if pla.get_occupant(*loc) is not None]
+            if len(blocked) == len(moves):
+                break
+            for member, loc in moves:
+                if (member, loc) not in blocked:
+                    member.step_to(loc)
+            moves = blocked
+
+    def step_to(self, loc):
+        """ Move the subject to an adjacent location. """
+        dx = loc[0] - self.subject.x
+        dy = loc[1] - self.subject.y
+        logger.debug('move {} {}'.format(dx, dy))
+        try:
+            self.session.hax2.move_being_on_map(self.subject, dx, dy)
+        except executor.Occupied:
+            pass
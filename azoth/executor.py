@@ -1,6 +1,12 @@
 """ Transactions: hooked functions that modify more than one object. """
 
+import array
 import collections
+import config
+import lru
+import path
+import perception
+import place
 
 PASS_NONE = -1
 PASS_DEF = 0
@@ -74,22 +80,173 @@ class DoesNotHaveError(RuleError):
         return "{} does not have {}".format(self.subject, self.item)
 
 
+class CostGrid(object):
+    """ The movement cost of every tile of a place for one movement mode,
+    compiled from the ruleset's passability map into a flat row-major array
+    ('costs', indexed by y * width + x). Impassable tiles hold PASS_NONE. The
+    grid follows terrain changes in the place through its 'terrain' hook, and
+    'version' is bumped on every change so that users can tell when to
+    refresh anything derived from it. """
+
+    def __init__(self, rules, mmode, pla):
+        self.rules = rules
+        self.mmode = mmode
+        self.place = pla
+        self.width = pla.width
+        self.height = pla.height
+        self.version = 0
+        self.rebuild()
+        pla.on('terrain', self.on_terrain_changed)
+
+    def _id_costs(self):
+        """ Return the cost of each terrain in the place's palette. """
+        return [self.rules.get_pclass_cost(self.mmode, getattr(ter, 'pclass',
+                                                               None))
+                for ter in self.place.palette]
+
+    def rebuild(self):
+        """ Recompile the whole grid. """
+        id_costs = self._id_costs()
+        self.costs = array.array('h', [id_costs[i] for i in
+                                       self.place.terrain_ids])
+        self.version += 1
+
+    def on_terrain_changed(self, x, y, width, height):
+        """ Recompile the costs of a region after its terrain changed. """
+        id_costs = self._id_costs()
+        ids = self.place.terrain_ids
+        for row in xrange(y, y + height):
+            start = row * self.width + x
+            self.costs[start:start + width] = array.array(
+                'h', [id_costs[i] for i in ids[start:start + width]])
+        self.version += 1
+
+    def get(self, x, y):
+        """ Return the cost of x, y. Raises OffMapError if it is not on the
+        map. """
+        if not self.place.onmap(x, y):
+            raise place.OffMapError(self.place, x, y)
+        return self.costs[y * self.width + x]
+
+    def passable(self, x, y):
+        """ Return True iff x, y is on the map and passable. """
+        return 0 <= x < self.width and 0 <= y < self.height and \
+            self.costs[y * self.width + x] != PASS_NONE
+
+    def close(self):
+        """ Stop following terrain changes. """
+        self.place.un('terrain', self.on_terrain_changed)
+
+
 class Ruleset(object):
     """ The ruleset registers transaction hooks that enforce the rules that
     affect the legality and outcomes of basic things like movement. """
 
     def __init__(self):
         self.pmap = collections.defaultdict(dict)
+        self.grids = {}
+        self.fields = lru.LRU(config.FLOW_FIELD_CACHE_SIZE)
+        self.paths = {}
+        self.regions = {}
+        self.perceptions = {}
+
+    def __getstate__(self):
+        """ Leave out the compiled grids, flow fields, path caches, regions
+        and perceptions when saving. """
+        state = dict(self.__dict__)
+        del state['grids']
+        del state['fields']
+        del state['paths']
+        del state['regions']
+        del state['perceptions']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.grids = {}
+        self.fields = lru.LRU(config.FLOW_FIELD_CACHE_SIZE)
+        self.paths = {}
+        self.regions = {}
+        self.perceptions = {}
 
     def set_passability(self, mmode, pclass, val):
         """ Set passability for mmode over pclass. """
         self.pmap[mmode][pclass] = val
+        for (grid_mmode, pla), grid in self.grids.items():
+            if grid_mmode == mmode:
+                grid.rebuild()
+        for cache in self.paths.values():
+            cache.clear()
+
+    def get_pclass_cost(self, mmode, pclass):
+        """ Return the movement cost of mmode over pclass. """
+        return self.pmap.get(mmode, {}).get(pclass, PASS_DEF)
+
+    def get_cost_grid(self, mmode, pla):
+        """ Return the CostGrid of mmode over pla, compiling it on first
+        use. """
+        try:
+            return self.grids[(mmode, pla)]
+        except KeyError:
+            grid = CostGrid(self, mmode, pla)
+            self.grids[(mmode, pla)] = grid
+            return grid
+
+    def get_flow_field(self, mmode, pla, dst, radius):
+        """ Return a path.flow_field() toward dst over the cost grid of mmode
+        over pla. The fields last asked for are kept, by mmode, place, dst
+        and radius, until the terrain changes, so all the followers of one
+        target share one, and the followers of different targets do not
+        trample each other's. """
+        key = (mmode, pla, dst, radius)
+        try:
+            field = self.fields.lookup(key)
+        except KeyError:
+            field = None
+        if field is None or not field.is_current():
+            field = path.flow_field(self.get_cost_grid(mmode, pla), dst,
+                                    radius)
+            self.fields.put(key, field)
+        return field
+
+    def get_regions(self, mmode, pla):
+        """ Return the path.Regions of the cost grid of mmode over pla,
+        labelling them on first use. """
+        try:
+            return self.regions[(mmode, pla)]
+        except KeyError:
+            regions = path.Regions(self.get_cost_grid(mmode, pla))
+            self.regions[(mmode, pla)] = regions
+            return regions
+
+    def get_path_cache(self, pla, size):
+        """ Return the path.PathCache of pla, making it on first use. """
+        try:
+            return self.paths[pla]
+        except KeyError:
+            cache = path.PathCache(pla, size)
+            self.paths[pla] = cache
+            return cache
+
+    def get_perception(self, pla):
+        """ Return the perception.Perception of pla, making it on first
+        use. """
+        try:
+            return self.perceptions[pla]
+        except KeyError:
+            seer = perception.Perception(pla)
+            self.perceptions[pla] = seer
+            return seer
+
+    def end_turn(self):
+        """ Forget what was only good for the turn that has ended. """
+        for seer in self.perceptions.values():
+            seer.end_turn()
 
     def assert_passable(self, obj, pla, x, y):
         """ Raise Impassable if terrain at loc is impassable to obj. """
-        ter = pla.get_terrain(x, y)
-        penalty = self.pmap.get(obj.mmode, {}).get(ter.pclass, PASS_DEF)
-        if penalty == PASS_NONE:
+        if self.get_cost_grid(obj.mmode, pla).get(x, y) == PASS_NONE:
+            ter = pla.get_terrain(x, y)
             raise Impassable(obj, ter.name, pla, x, y)
 
     @staticmethod
@@ -136,8 +293,7 @@ class Ruleset(object):
                     yield x, y
 
     def get_movement_cost(self, mmode, pla, x, y):
-        ter = pla.get_terrain(x, y)
-        return self.pmap.get(mmode, {}).get(ter.pclass, PASS_DEF)
+        return self.get_cost_grid(mmode, pla).get(x, y)
 
 
 class Executor(object):
@@ -0,0 +1,227 @@
+"""
+Field of view.
+
+An algorithm takes a 2d numpy bool array, indexed [y, x], of the tiles that
+do not block sight (such as the 'clear' of a place.Transparency), the
+viewer's x, y, a radius and whether walls at the edge of sight are lit, and
+returns a Fov of what the viewer sees. The in-tree one is recursive
+shadowcasting in plain Python; libtcod's are offered as well when libtcod
+can be loaded. config.FOV_ALGORITHM picks the one compute() uses, and a
+FovCache keeps the views from the last few spots for reuse.
+"""
+
+import config
+import logging
+import lru
+import numpy
+import time
+from tcodlib import libtcod
+
+logger = logging.getLogger('fov')
+
+# The transforms from octant (column, row) offsets to map offsets, as
+# (xx, xy, yx, yy), for the eight octants around the viewer.
+_OCTANTS = [(1, 0, 0, 1), (0, 1, 1, 0), (0, -1, 1, 0), (-1, 0, 0, 1),
+            (-1, 0, 0, -1), (0, -1, -1, 0), (0, 1, -1, 0), (1, 0, 0, -1)]
+
+
+class Fov(object):
+    """
+    The tiles visible from x, y within radius: 'visible' is a 2d numpy bool
+    array, indexed [y, x], over the window of the map with its top left at
+    left, top. Tiles outside the window are not visible.
+    """
+
+    def __init__(self, x, y, radius, left, top, visible):
+        self.x = x
+        self.y = y
+        self.radius = radius
+        self.left = left
+        self.top = top
+        self.visible = visible
+
+    def is_visible(self, x, y):
+        """ Return True iff x, y is in view. """
+        x -= self.left
+        y -= self.top
+        height, width = self.visible.shape
+        return 0 <= x < width and 0 <= y < height and bool(self.visible[y, x])
+
+
+def window(transparent, x, y, radius):
+    """ Return the left, top, right and bottom of the square around x, y out
+    to radius, clipped to the map. """
+    height, width = transparent.shape
+    return (max(0, x - radius), max(0, y - radius),
+            min(width, x + radius + 1), min(height, y + radius + 1))
+
+
+def shadowcast(transparent, x, y, radius, light_walls=True):
+    """ Return the Fov from x, y by recursive shadowcasting. Tiles are in
+    range when their distance from the viewer is at most radius. """
+    left, top, right, bottom = window(transparent, x, y, radius)
+    clear = transparent[top:bottom, left:right].tolist()
+    lit = [[False] * (right - left) for row in clear]
+    cx = x - left
+    cy = y - top
+    lit[cy][cx] = True
+    for xx, xy, yx, yy in _OCTANTS:
+        _cast(clear, lit, cx, cy, 1, 1.0, 0.0, radius, xx, xy, yx, yy,
+              light_walls)
+    return Fov(x, y, radius, left, top, numpy.array(lit, dtype=bool))
+
+
+def _cast(clear, lit, cx, cy, row, start, end, radius, xx, xy, yx, yy,
+          light_walls):
+    """ Light the tiles of one octant, from 'row' out to radius, between the
+    'start' and 'end' slopes, recursing past each wall into the part of the
+    octant it leaves open. """
+    if start < end:
+        return
+    height = len(clear)
+    width = len(clear[0])
+    limit = radius * radius
+    new_start = start
+    for j in xrange(row, radius + 1):
+        dx = -j - 1
+        dy = -j
+        blocked = False
+        while dx <= 0:
+            dx += 1
+            mx = cx + dx * xx + dy * xy
+            my = cy + dx * yx + dy * yy
+            l_slope = (dx - 0.5) / (dy + 0.5)
+            r_slope = (dx + 0.5) / (dy - 0.5)
+            if start < r_slope:
+                continue
+            if end > l_slope:
+                break
+            onmap = 0 <= mx < width and 0 <= my < height
+            opaque = not onmap or not clear[my][mx]
+            if onmap and dx * dx + dy * dy <= limit and \
+                    (light_walls or not opaque):
+                lit[my][mx] = True
+            if blocked:
+                if opaque:
+                    new_start = r_slope
+                else:
+                    blocked = False
+                    start = new_start
+            elif opaque and j < radius:
+                blocked = True
+                _cast(clear, lit, cx, cy, j + 1, start, l_slope, radius,
+                      xx, xy, yx, yy, light_walls)
+                new_start = r_slope
+        if blocked:
+            break
+
+
+class LibtcodFov(object):
+    """
+    One of libtcod's algorithms, as a field of view algorithm.
+
+    libtcod keeps the transparency in a map of its own, so the map keeps a
+    numpy copy of what it holds and each call only sets the tiles of the
+    viewer's window that differ.
+    """
+
+    def __init__(self, algo):
+        self.algo = algo
+        self.map = None
+        self.clear = None
+
+    def __del__(self):
+        if self.map is not None and libtcod is not None:
+            libtcod.map_delete(self.map)
+
+    def sync(self, transparent, left, top, right, bottom):
+        """ Bring the window of the libtcod map up to date. """
+        if self.clear is None or self.clear.shape != transparent.shape:
+            if self.map is not None:
+                libtcod.map_delete(self.map)
+            height, width = transparent.shape
+            self.map = libtcod.map_new(width, height)
+            libtcod.map_clear(self.map, False, False)
+            self.clear = numpy.zeros(transparent.shape, dtype=bool)
+        new = transparent[top:bottom, left:right]
+        old = self.clear[top:bottom, left:right]
+        for y, x in zip(*numpy.nonzero(new != old)):
+            libtcod.map_set_properties(self.map, int(x + left), int(y + top),
+                                       bool(new[y, x]), False)
+        old[...] = new
+
+    def __call__(self, transparent, x, y, radius, light_walls=True):
+        left, top, right, bottom = window(transparent, x, y, radius)
+        self.sync(transparent, left, top, right, bottom)
+        libtcod.map_compute_fov(self.map, x, y, radius, light_walls,
+                                self.algo)
+        visible = [[libtcod.map_is_in_fov(self.map, mx, my)
+                    for mx in xrange(left, right)]
+                   for my in xrange(top, bottom)]
+        return Fov(x, y, radius, left, top, numpy.array(visible, dtype=bool))
+
+
+# The algorithms available, by name.
+ALGORITHMS = {'shadowcast': shadowcast}
+
+if libtcod is not None:
+    ALGORITHMS['libtcod'] = LibtcodFov(libtcod.FOV_BASIC)
+    ALGORITHMS['libtcod_shadow'] = LibtcodFov(libtcod.FOV_SHADOW)
+
+
+def compute(transparent, x, y, radius, light_walls=True, algorithm=None):
+    """ Return the Fov from x, y out to radius with the named algorithm, by
+    default config.FOV_ALGORITHM. Algorithms that are not available fall
+    back to shadowcasting. """
+    name = algorithm or config.FOV_ALGORITHM
+    try:
+        algo = ALGORITHMS[name]
+    except KeyError:
+        logger.debug('{} is not available; using shadowcast'.format(name))
+        algo = shadowcast
+    return algo(transparent, x, y, radius, light_walls)
+
+
+class FovCache(object):
+    """
+    A least-recently-used cache of the fields of view over a
+    place.Transparency, keyed by viewpoint, radius, algorithm and the version
+    of the transparency around the viewpoint, so a view is only computed
+    again once the terrain within its reach has changed. The views are
+    shared, and must not be modified.
+
+    'hits', 'misses' and 'evictions' count what has happened to lookups,
+    and 'seconds' is the time spent computing the misses, for telling whether
+    the cache pays its way.
+    """
+
+    def __init__(self, transparency, size):
+        self.transparency = transparency
+        self.entries = lru.LRU(size)
+        self.hits = 0
+        self.misses = 0
+        self.seconds = 0.0
+
+    @property
+    def evictions(self):
+        """ The entries dropped to make room. """
+        return self.entries.evictions
+
+    def compute(self, x, y, radius, light_walls=True, algorithm=None):
+        """ Return the Fov as compute() would. """
+        name = algorithm or config.FOV_ALGORITHM
+        clear = self.transparency.clear
+        version = self.transparency.region_version(*window(clear, x, y,
+                                                           radius))
+        key = (x, y, radius, light_walls, name, version)
+        try:
+            view = self.entries.lookup(key)
+        except KeyError:
+            self.misses += 1
+            start = time.time()
+            view = compute(clear, x, y, radius, light_walls, name)
+            self.seconds += time.time() - start
+            self.entries.put(key, view)
+        else:
+            self.hits += 1
+        return view
@@ -6,7 +6,7 @@ import animation
 import colors
 import config
 import event
-import libtcodpy as libtcod
+import fov
 import logging
 import os
 import pygame
@@ -16,7 +16,6 @@ import threading
 
 
 FOV_LIGHT_WALLS = True
-FOV_ALGO = 0  # default
 
 
 class Window(object):
@@ -819,14 +818,16 @@ class PlaceWindow(Window):
         self.rows = int(self.height / self.cell_height)
         self.view = pygame.Rect(0, 0, self.columns, self.rows)
         self.place_rect = pygame.Rect(0, 0, self.place.width, self.place.height)
+        # tiles to shade, such as those explored by a path search
+        self.marked = None
+        self.mark = pygame.Surface((spr.width, spr.height),
+                                   flags=pygame.SRCALPHA)
+        self.mark.fill(pygame.Color(255, 255, 0, 64))
         # experiment with a fov (aka los) map
         self.fade = sprite.Fade(spr.width, spr.height).surf
-        self.fov_map = libtcod.map_new(self.place.width, self.place.height)
-        for y in range(self.place.height):
-            for x in range(self.place.width):
-                ter = self.place.get_terrain(x, y)
-                libtcod.map_set_properties(self.fov_map, x, y, 
-                                           not ter.blocks_sight, False)
+        self.transparency = self.place.get_transparency()
+        self.fov_cache = fov.FovCache(self.transparency, config.FOV_CACHE_SIZE)
+        self.fov = None
 
     def on_paint(self):
         # This assumes the lock has been acquired.
@@ -834,11 +835,12 @@ class PlaceWindow(Window):
         self.surface.fill(self.background_color)
 
         # pass 1 - terrain
+        marked = self.marked
         tile = pygame.Rect(0, 0, self.cell_width, self.cell_height)
         for map_y in xrange(self.view.top, self.view.bottom):
             tile.left = 0
             for map_x in xrange(self.view.left, self.view.right):
-                visible = libtcod.map_is_in_fov(self.fov_map, map_x, map_y)
+                visible = self.in_fov(map_x, map_y)
                 explored = self.place.get_explored(map_x, map_y)
                 if visible or explored:
                     terrain = self.place.get_terrain(map_x, map_y)
@@ -847,8 +849,8 @@ class PlaceWindow(Window):
                                       tile.topleft)
                     if not visible:
                         self.surface.blit(self.fade, tile.topleft)  # haze
-                    else:
-                        self.place.set_explored(map_x, map_y, True)
+                    if marked and (map_x, map_y) in marked:
+                        self.surface.blit(self.mark, tile.topleft)
                 tile.left += tile.width
             tile.top += tile.height
 
@@ -857,7 +859,7 @@ class PlaceWindow(Window):
         for map_y in xrange(self.view.top, self.view.bottom):
             tile.left = 0
             for map_x in xrange(self.view.left, self.view.right):
-                visible = libtcod.map_is_in_fov(self.fov_map, map_x, map_y)
+                visible = self.in_fov(map_x, map_y)
                 if visible:
                     items = self.place.get_items(map_x, map_y)
                     for item in items:
@@ -873,7 +875,7 @@ class PlaceWindow(Window):
         for map_y in xrange(self.view.top, self.view.bottom):
             tile.left = 0
             for map_x in xrange(self.view.left, self.view.right):
-                visible = libtcod.map_is_in_fov(self.fov_map, map_x, map_y)
+                visible = self.in_fov(map_x, map_y)
                 if visible:
                     occupant = self.place.get_occupant(map_x, map_y)
                     if occupant:
@@ -886,8 +888,13 @@ class PlaceWindow(Window):
         self.log.debug('paint done')
 
     def compute_fov(self, x, y, radius):
-        libtcod.map_compute_fov(self.fov_map, x, y, radius, FOV_LIGHT_WALLS,
-                                FOV_ALGO)
+        """ Look from x, y, and explore whatever comes into view. """
+        self.fov = self.fov_cache.compute(x, y, radius, FOV_LIGHT_WALLS)
+        cache = self.fov_cache
+        self.log.debug('fov cache: {} hits, {} misses, {:.1f}ms computing'
+                       .format(cache.hits, cache.misses,
+                               1000 * cache.seconds))
+        self.place.explore(self.fov.left, self.fov.top, self.fov.visible)
 
     def scroll_up(self):
         if self.view.top > 0:
@@ -912,7 +919,7 @@ class PlaceWindow(Window):
         return map_x, map_y
 
     def in_fov(self, map_x, map_y):
-        return libtcod.map_is_in_fov(self.fov_map, map_x, map_y)
+        return self.fov is not None and self.fov.is_visible(map_x, map_y)
 
     def explored(self, map_x, map_y):
         return self.place.get_explored(map_x, map_y)
@@ -996,6 +1003,7 @@ class SessionViewer(Viewer):
                                 cmp=lambda x, y: cmp(x.subject.order, 
                                                      y.subject.order)):
                 actor.do_turn(self)
+            self.session.rules.end_turn()
             self.on_loop_finish()
 
     def on_loop_finish(self):
@@ -1007,7 +1015,7 @@ class SessionViewer(Viewer):
         """ Handle a key to control the subject during its turn. Raises Handled
         when done. """
         # Cancel pathfinding on any keystroke
-        self.controller.path = None
+        self.controller.cancel_path()
         handler = {
             pygame.K_DOWN: lambda: self.controller.move(0, 1),
             pygame.K_UP: lambda: self.controller.move(0, -1),
@@ -1028,7 +1036,12 @@ class SessionViewer(Viewer):
         if not self.map.explored(*dst):
             self.console.error('Not in view!')
         else:
-            if not self.controller.pathfind_to(*dst):
+            found = self.controller.pathfind_to(*dst)
+            if config.PATHFIND_STATS:
+                stats = self.controller.stats
+                self.map.marked = stats.explored if stats is not None \
+                    else None
+            if not found:
                 self.console.error('No path!')
             else:
                 if self.session.world.get_items(*dst):
@@ -0,0 +1,233 @@
+"""
+Hierarchical pathfinding (HPA*) over the sectors of a place.World.
+
+The tiles where a route can cross from one sector into the next are the
+nodes of an abstract graph. The costs of the routes between the nodes of each
+sector are precomputed, so a long path is found by searching the small
+abstract graph first and then refining only the sectors along the route.
+"""
+
+import config
+import heapq
+import itertools
+import path
+
+# Entrances narrower than this get a single transition in the middle.
+# Wider ones get one at each end and more spaced this far apart in between,
+# which keeps the detours to reach a transition short.
+TRANSITION_SPACING = 8
+
+
+class SectorGraph(object):
+    """
+    The abstract graph of a World for one movement mode.
+
+    Border transitions and intra-sector route costs are computed the first
+    time a sector is searched and cached. Each cache entry remembers the cost
+    grids (and their versions) it was computed from, so a terrain or
+    passability change in a sector invalidates only that sector and the
+    borders it shares with its neighbors.
+    """
+
+    def __init__(self, world, rules, mmode):
+        self.world = world
+        self.rules = rules
+        self.mmode = mmode
+        self.size = config.SECTOR_SIZE
+        self.borders = {}
+        self.sectors = {}
+
+    def get_grid(self, sx, sy):
+        """ Return the cost grid of the sector at sx, sy. """
+        return self.rules.get_cost_grid(self.mmode,
+                                        self.world.get_sector(sx, sy))
+
+    def sector_of(self, loc):
+        """ Return the sector coordinates of a tile. """
+        return loc[0] // self.size, loc[1] // self.size
+
+    def get_transitions(self, sx, sy, east):
+        """ Return the (a, b) tile pairs where a route can cross from the
+        sector at sx, sy into its neighbor to the east (or the south if not
+        'east'). """
+        other = (sx + 1, sy) if east else (sx, sy + 1)
+        grid_a = self.get_grid(sx, sy)
+        grid_b = self.get_grid(*other)
+        key = (grid_a, grid_a.version, grid_b, grid_b.version)
+        cached = self.borders.get((sx, sy, east))
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        last = self.size - 1
+        runs = []
+        run = []
+        for i in range(self.size):
+            if east:
+                open_ = grid_a.passable(last, i) and grid_b.passable(0, i)
+            else:
+                open_ = grid_a.passable(i, last) and grid_b.passable(i, 0)
+            if open_:
+                run.append(i)
+            elif run:
+                runs.append(run)
+                run = []
+        if run:
+            runs.append(run)
+
+        transitions = []
+        for run in runs:
+            if len(run) < TRANSITION_SPACING:
+                crossings = [run[len(run) // 2]]
+            else:
+                crossings = run[:-1:TRANSITION_SPACING] + [run[-1]]
+            for i in crossings:
+                if east:
+                    a = (sx * self.size + last, sy * self.size + i)
+                    b = (a[0] + 1, a[1])
+                else:
+                    a = (sx * self.size + i, sy * self.size + last)
+                    b = (a[0], a[1] + 1)
+                transitions.append((a, b))
+        self.borders[(sx, sy, east)] = (key, transitions)
+        return transitions
+
+    def get_links(self, sx, sy):
+        """ Return {node: [tiles across the border]} for the entrance nodes
+        of the sector at sx, sy. """
+        links = {}
+        if sx + 1 < self.world.width:
+            for a, b in self.get_transitions(sx, sy, True):
+                links.setdefault(a, []).append(b)
+        if sy + 1 < self.world.height:
+            for a, b in self.get_transitions(sx, sy, False):
+                links.setdefault(a, []).append(b)
+        if sx > 0:
+            for a, b in self.get_transitions(sx - 1, sy, True):
+                links.setdefault(b, []).append(a)
+        if sy > 0:
+            for a, b in self.get_transitions(sx, sy - 1, False):
+                links.setdefault(b, []).append(a)
+        return links
+
+    def get_edges(self, sx, sy):
+        """ Return {node: {node: cost}} of the cheapest routes inside the
+        sector at sx, sy between its entrance nodes. """
+        links = self.get_links(sx, sy)
+        grid = self.get_grid(sx, sy)
+        key = (grid, grid.version, frozenset(links))
+        cached = self.sectors.get((sx, sy))
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        ox = sx * self.size
+        oy = sy * self.size
+        nodes = list(links)
+        fields = path.distance_fields(path.cost_array(grid),
+                                      [(x - ox, y - oy) for x, y in nodes])
+        edges = {}
+        for i, node in enumerate(nodes):
+            edges[node] = {}
+            for other in nodes:
+                cost = fields[i, other[1] - oy, other[0] - ox]
+                if other != node and cost < path.INFINITY:
+                    edges[node][other] = int(cost)
+        self.sectors[(sx, sy)] = (key, edges)
+        return edges
+
+    def _local_costs(self, loc, also=None, reverse=False):
+        """ Return {tile: cost} of the routes from loc to the entrance nodes
+        of its sector and to 'also' (or from them to loc if 'reverse'). """
+        sx, sy = self.sector_of(loc)
+        ox = sx * self.size
+        oy = sy * self.size
+        grid = self.get_grid(sx, sy)
+        field = path.distance_fields(path.cost_array(grid),
+                                     [(loc[0] - ox, loc[1] - oy)],
+                                     reverse=reverse)[0]
+        tiles = list(self.get_links(sx, sy))
+        if also is not None and self.sector_of(also) == (sx, sy):
+            tiles.append(also)
+        costs = {}
+        for x, y in tiles:
+            cost = field[y - oy, x - ox]
+            if cost < path.INFINITY:
+                costs[(x, y)] = int(cost)
+        return costs
+
+    def _enter_cost(self, loc):
+        """ Return the cost of stepping onto loc. """
+        sx, sy = self.sector_of(loc)
+        grid = self.get_grid(sx, sy)
+        return grid.costs[(loc[1] - sy * self.size) * grid.width +
+                          loc[0] - sx * self.size] + 1
+
+    def find_abstract(self, src, dst):
+        """ Return the list of nodes of the cheapest route from src to dst
+        over the abstract graph, including src and dst, or [] if there is
+        none. """
+        src_costs = self._local_costs(src, also=dst)
+        dst_costs = self._local_costs(dst, reverse=True)
+        pq = []
+        counter = itertools.count()
+        costs = {src: 0}
+        parents = {src: None}
+        closed = set()
+        # Ties go to the deepest node; on open ground every node between src
+        # and dst has the same priority, and expanding them breadth-first
+        # would build every sector in the rectangle.
+        heapq.heappush(pq, (path.manhattan(src, dst), 0, next(counter), src))
+        while pq:
+            node = heapq.heappop(pq)[-1]
+            if node in closed:
+                continue
+            closed.add(node)
+            if node == dst:
+                nodes = []
+                while node is not None:
+                    nodes.append(node)
+                    node = parents[node]
+                nodes.reverse()
+                return nodes
+
+            sector = self.sector_of(node)
+            if node == src:
+                edges = dict(src_costs)
+            else:
+                edges = dict(self.get_edges(*sector).get(node, {}))
+                if node in dst_costs and self.sector_of(dst) == sector:
+                    edges[dst] = dst_costs[node]
+            for other in self.get_links(*sector).get(node, ()):
+                edges[other] = self._enter_cost(other)
+
+            for other, cost in edges.items():
+                if other in closed:
+                    continue
+                cost += costs[node]
+                if cost >= costs.get(other, cost + 1):
+                    continue
+                costs[other] = cost
+                parents[other] = node
+                heapq.heappush(pq, (cost + path.manhattan(other, dst), -cost,
+                                    next(counter), other))
+        return []
+
+    def find(self, src, dst):
+        """ Return a path from src to dst (in world tile coordinates) in the
+        same form as path.find(), or [] if there is none. Only the sectors
+        along the abstract route are searched tile by tile. """
+        if src == dst:
+            return []
+        nodes = self.find_abstract(src, dst)
+        result = []
+        for a, b in zip(nodes, nodes[1:]):
+            sector = self.sector_of(a)
+            if sector != self.sector_of(b):
+                result.append(b)
+                continue
+            ox = sector[0] * self.size
+            oy = sector[1] * self.size
+            grid = self.get_grid(*sector)
+            steps = path.find_on_grid(grid, (a[0] - ox, a[1] - oy),
+                                      (b[0] - ox, b[1] - oy),
+                                      max_depth=grid.width * grid.height)
+            result.extend((x + ox, y + oy) for x, y in steps)
+        return result
@@ -0,0 +1,49 @@
+"""
+The least-recently-used table behind the runtime caches (path.PathCache,
+fov.FovCache and the flow fields of executor.Ruleset).
+"""
+
+import collections
+
+
+class LRU(object):
+    """
+    A table of at most 'size' entries. lookup() and put() make an entry the
+    most recently used, and put() drops the least recently used ones to make
+    room, counting them in 'evictions'.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, key):
+        """ Return the value of key, or raise KeyError. """
+        value = self.entries.pop(key)
+        self.entries[key] = value
+        return value
+
+    def put(self, key, value):
+        """ Set the value of key. """
+        self.entries.pop(key, None)
+        self.entries[key] = value
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        """ Remove key and return its value, or default. """
+        return self.entries.pop(key, default)
+
+    def items(self):
+        """ Return a list of the (key, value) pairs, least recently used
+        first. """
+        return self.entries.items()
+
+    def clear(self):
+        """ Remove every entry. """
+        self.entries.clear()
@@ -1,7 +1,14 @@
 """
 Pathfinding.
 """
+import array
+import collections
 import heapq
+import itertools
+import lru
+import numpy
+import time
+import weakref
 
 
 class Step(object):
@@ -26,7 +33,102 @@ class Step(object):
 directions = ((-1, 0), (1, 0), (0, -1), (0, 1))
 
 
-def find(src, dst, neighbors, heuristic, max_depth=100):
+class SearchStats(object):
+    """
+    Instrumentation for one search. Pass one as 'stats' to find(),
+    search(), jump_point_search(), find_on_grid() or search_on_grid() and it
+    is filled in as the search runs; without one the searches run exactly
+    as they would otherwise.
+
+    'pushed' and 'popped' count open-list operations, stale entries
+    included; 'reopened' counts the pushes for locations that were already
+    on the open list, because a cheaper route to them turned up. 'expanded'
+    is the number of locations expanded. 'calls' and 'times' hold the
+    number of calls to, and seconds spent in, each callback ('neighbors',
+    'heuristic' or, for jump point search, 'jump'), plus the seconds spent
+    on the 'heap' and in the search as a whole ('total', which leaves out
+    the time a sliced search spends waiting for its next slice).
+
+    If 'explored' is True then the 'explored' set gets the locations that
+    were expanded, for showing on the map, when the search is done.
+    """
+
+    def __init__(self, explored=False):
+        self.pushed = 0
+        self.popped = 0
+        self.reopened = 0
+        self.expanded = 0
+        self.calls = collections.Counter()
+        self.times = collections.Counter()
+        self.explored = set() if explored else None
+        self.started = None
+
+    def __str__(self):
+        return ('expanded={} pushed={} popped={} reopened={} calls={} '
+                'times={}').format(
+                    self.expanded, self.pushed, self.popped, self.reopened,
+                    dict(self.calls),
+                    dict((k, round(v, 6)) for k, v in self.times.items()))
+
+    def heap(self, locate):
+        """ Return counting, timed replacements for heapq.heappush() and
+        heapq.heappop() on an open list where locate(entry) gives the
+        location of an entry. """
+        opened = set()
+
+        def push(pq, entry):
+            start = time.time()
+            heapq.heappush(pq, entry)
+            self.times['heap'] += time.time() - start
+            self.pushed += 1
+            loc = locate(entry)
+            if loc in opened:
+                self.reopened += 1
+            else:
+                opened.add(loc)
+
+        def pop(pq):
+            start = time.time()
+            entry = heapq.heappop(pq)
+            self.times['heap'] += time.time() - start
+            self.popped += 1
+            return entry
+
+        return push, pop
+
+    def timed(self, name, callback, drain=False):
+        """ Return a counting, timed replacement for a callback. If 'drain'
+        then the callback returns an iterator, which is run out inside the
+        timing. """
+        def wrapper(*args):
+            start = time.time()
+            result = callback(*args)
+            if drain:
+                result = list(result)
+            self.times[name] += time.time() - start
+            self.calls[name] += 1
+            return result
+        return wrapper
+
+    def start(self):
+        """ Note that the search is starting or resuming. """
+        self.started = time.time()
+
+    def stop(self):
+        """ Note that the search is pausing or done. """
+        self.times['total'] += time.time() - self.started
+
+    def finish(self, expanded):
+        """ Note that the search is done, having expanded the locations in
+        'expanded'. """
+        self.stop()
+        expanded = list(expanded)
+        self.expanded = len(expanded)
+        if self.explored is not None:
+            self.explored.update(expanded)
+
+
+def find(src, dst, neighbors, heuristic, max_depth=100, stats=None):
     """ 
     Find a path on a grid from 'src' to 'dst' using 'is_valid' to filter
     locations and 'heuristic' to judge the value of a location; if a path cannot
@@ -42,53 +144,1234 @@ def find(src, dst, neighbors, heuristic, max_depth=100):
     go negative.)  Cost is the incremental cost of stepping on the current
     location, and could also include risk factors for anything undesirable on
     the step.
+
+    The open list is a binary heap with lazy deletion: when a better route to
+    a location is found the new step is simply pushed, and the stale entry is
+    skipped when it surfaces. Expanded locations go in a closed set and are
+    never expanded again.
+
+    'stats' is an optional SearchStats to fill in.
     """
+    for done, path in search(src, dst, neighbors, heuristic, max_depth,
+                             stats=stats):
+        pass
+    return path
+
+
+def _steps_to(step):
+    """ Return the locations on the way to a Step, not counting the
+    start. """
+    path = []
+    while step.nextstep is not None:
+        path.append(step.loc)
+        step = step.nextstep
+    path.reverse()
+    return path
+
+
+def search(src, dst, neighbors, heuristic, max_depth=100, batch=None,
+           stats=None):
+    """
+    Run the search of find() as a generator that yields (done, path) pairs.
+    If 'batch' is given then after every 'batch' locations expanded it yields
+    (False, path) with the best partial path so far: the path to the
+    expanded location that the heuristic rates nearest to dst. The last pair
+    is (True, path) with the same result that find() would return.
+    """
+    push = heapq.heappush
+    pop = heapq.heappop
+    if stats is not None:
+        stats.start()
+        push, pop = stats.heap(lambda entry: entry[2].loc)
+        neighbors = stats.timed('neighbors', neighbors, drain=True)
+        heuristic = stats.timed('heuristic', heuristic)
     pq = []
     found = {}
+    closed = set()
+    counter = itertools.count()
     nearness, cost = heuristic(src, dst)
     step = Step(src, nearness)
-    heapq.heappush(pq, (step.nearness, step))
+    push(pq, (step.nearness, next(counter), step))
     found[src] = step
+    best = step
+    expanded = 0
     while pq:
-        priority, step = heapq.heappop(pq)
+        priority, _, step = pop(pq)
+
+        # Skip stale entries and locations that were already expanded.
+        if step.loc in closed or found[step.loc] is not step:
+            continue
+        closed.add(step.loc)
 
         # Check if goal reached.
         if step.loc == dst:
-            path = []
-            path.append(step)
-            while step.nextstep is not None:
-                step = step.nextstep
-                path.append(step)
-            path.pop()  # discard the starting tile
-            return [x.loc for x in reversed(path)]
+            if stats is not None:
+                stats.finish(closed)
+            yield True, _steps_to(step)
+            return
+
+        # Keep track of the best partial path, and take a break if it is
+        # time.
+        if (step.nearness - step.cost, step.cost) < \
+                (best.nearness - best.cost, best.cost):
+            best = step
+        expanded += 1
+        if batch is not None and expanded % batch == 0:
+            if stats is not None:
+                stats.stop()
+            yield False, _steps_to(best)
+            if stats is not None:
+                stats.start()
 
         # Check if path too long.
         if step.depth == max_depth:
             continue
 
-        # Schedule the four neighbors, if valid
+        # Schedule the neighbors
         for newloc in neighbors(step.loc):
+            if newloc in closed:
+                continue
             nearness, cost = heuristic(newloc, dst)
             cost += step.cost
             nearness += cost
-            # Check if we already have a route here
+            # Check if we already have a route here that is at least as good.
             old = found.get(newloc, None)
-            if old is not None:
-                if nearness > old.nearness:
-                    # The old one is better so ignore the new one.
-                    continue
-                else:
-                    # The new one is better so discard the old one.
-                    try:
-                        index = pq.index((old.nearness, old) )
-                        del pq[index]
-                    except ValueError:
-                        pass
-
+            if old is not None and nearness >= old.nearness:
+                continue
             newstep = Step(newloc, nearness=nearness, cost=cost, nextstep=step)
-            heapq.heappush(pq, (newstep.nearness, newstep))
+            push(pq, (newstep.nearness, next(counter), newstep))
             found[newloc] = newstep
 
     # No path found
+    if stats is not None:
+        stats.finish(closed)
+    yield True, []
+
+
+def manhattan(loc, dst):
+    """ Return the city-block distance between two locations. """
+    return abs(dst[0] - loc[0]) + abs(dst[1] - loc[1])
+
+
+def _next_true(stops, axis):
+    """ For every cell, return the index along 'axis' of the first True in
+    'stops' at or after it. """
+    size = stops.shape[axis]
+    index = numpy.arange(size).reshape((-1, 1) if axis == 0 else (1, -1))
+    index = numpy.where(stops, index, size)
+    flip = [slice(None)] * 2
+    flip[axis] = slice(None, None, -1)
+    flip = tuple(flip)
+    return numpy.minimum.accumulate(index[flip], axis=axis)[flip]
+
+
+def _prev_true(stops, axis):
+    """ For every cell, return the index along 'axis' of the last True in
+    'stops' at or before it. """
+    index = numpy.arange(stops.shape[axis])
+    index = index.reshape((-1, 1) if axis == 0 else (1, -1))
+    return numpy.maximum.accumulate(numpy.where(stops, index, -1), axis=axis)
+
+
+class JumpTable(object):
+    """
+    Precomputed jumps for Jump Point Search over a 2d array of walls.
+
+    A jump runs in a straight line until it hits a wall (a dead end), the
+    destination, or a tile where the path may have to turn: a horizontal
+    jump stops where a vertical move opens up that was blocked one step
+    back, and a vertical jump also stops where a horizontal jump would find
+    something. All of that is computed for the whole array at once, so each
+    jump during the search is a single lookup.
+    """
+    def __init__(self, walls, dst):
+        height, width = walls.shape
+        # Pad with a border of walls so every tile has four neighbors.
+        walls = numpy.pad(walls, 1, 'constant', constant_values=True)
+        clear = ~walls
+        goal = numpy.zeros_like(walls)
+        goal[dst[1] + 1, dst[0] + 1] = True
+        self.walls = walls
+
+        # Horizontal jumps.
+        right = walls | goal
+        right[1:-1, 1:] |= (clear[:-2, 1:] & walls[:-2, :-1]) | \
+            (clear[2:, 1:] & walls[2:, :-1])
+        left = walls | goal
+        left[1:-1, :-1] |= (clear[:-2, :-1] & walls[:-2, 1:]) | \
+            (clear[2:, :-1] & walls[2:, 1:])
+        rows = numpy.arange(height + 2).reshape(-1, 1)
+        self.right = _next_true(right, 1)
+        self.left = _prev_true(left, 1)
+        found_right = ~walls[rows, self.right]
+        found_left = ~walls[rows, self.left]
+
+        # Vertical jumps.
+        across = numpy.zeros_like(walls)
+        across[:, 1:-1] = found_right[:, 2:] | found_left[:, :-2]
+        down = walls | goal | across
+        down[1:, 1:-1] |= (clear[1:, :-2] & walls[:-1, :-2]) | \
+            (clear[1:, 2:] & walls[:-1, 2:])
+        up = walls | goal | across
+        up[:-1, 1:-1] |= (clear[:-1, :-2] & walls[1:, :-2]) | \
+            (clear[:-1, 2:] & walls[1:, 2:])
+        self.down = _next_true(down, 0)
+        self.up = _prev_true(up, 0)
+
+    def passable(self, x, y):
+        """ Return True iff x, y is inside and not a wall. """
+        return not self.walls[y + 1, x + 1]
+
+    def jump(self, x, y, dx, dy):
+        """ Jump from x, y in direction dx, dy (one of which is zero) and
+        return the jump point, or None if the jump runs into a wall. """
+        x += 1
+        y += 1
+        if dx > 0:
+            x = self.right[y, x]
+        elif dx < 0:
+            x = self.left[y, x]
+        elif dy > 0:
+            y = self.down[y, x]
+        else:
+            y = self.up[y, x]
+        if self.walls[y, x]:
+            return None
+        return int(x) - 1, int(y) - 1
+
+
+def _jump_directions(loc, parent, passable):
+    """ Return the pruned directions to jump in from loc, given the jump
+    point it was reached from. """
+    x, y = loc
+    if parent is None:
+        candidates = directions
+    else:
+        dx = cmp(x, parent[0])
+        dy = cmp(y, parent[1])
+        if dx:
+            candidates = ((0, -1), (0, 1), (dx, 0))
+        else:
+            candidates = ((-1, 0), (1, 0), (0, dy))
+    return [(dx, dy) for dx, dy in candidates if passable(x + dx, y + dy)]
+
+
+def jump_point_search(src, dst, walls, max_depth=100, stats=None,
+                      max_nodes=None):
+    """
+    Find a path from 'src' to 'dst' on a 4-connected grid where every
+    passable tile costs the same, using Jump Point Search. Instead of
+    expanding every tile, it jumps along straight lines and only expands the
+    tiles where the path may have to turn, so open ground costs a handful of
+    expansions instead of thousands.
+
+    'walls' is a 2d numpy bool array indexed [y, x] that is True for the
+    tiles that cannot be entered.
+
+    Returns the path in the same form as find(), or [] if there is no path
+    of at most max_depth steps. If 'max_nodes' is given and the search would
+    have to expand more jump points than that, it gives up and returns None.
+    'stats' is an optional SearchStats to fill in; it counts the jump points
+    expanded, not the tiles jumped over.
+    """
+    height, width = walls.shape
+    if not (0 <= dst[0] < width and 0 <= dst[1] < height) or \
+            walls[dst[1], dst[0]]:
+        return []
+    walls = walls.copy()
+    walls[src[1], src[0]] = False
+    table = JumpTable(walls, dst)
+    push = heapq.heappush
+    pop = heapq.heappop
+    jump = table.jump
+    if stats is not None:
+        stats.start()
+        push, pop = stats.heap(lambda entry: entry[2])
+        jump = stats.timed('jump', jump)
+    pq = []
+    counter = itertools.count()
+    costs = {src: 0}
+    parents = {src: None}
+    closed = set()
+    push(pq, (manhattan(src, dst), next(counter), src))
+    while pq:
+        priority, _, loc = pop(pq)
+        if loc in closed:
+            continue
+        if max_nodes is not None and len(closed) >= max_nodes:
+            if stats is not None:
+                stats.stop()
+            return None
+        closed.add(loc)
+
+        if loc == dst:
+            if stats is not None:
+                stats.finish(closed)
+            path = []
+            while parents[loc] is not None:
+                parent = parents[loc]
+                dx = cmp(loc[0], parent[0])
+                dy = cmp(loc[1], parent[1])
+                while loc != parent:
+                    path.append(loc)
+                    loc = (loc[0] - dx, loc[1] - dy)
+            path.reverse()
+            return path
+
+        for dx, dy in _jump_directions(loc, parents[loc], table.passable):
+            point = jump(loc[0] + dx, loc[1] + dy, dx, dy)
+            if point is None or point in closed:
+                continue
+            cost = costs[loc] + manhattan(loc, point)
+            if cost > max_depth or cost >= costs.get(point, cost + 1):
+                continue
+            costs[point] = cost
+            parents[point] = loc
+            push(pq, (cost + manhattan(point, dst), next(counter), point))
+
+    # No path found
+    if stats is not None:
+        stats.finish(closed)
     return []
-            
+
+
+def cost_array(grid):
+    """ Return the costs of a cost grid as a 2d numpy array indexed [y, x],
+    sharing memory with the grid. """
+    return numpy.frombuffer(grid.costs, dtype=numpy.int16).reshape(
+        grid.height, grid.width)
+
+
+def is_uniform(costs):
+    """ Return True iff all the passable tiles in a 2d numpy array of costs
+    have the same cost. """
+    passable = costs[costs >= 0]
+    return not passable.size or passable.min() == passable.max()
+
+
+# The cost of unreachable tiles in distance fields.
+INFINITY = 1 << 29
+
+# The cost of unreachable tiles in incremental searches.
+UNREACHABLE = float('inf')
+
+
+def distance_fields(costs, starts, reverse=False):
+    """ Return a numpy array indexed [i, y, x] of the costs of the cheapest
+    routes from starts[i] to every tile of a 2d numpy array of costs (or from
+    every tile to starts[i] if 'reverse'), where entering a tile costs its
+    cost plus one, negative costs are impassable and unreachable tiles cost
+    INFINITY. All the fields are relaxed together with whole-array
+    operations until they settle. """
+    height, width = costs.shape
+    walls = numpy.where(costs < 0, INFINITY, 0).astype(numpy.int32)
+    enter = numpy.full((height + 2, width + 2), INFINITY,
+                       dtype=numpy.int32)
+    enter[1:-1, 1:-1] = numpy.maximum(walls, costs + 1)
+    dist = numpy.full((len(starts), height + 2, width + 2),
+                      INFINITY, dtype=numpy.int32)
+    for i, (x, y) in enumerate(starts):
+        dist[i, y + 1, x + 1] = 0
+    inner = dist[:, 1:-1, 1:-1]
+    while True:
+        # A reverse route pays to enter each neighbor; a forward one pays to
+        # enter the tile itself.
+        around = dist + enter if reverse else dist
+        best = numpy.minimum(numpy.minimum(around[:, :-2, 1:-1],
+                                           around[:, 2:, 1:-1]),
+                             numpy.minimum(around[:, 1:-1, :-2],
+                                           around[:, 1:-1, 2:]))
+        if not reverse:
+            best += enter[1:-1, 1:-1]
+        numpy.minimum(best, inner, out=best)
+        numpy.maximum(best, walls, out=best)
+        if (best == inner).all():
+            return inner
+        inner[...] = best
+
+
+# The native search backend, if one has been installed (see tcodpath): an
+# object with these methods, each of which may return None to leave a job to
+# the Python engine.
+#
+# find_uniform(grid, src, dst, blocked, allowed, max_depth) returns what
+# find_on_grid() would, given that every tile that a path of max_depth steps
+# could reach costs the same.
+#
+# flow_field(grid, dst) returns an object that works like a FlowField over
+# the whole grid, given that every passable tile costs the same.
+native = None
+
+
+def _grid_window(grid, src, dst, blocked, allowed, max_depth):
+    """ Return the bounds (left, top, right, bottom) of the part of a cost
+    grid that a path of max_depth steps from src could reach, and a 2d numpy
+    array of the costs and one of the walls inside them, or None if dst is
+    out of reach. """
+    left = max(0, src[0] - max_depth)
+    top = max(0, src[1] - max_depth)
+    right = min(grid.width, src[0] + max_depth + 1)
+    bottom = min(grid.height, src[1] + max_depth + 1)
+    if not (left <= dst[0] < right and top <= dst[1] < bottom):
+        return None
+    costs = cost_array(grid)[top:bottom, left:right]
+    walls = costs < 0
+    if allowed is not None:
+        walls |= ~allowed[top:bottom, left:right]
+    for x, y in blocked:
+        if left <= x < right and top <= y < bottom:
+            walls[y - top, x - left] = True
+    return (left, top, right, bottom), costs, walls
+
+
+class SearchBuffers(object):
+    """
+    The per-tile book-keeping of _search_grid(), in flat arrays indexed by
+    y * width + x: the cost of the best route found to each tile, the index
+    of the tile it came from and its number of steps.
+
+    The arrays outlive a search so that the next one over the same grid can
+    reuse them, and are never cleared: instead each search is numbered, and
+    a tile's 'state' is only current if it carries the number of the search
+    (OPEN) or that plus one (CLOSED).
+    """
+
+    def __init__(self, size):
+        self.g = array.array('i', [0]) * size
+        self.parent = array.array('i', [0]) * size
+        self.depth = array.array('i', [0]) * size
+        self.state = array.array('i', [0]) * size
+        self.number = 0
+
+    def begin(self):
+        """ Start a new search and return its OPEN and CLOSED states. """
+        self.number += 2
+        if self.number >= (1 << 31) - 2:
+            self.state = array.array('i', [0]) * len(self.state)
+            self.number = 2
+        return self.number, self.number + 1
+
+    def path_to(self, i, width):
+        """ Return the locations on the way to tile i, not counting the
+        start. """
+        path = []
+        parent = self.parent
+        while parent[i] >= 0:
+            path.append((i % width, i // width))
+            i = parent[i]
+        path.reverse()
+        return path
+
+
+# Idle SearchBuffers by cost grid.
+_buffers = weakref.WeakKeyDictionary()
+
+
+def _acquire_buffers(grid):
+    """ Return idle SearchBuffers for a grid, making new ones if the others
+    are all in use (say, by a search still running a slice at a time). """
+    idle = _buffers.setdefault(grid, [])
+    if idle:
+        return idle.pop()
+    return SearchBuffers(grid.width * grid.height)
+
+
+def _release_buffers(grid, buffers):
+    """ Give SearchBuffers back for reuse by the next search over a grid. """
+    _buffers.setdefault(grid, []).append(buffers)
+
+
+def _search_grid(grid, src, dst, bounds, walls, max_depth, batch, stats):
+    """
+    The A* search of search() over the part of a cost grid inside bounds,
+    with a city-block heuristic and the grid costs (plus one per step), and
+    the same (done, path) results.
+
+    Rather than a Step and a dict entry per tile this keeps its state in
+    SearchBuffers and pushes plain ints on the open list: f * size + index,
+    so entries with the same f come off in index order. Stale entries are
+    recognized by their f no longer matching the tile's cost.
+
+    With 'stats' there are no callbacks to count, only the heap and the
+    whole.
+    """
+    left, top, right, bottom = bounds
+    span = right - left
+    walls = bytearray(walls.tobytes())
+    width = grid.width
+    size = width * grid.height
+    costs = grid.costs
+    dx, dy = dst
+    goal = dy * width + dx
+    push = heapq.heappush
+    pop = heapq.heappop
+    if stats is not None:
+        stats.start()
+        push, pop = stats.heap(lambda entry: entry % size)
+    buffers = _acquire_buffers(grid)
+
+    def expanded_tiles():
+        """ Return the locations closed by this search. """
+        return ((x, y) for y in xrange(top, bottom)
+                for x in xrange(left, right)
+                if buffers.state[y * width + x] == CLOSED)
+
+    try:
+        OPEN, CLOSED = buffers.begin()
+        g = buffers.g
+        parent = buffers.parent
+        depth = buffers.depth
+        state = buffers.state
+        start = src[1] * width + src[0]
+        g[start] = 0
+        parent[start] = -1
+        depth[start] = 0
+        state[start] = OPEN
+        pq = []
+        push(pq, manhattan(src, dst) * size + start)
+        best = start
+        best_h = manhattan(src, dst)
+        expanded = 0
+        while pq:
+            f, i = divmod(pop(pq), size)
+            if state[i] == CLOSED:
+                continue
+            x = i % width
+            y = i // width
+            h = abs(x - dx) + abs(y - dy)
+            if f != g[i] + h:
+                continue
+            state[i] = CLOSED
+
+            if i == goal:
+                if stats is not None:
+                    stats.finish(expanded_tiles())
+                yield True, buffers.path_to(i, width)
+                return
+
+            # Keep track of the best partial path, and take a break if it is
+            # time.
+            if h < best_h or (h == best_h and g[i] < g[best]):
+                best = i
+                best_h = h
+            expanded += 1
+            if batch is not None and expanded % batch == 0:
+                if stats is not None:
+                    stats.stop()
+                yield False, buffers.path_to(best, width)
+                if stats is not None:
+                    stats.start()
+
+            if depth[i] == max_depth:
+                continue
+            for ddx, ddy in directions:
+                nx = x + ddx
+                ny = y + ddy
+                if not (left <= nx < right and top <= ny < bottom) or \
+                        walls[(ny - top) * span + nx - left]:
+                    continue
+                j = ny * width + nx
+                s = state[j]
+                if s == CLOSED:
+                    continue
+                cost = g[i] + costs[j] + 1
+                if s == OPEN and cost >= g[j]:
+                    continue
+                g[j] = cost
+                parent[j] = i
+                depth[j] = depth[i] + 1
+                state[j] = OPEN
+                push(pq, (cost + abs(nx - dx) + abs(ny - dy)) * size + j)
+        if stats is not None:
+            stats.finish(expanded_tiles())
+        yield True, []
+    finally:
+        _release_buffers(grid, buffers)
+
+
+def find_on_grid(grid, src, dst, blocked=(), allowed=None, max_depth=100,
+                 stats=None):
+    """
+    Find a path from 'src' to 'dst' over a cost grid (see
+    executor.CostGrid): an object with 'width', 'height' and a flat
+    row-major array('h') of 'costs', where a negative cost means impassable.
+
+    'blocked' is an optional list of extra locations to treat as
+    impassable, such as occupied tiles. 'allowed' is an optional 2d numpy
+    bool array indexed [y, x] of the tiles that may be used at all, such as
+    the explored tiles.
+
+    When every passable tile that a path of max_depth steps could reach
+    costs the same, this uses the native backend if one is installed (see
+    'native'), or else jump_point_search(); otherwise it falls back on the
+    A* search of find() with a city-block heuristic and the grid costs (plus
+    one per step), run over flat arrays reused from one search to the next.
+
+    'stats' is an optional SearchStats to fill in. Native searches cannot
+    be instrumented, so with stats the Python engine always runs.
+    """
+    window = _grid_window(grid, src, dst, blocked, allowed, max_depth)
+    if window is None:
+        return []
+    bounds, costs, walls = window
+    if is_uniform(costs):
+        return _find_uniform(grid, src, dst, blocked, allowed, max_depth,
+                             window, stats)
+    for done, path in _search_grid(grid, src, dst, bounds, walls, max_depth,
+                                   None, stats):
+        pass
+    return path
+
+
+def _find_uniform(grid, src, dst, blocked, allowed, max_depth, window, stats,
+                  max_nodes=None):
+    """ Find a path over a window of uniform costs, with the native backend
+    or jump_point_search(). Returns None if the search gave up after
+    max_nodes jump points. """
+    bounds, costs, walls = window
+    left, top = bounds[:2]
+    if native is not None and stats is None:
+        path = native.find_uniform(grid, src, dst, blocked, allowed,
+                                   max_depth)
+        if path is not None:
+            return path
+    path = jump_point_search((src[0] - left, src[1] - top),
+                             (dst[0] - left, dst[1] - top), walls,
+                             max_depth=max_depth, stats=stats,
+                             max_nodes=max_nodes)
+    if path is None:
+        return None
+    if stats is not None and stats.explored:
+        explored = [(x + left, y + top) for x, y in stats.explored]
+        stats.explored.clear()
+        stats.explored.update(explored)
+    return [(x + left, y + top) for x, y in path]
+
+
+def search_on_grid(grid, src, dst, blocked=(), allowed=None, max_depth=100,
+                   batch=None, stats=None):
+    """ Search for a path over a cost grid a slice at a time. The arguments
+    are as for find_on_grid() and search(). A jump point search cannot be
+    broken up, so where the costs are uniform it is tried first, and if it
+    is done within one slice of 'batch' jump points it answers in one go;
+    otherwise, and for weighted ground, the A* search of find() runs a slice
+    at a time. """
+    window = _grid_window(grid, src, dst, blocked, allowed, max_depth)
+    if window is None:
+        return iter([(True, [])])
+    bounds, costs, walls = window
+    if is_uniform(costs):
+        path = _find_uniform(grid, src, dst, blocked, allowed, max_depth,
+                             window, stats, max_nodes=batch)
+        if path is not None:
+            return iter([(True, path)])
+    return _search_grid(grid, src, dst, bounds, walls, max_depth, batch,
+                        stats)
+
+
+class FlowField(object):
+    """
+    A distance field (or "Dijkstra map") of the cost of the cheapest route
+    to 'dst' from every tile within 'radius' of it on a cost grid. Any
+    number of followers headed for the same place can share one and each
+    pick their next step with next_step() in constant time.
+
+    'version' is the grid version the field was computed from; see
+    is_current().
+    """
+
+    def __init__(self, grid, dst, radius):
+        self.grid = grid
+        self.dst = dst
+        self.radius = radius
+        self.version = grid.version
+        self.left = max(0, dst[0] - radius)
+        self.top = max(0, dst[1] - radius)
+        right = min(grid.width, dst[0] + radius + 1)
+        bottom = min(grid.height, dst[1] + radius + 1)
+        costs = cost_array(grid)[self.top:bottom, self.left:right]
+        self.costs = distance_fields(
+            costs, [(dst[0] - self.left, dst[1] - self.top)],
+            reverse=True)[0]
+
+    def is_current(self):
+        """ Return True iff the grid has not changed since the field was
+        computed. """
+        return self.version == self.grid.version
+
+    def get(self, x, y):
+        """ Return the cost of the route from x, y to dst, or INFINITY if
+        there is none within range. """
+        x -= self.left
+        y -= self.top
+        height, width = self.costs.shape
+        if 0 <= x < width and 0 <= y < height:
+            return self.costs[y, x]
+        return INFINITY
+
+    def next_step(self, src, blocked=()):
+        """ Return the neighbor of 'src' on the cheapest route from it to dst
+        that is not in 'blocked', or None if src is out of range or all the
+        neighbors that are closer to dst are blocked. """
+        here = self.get(*src)
+        if here == INFINITY:
+            return None
+        best = None
+        best_cost = INFINITY
+        for dx, dy in directions:
+            x = src[0] + dx
+            y = src[1] + dy
+            cost = self.get(x, y)
+            if cost >= here or (x, y) in blocked:
+                continue
+            cost += self.grid.costs[y * self.grid.width + x] + 1
+            if cost < best_cost:
+                best = x, y
+                best_cost = cost
+        return best
+
+
+def flow_field(grid, dst, radius):
+    """ Return a FlowField toward dst over a cost grid, or the native
+    backend's equivalent if the field would cover the whole grid. """
+    if native is not None and dst[0] - radius <= 0 and \
+            dst[1] - radius <= 0 and dst[0] + radius >= grid.width - 1 and \
+            dst[1] + radius >= grid.height - 1 and \
+            is_uniform(cost_array(grid)):
+        field = native.flow_field(grid, dst)
+        if field is not None:
+            return field
+    return FlowField(grid, dst, radius)
+
+
+class Replanner(object):
+    """
+    Incremental path search over a cost grid, using Moving Target D* Lite
+    (Sun, Yeoh and Koenig). The search tree is kept between calls to find(),
+    so when the destination moves or a few tiles change cost only the part
+    of the tree that depends on them is searched again. The tree stays
+    rooted where it was started for as long as the source keeps to the
+    route from there, so stepping along the path costs nothing.
+
+    'allowed' is as for find_on_grid(), and can be changed between searches
+    with set_allowed(). The search is confined to the bounding box of the
+    source and destination grown by 'margin' tiles on every side; it starts
+    over when either leaves it.
+    """
+
+    def __init__(self, grid, allowed=None, margin=50):
+        self.grid = grid
+        self.allowed = allowed
+        self.margin = margin
+        self.root = None
+        self.dst = None
+        self.unsettled = set()
+
+    def reset(self, src, dst, blocked):
+        """ Throw away the search tree and start a new one at src. """
+        self.root = src
+        self.dst = dst
+        self.blocked = blocked
+        self.left = max(0, min(src[0], dst[0]) - self.margin)
+        self.top = max(0, min(src[1], dst[1]) - self.margin)
+        self.right = min(self.grid.width,
+                         max(src[0], dst[0]) + self.margin + 1)
+        self.bottom = min(self.grid.height,
+                          max(src[1], dst[1]) + self.margin + 1)
+        self.version = self.grid.version
+        self.snapshot = cost_array(self.grid).copy()
+        self.unsettled = set()
+        self.km = 0
+        self.g = {}
+        self.rhs = {src: 0}
+        self.parents = {src: None}
+        self.open = {}
+        self.pq = []
+        self.counter = itertools.count()
+        self.update_state(src)
+
+    def inside(self, loc):
+        """ Return True iff loc is inside the search box. """
+        return self.left <= loc[0] < self.right and \
+            self.top <= loc[1] < self.bottom
+
+    def cost(self, loc):
+        """ Return the cost of stepping onto loc. """
+        x, y = loc
+        if not self.inside(loc) or loc in self.blocked or \
+                (self.allowed is not None and not self.allowed[y, x]):
+            return UNREACHABLE
+        cost = self.grid.costs[y * self.grid.width + x]
+        return UNREACHABLE if cost < 0 else cost + 1
+
+    def key(self, loc):
+        """ Return the priority of loc in the open list. """
+        g = min(self.g.get(loc, UNREACHABLE), self.rhs.get(loc, UNREACHABLE))
+        return g + manhattan(loc, self.dst) + self.km, g
+
+    def update_state(self, loc):
+        """ Put loc on the open list iff it is inconsistent. """
+        if self.g.get(loc, UNREACHABLE) != self.rhs.get(loc, UNREACHABLE):
+            key = self.key(loc)
+            self.open[loc] = key
+            heapq.heappush(self.pq, (key, next(self.counter), loc))
+        else:
+            self.open.pop(loc, None)
+
+    def update_rhs(self, loc):
+        """ Recompute the best way into loc from its neighbors. """
+        best = UNREACHABLE
+        parent = None
+        cost = self.cost(loc)
+        if cost != UNREACHABLE:
+            for dx, dy in directions:
+                prev = loc[0] + dx, loc[1] + dy
+                g = self.g.get(prev, UNREACHABLE) + cost
+                if g < best:
+                    best = g
+                    parent = prev
+        self.rhs[loc] = best
+        self.parents[loc] = parent
+
+    def peek(self):
+        """ Return the first live entry of the open list, or None. """
+        while self.pq:
+            key, _, loc = self.pq[0]
+            if self.open.get(loc) == key:
+                return self.pq[0]
+            heapq.heappop(self.pq)
+        return None
+
+    def compute(self):
+        """ Expand nodes until the route to dst is settled. """
+        dst = self.dst
+        while True:
+            entry = self.peek()
+            if entry is None or (entry[0] >= self.key(dst) and
+                                 self.rhs.get(dst, UNREACHABLE) <=
+                                 self.g.get(dst, UNREACHABLE)):
+                return
+            heapq.heappop(self.pq)
+            old_key, _, loc = entry
+            del self.open[loc]
+            new_key = self.key(loc)
+            g = self.g.get(loc, UNREACHABLE)
+            rhs = self.rhs.get(loc, UNREACHABLE)
+            if old_key < new_key:
+                self.update_state(loc)
+            elif g > rhs:
+                self.g[loc] = rhs
+                for dx, dy in directions:
+                    nxt = loc[0] + dx, loc[1] + dy
+                    if nxt == self.root:
+                        continue
+                    cost = rhs + self.cost(nxt)
+                    if cost < self.rhs.get(nxt, UNREACHABLE):
+                        self.rhs[nxt] = cost
+                        self.parents[nxt] = loc
+                        self.update_state(nxt)
+            else:
+                self.g[loc] = UNREACHABLE
+                for dx, dy in directions:
+                    nxt = loc[0] + dx, loc[1] + dy
+                    if nxt != self.root and self.parents.get(nxt) == loc:
+                        self.update_rhs(nxt)
+                        self.update_state(nxt)
+                self.update_state(loc)
+
+    def move_root(self, src):
+        """ Make src, which is in the search tree, its new root. The rest of
+        the tree either hangs off it or is repaired by the next search. """
+        old = self.root
+        self.root = src
+        self.parents[src] = None
+        self.update_rhs(old)
+        self.update_state(old)
+
+    def set_allowed(self, allowed):
+        """ Replace the 'allowed' mask with a new array. The tiles inside the
+        search box that it lets in or shuts out are searched again by the
+        next find(). """
+        old = self.allowed
+        self.allowed = allowed
+        if self.root is None or (old is None and allowed is None):
+            return
+        if old is None or allowed is None:
+            self.root = None
+            return
+        box = (slice(self.top, self.bottom), slice(self.left, self.right))
+        for y, x in numpy.argwhere(old[box] != allowed[box]):
+            self.unsettled.add((x + self.left, y + self.top))
+
+    def changed(self, blocked):
+        """ Return the tiles whose cost changed since the last search. """
+        locs = set(self.blocked.symmetric_difference(blocked))
+        self.blocked = blocked
+        locs |= self.unsettled
+        self.unsettled = set()
+        if self.grid.version != self.version:
+            costs = cost_array(self.grid)
+            for y, x in numpy.argwhere(costs != self.snapshot):
+                locs.add((x, y))
+            self.snapshot = costs.copy()
+            self.version = self.grid.version
+        return locs
+
+    def route(self):
+        """ Return the tiles from the root to dst, excluding the root, or []
+        if dst is unreachable. """
+        if self.rhs.get(self.dst, UNREACHABLE) == UNREACHABLE:
+            return []
+        route = []
+        loc = self.dst
+        while loc != self.root:
+            route.append(loc)
+            loc = self.parents[loc]
+        route.reverse()
+        return route
+
+    def find(self, src, dst, blocked=()):
+        """ Return a path from src to dst in the same form as find(), or []
+        if there is none. 'blocked' is as for find_on_grid() and replaces the
+        tiles blocked on the last call. """
+        blocked = frozenset(blocked)
+        if src == dst:
+            return []
+        if self.root is None or not self.inside(src) or \
+                not self.inside(dst) or \
+                self.rhs.get(src, UNREACHABLE) == UNREACHABLE:
+            self.reset(src, dst, blocked)
+        else:
+            if dst != self.dst:
+                self.km += manhattan(self.dst, dst)
+                self.dst = dst
+            for loc in self.changed(blocked):
+                if loc != self.root:
+                    self.update_rhs(loc)
+                    self.update_state(loc)
+        self.compute()
+        route = self.route()
+        if src == self.root:
+            return route
+        # Any part of a cheapest route is a cheapest route, so as long as
+        # src is still on the one from the root (as when it is following
+        # it) the root can stay behind.
+        if src in route:
+            return route[route.index(src) + 1:]
+        if self.rhs.get(src, UNREACHABLE) == UNREACHABLE:
+            self.reset(src, dst, blocked)
+        else:
+            self.move_root(src)
+        self.compute()
+        return self.route()
+
+
+class PathCache(object):
+    """
+    A least-recently-used cache of the paths found over a place, keyed by
+    (src, dst, mmode). Each path is dropped as soon as the terrain changes
+    anywhere inside its bounding rectangle, which the cache learns of
+    through the place's 'terrain' hook. The paths are found without regard
+    to occupants, so their comings and goings do not count; nor does
+    exploring, which only ever opens up more ways to go.
+
+    'hits', 'misses', 'evictions' and 'invalidations' count what has
+    happened to lookups and entries, for tuning 'size'.
+    """
+
+    def __init__(self, pla, size):
+        self.place = pla
+        self.entries = lru.LRU(size)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        pla.on('terrain', self.on_changed)
+
+    @property
+    def evictions(self):
+        """ The entries dropped to make room. """
+        return self.entries.evictions
+
+    def get(self, src, dst, mmode):
+        """ Return a copy of the cached path, or None. """
+        key = (src, dst, mmode)
+        try:
+            entry = self.entries.lookup(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return list(entry[1])
+
+    def put(self, src, dst, mmode, path):
+        """ Cache a (non-empty) path. """
+        xs = [src[0]] + [loc[0] for loc in path]
+        ys = [src[1]] + [loc[1] for loc in path]
+        rect = min(xs), min(ys), max(xs) + 1, max(ys) + 1
+        self.entries.put((src, dst, mmode), (rect, tuple(path)))
+
+    def on_changed(self, x, y, width, height):
+        """ Drop the paths whose rectangles overlap the changed region. """
+        for key, (rect, _) in self.entries.items():
+            if x < rect[2] and rect[0] < x + width and \
+                    y < rect[3] and rect[1] < y + height:
+                self.entries.pop(key)
+                self.invalidations += 1
+
+    def clear(self):
+        """ Drop every path. """
+        self.entries.clear()
+
+    def close(self):
+        """ Stop following changes in the place. """
+        self.place.un('terrain', self.on_changed)
+
+
+def label_regions(mask):
+    """
+    Label the 4-connected regions of True tiles in a 2d numpy bool array.
+    Returns a numpy int32 array of the same shape holding 0 for the False
+    tiles and 1 through n for the regions, and a list of the bounds (left,
+    top, right, bottom) of each region, indexed by label (the first is
+    unused).
+
+    Each row is split into runs of True tiles with whole-array operations,
+    and the runs that overlap in consecutive rows are joined with a
+    union-find, so the Python loops only ever visit runs, never tiles.
+    """
+    height, width = mask.shape
+    padded = numpy.zeros((height, width + 2), dtype=numpy.int8)
+    padded[:, 1:-1] = mask
+    edges = numpy.diff(padded, axis=1)
+    rows, starts = numpy.nonzero(edges == 1)
+    ends = numpy.nonzero(edges == -1)[1]
+    rows = rows.tolist()
+    starts = starts.tolist()
+    ends = ends.tolist()
+    firsts = numpy.searchsorted(rows, numpy.arange(height + 1)).tolist()
+    parents = range(len(rows))
+
+    def root(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    for y in xrange(1, height):
+        i, i_end = firsts[y - 1], firsts[y]
+        j, j_end = firsts[y], firsts[y + 1]
+        while i < i_end and j < j_end:
+            if starts[i] < ends[j] and starts[j] < ends[i]:
+                a = root(i)
+                b = root(j)
+                if a != b:
+                    parents[max(a, b)] = min(a, b)
+            if ends[i] < ends[j]:
+                i += 1
+            else:
+                j += 1
+
+    labels = numpy.zeros((height, width), dtype=numpy.int32)
+    bounds = [None]
+    ids = {}
+    for i in xrange(len(rows)):
+        top = root(i)
+        label = ids.get(top)
+        y = rows[i]
+        if label is None:
+            label = ids[top] = len(bounds)
+            bounds.append([starts[i], y, ends[i], y + 1])
+        else:
+            box = bounds[label]
+            box[0] = min(box[0], starts[i])
+            box[2] = max(box[2], ends[i])
+            box[3] = y + 1
+        labels[y, starts[i]:ends[i]] = label
+    return labels, [tuple(box) if box else None for box in bounds]
+
+
+class Regions(object):
+    """
+    The connected regions of the passable tiles of a cost grid, so that a
+    search between tiles in different regions, which can only fail after
+    searching everything it can reach, can be turned down at once with
+    connected().
+
+    Terrain changes are queued through the place's 'terrain' hook, and the
+    next query relabels only the regions that touch them (which may have
+    been split or joined), within their bounds. Any other change to the
+    grid, such as a new passability, relabels everything.
+    """
+
+    def __init__(self, grid):
+        self.grid = grid
+        self.dirty = []
+        self.rebuild()
+        grid.place.on('terrain', self.on_terrain_changed)
+
+    def rebuild(self):
+        """ Relabel the whole grid. """
+        labels, bounds = label_regions(cost_array(self.grid) >= 0)
+        self.labels = labels
+        self.bounds = dict((label, box) for label, box in enumerate(bounds)
+                           if box is not None)
+        self.next_label = len(bounds)
+        self.version = self.grid.version
+        self.dirty = []
+
+    def on_terrain_changed(self, x, y, width, height):
+        """ Queue a changed region, if it is the only change to the grid
+        since the labels were last brought up to date. """
+        if self.version == self.grid.version - 1:
+            self.version = self.grid.version
+            self.dirty.append((x, y, x + width, y + height))
+
+    def refresh(self):
+        """ Bring the labels up to date with the grid. """
+        if self.version != self.grid.version:
+            self.rebuild()
+        elif self.dirty:
+            self.relabel(self.dirty)
+            self.dirty = []
+
+    def relabel(self, rects):
+        """ Relabel the regions touching any of a list of (left, top, right,
+        bottom) rects, and the rects themselves. """
+        height, width = self.labels.shape
+        touching = set()
+        box = list(rects[0])
+        for left, top, right, bottom in rects:
+            ring = self.labels[max(0, top - 1):bottom + 1,
+                               max(0, left - 1):right + 1]
+            touching.update(numpy.unique(ring).tolist())
+            box = [min(box[0], left), min(box[1], top),
+                   max(box[2], right), max(box[3], bottom)]
+        touching.discard(0)
+        for label in touching:
+            left, top, right, bottom = self.bounds.pop(label)
+            box = [min(box[0], left), min(box[1], top),
+                   max(box[2], right), max(box[3], bottom)]
+        left, top, right, bottom = box
+        window = self.labels[top:bottom, left:right]
+        stale = numpy.in1d(window, list(touching)).reshape(window.shape)
+        mask = stale.copy()
+        for rleft, rtop, rright, rbottom in rects:
+            mask[rtop - top:rbottom - top, rleft - left:rright - left] = True
+        mask &= cost_array(self.grid)[top:bottom, left:right] >= 0
+        labels, bounds = label_regions(mask)
+        offset = self.next_label - 1
+        window[stale] = 0
+        window[mask] = labels[mask] + offset
+        for label, (bleft, btop, bright, bbottom) in enumerate(bounds[1:],
+                                                               1):
+            self.bounds[label + offset] = (bleft + left, btop + top,
+                                           bright + left, bbottom + top)
+        self.next_label += len(bounds) - 1
+
+    def label(self, x, y):
+        """ Return the label of the region of x, y, or 0 if it is impassable
+        or off the map. """
+        self.refresh()
+        if 0 <= x < self.grid.width and 0 <= y < self.grid.height:
+            return self.labels[y, x]
+        return 0
+
+    def connected(self, src, dst):
+        """ Return True iff there is a route over passable tiles between src
+        and dst, ignoring occupants. """
+        a = self.label(*src)
+        return a != 0 and a == self.label(*dst)
+
+    def close(self):
+        """ Stop following terrain changes. """
+        self.grid.place.un('terrain', self.on_terrain_changed)
+
+
+# The cost of waiting a turn in a space-time search.
+WAIT_COST = 1
+
+
+class ReservationTable(object):
+    """
+    The space-time reservations of a group of agents moving together for
+    cooperative pathfinding (WHCA*): which agent will be on which location
+    at each time step of the planning window.
+    """
+
+    def __init__(self):
+        self.cells = {}
+
+    def reserve(self, agent, locs):
+        """ Reserve locs[t] for agent at each time step t. """
+        for t, loc in enumerate(locs):
+            self.cells[(loc, t)] = agent
+
+    def release(self, agent, loc, t):
+        """ Cancel agent's reservation of loc at time t, if it has one. """
+        if self.cells.get((loc, t)) is agent:
+            del self.cells[(loc, t)]
+
+    def is_free(self, agent, loc, t):
+        """ Return True iff no other agent has loc at time t. """
+        return self.cells.get((loc, t), agent) is agent
+
+    def can_move(self, agent, src, dst, t):
+        """ Return True iff agent can go from src at time t to dst at time
+        t + 1 without running into, or through, another agent. """
+        if not self.is_free(agent, dst, t + 1):
+            return False
+        other = self.cells.get((dst, t))
+        return other is None or other is agent or \
+            self.cells.get((src, t + 1)) is not other
+
+
+def find_in_time(src, neighbors, heuristic, reservations, agent, window):
+    """
+    Plan the moves of one agent over the next 'window' time steps with a
+    space-time A* that steers around the reservations of the agents planned
+    before it.
+
+    'neighbors' is a function that expects a location and yields (location,
+    cost) for the places that can be stepped to from it, and 'heuristic'
+    one that expects a location and returns an estimate of the cost to go
+    from there, which must be 0 at the goal. Waiting a turn costs WAIT_COST.
+
+    Returns the locations of the agent at times 0 through 'window' (fewer if
+    it reaches the goal, where it is free to stay). Once the window is used
+    up, the rest of the way is estimated by the heuristic.
+    """
+    pq = []
+    counter = itertools.count()
+    costs = {(src, 0): 0}
+    parents = {(src, 0): None}
+    closed = set()
+    heapq.heappush(pq, (heuristic(src), next(counter), (src, 0)))
+    while pq:
+        _, _, node = heapq.heappop(pq)
+        if node in closed:
+            continue
+        closed.add(node)
+        loc, t = node
+        arrived = heuristic(loc) == 0 and \
+            all(reservations.is_free(agent, loc, later)
+                for later in xrange(t, window + 1))
+        if arrived or t == window:
+            locs = []
+            while node is not None:
+                locs.append(node[0])
+                node = parents[node]
+            locs.reverse()
+            return locs
+        moves = list(neighbors(loc))
+        moves.append((loc, WAIT_COST))
+        for nxt, cost in moves:
+            if not reservations.can_move(agent, loc, nxt, t):
+                continue
+            new = (nxt, t + 1)
+            cost += costs[node]
+            if new in closed or cost >= costs.get(new, cost + 1):
+                continue
+            costs[new] = cost
+            parents[new] = node
+            heapq.heappush(pq, (cost + heuristic(nxt), next(counter), new))
+    return [src]
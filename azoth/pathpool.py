@@ -0,0 +1,88 @@
+"""
+Batches of path queries answered by a pool of worker processes.
+
+The cost grids of a place are copied into shared memory that the workers
+inherit when they start, so a batch only has to send the queries and the
+paths back and forth; the grids themselves are never pickled.
+"""
+
+import multiprocessing
+import multiprocessing.sharedctypes
+import path
+
+# The shared grids of a worker process, by mmode.
+_grids = {}
+
+
+class SharedGrid(object):
+    """ A cost grid (see executor.CostGrid) whose costs live in shared
+    memory. """
+
+    def __init__(self, width, height, costs=None):
+        self.width = width
+        self.height = height
+        if costs is None:
+            costs = multiprocessing.sharedctypes.RawArray('h', width * height)
+        self.costs = costs
+
+    def copy_from(self, grid):
+        """ Overwrite the costs with those of another grid. """
+        path.cost_array(self)[...] = path.cost_array(grid)
+
+
+def _init_worker(width, height, shared):
+    """ Wrap the inherited shared memory in each worker process. """
+    for mmode, costs in shared.items():
+        _grids[mmode] = SharedGrid(width, height, costs)
+
+
+def _find(query):
+    """ Answer one query in a worker process. """
+    src, dst, mmode, blocked, max_depth = query
+    return path.find_on_grid(_grids[mmode], src, dst, blocked=blocked,
+                             max_depth=max_depth)
+
+
+class PathPool(object):
+    """
+    A pool of worker processes that find paths over one place, for any of
+    the given movement modes.
+
+    Before each batch the cost grids of any modes whose terrain or
+    passability has changed are copied into the shared snapshot. The
+    workers only ever read it, and the snapshot is not touched again until
+    the batch is done.
+    """
+
+    def __init__(self, rules, pla, mmodes, processes=None):
+        self.grids = dict((mmode, rules.get_cost_grid(mmode, pla))
+                          for mmode in mmodes)
+        self.shared = dict((mmode, SharedGrid(pla.width, pla.height))
+                           for mmode in mmodes)
+        self.versions = dict.fromkeys(mmodes)
+        self.pool = multiprocessing.Pool(
+            processes, _init_worker,
+            (pla.width, pla.height,
+             dict((mmode, grid.costs)
+                  for mmode, grid in self.shared.items())))
+
+    def sync(self):
+        """ Bring the shared snapshot up to date with the cost grids. """
+        for mmode, grid in self.grids.items():
+            if self.versions[mmode] != grid.version:
+                self.shared[mmode].copy_from(grid)
+                self.versions[mmode] = grid.version
+
+    def find(self, queries, blocked=(), max_depth=100):
+        """ Return the path for each (src, dst, mmode) query, in order, as
+        find_on_grid() would with 'blocked' and 'max_depth'. """
+        self.sync()
+        blocked = list(blocked)
+        work = [(src, dst, mmode, blocked, max_depth)
+                for src, dst, mmode in queries]
+        return self.pool.map(_find, work)
+
+    def close(self):
+        """ Shut down the worker processes. """
+        self.pool.close()
+        self.pool.join()
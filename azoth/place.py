@@ -2,7 +2,10 @@
 
 import array
 import collections
+import config
 import cPickle
+import numpy
+import terrainmap
 
 
 class PlaceError(Exception):
@@ -51,6 +54,61 @@ class OffMapError(PlaceError):
                                               self.place.name)
 
 
+class Transparency(object):
+    """ Which tiles of a place do not block sight, for field of view (see
+    fov): 'clear' is a 2d numpy bool array indexed [y, x]. It is built in one
+    go from the palette and patched through the place's 'terrain' hook, and
+    'version' is bumped on every change. Each 'block' by 'block' square of
+    the place has a version of its own too, for telling whether the tiles
+    around one spot have changed (see region_version()). """
+
+    block = 16
+
+    def __init__(self, pla):
+        self.place = pla
+        self.version = 0
+        self.clear = numpy.zeros((pla.height, pla.width), dtype=bool)
+        self.blocks = numpy.zeros(((pla.height + self.block - 1) // self.block,
+                                   (pla.width + self.block - 1) // self.block),
+                                  dtype=numpy.int64)
+        self.update(0, 0, pla.width, pla.height)
+        pla.on('terrain', self.on_terrain_changed)
+
+    def update(self, x, y, width, height):
+        """ Copy the transparency of a region from the terrain. """
+        pla = self.place
+        # The palette keeps entries no tile uses any more, such as the None
+        # a place starts out with; those count as opaque.
+        id_clear = numpy.array([ter is not None and not ter.blocks_sight
+                                for ter in pla.palette], dtype=bool)
+        ids = numpy.frombuffer(pla.terrain_ids, dtype=numpy.uint16)
+        ids = ids.reshape(pla.height, pla.width)
+        self.clear[y:y + height, x:x + width] = \
+            id_clear[ids[y:y + height, x:x + width]]
+
+    def on_terrain_changed(self, x, y, width, height):
+        """ Patch a region after its terrain changed. """
+        if width == height == 1:
+            self.clear[y, x] = not self.place.get_terrain(x, y).blocks_sight
+        else:
+            self.update(x, y, width, height)
+        self.blocks[y // self.block:(y + height - 1) // self.block + 1,
+                    x // self.block:(x + width - 1) // self.block + 1] += 1
+        self.version += 1
+
+    def region_version(self, left, top, right, bottom):
+        """ Return a number that goes up whenever the terrain changes in the
+        blocks that cover the region from left, top up to right, bottom. """
+        return int(self.blocks[top // self.block:
+                               (bottom - 1) // self.block + 1,
+                               left // self.block:
+                               (right - 1) // self.block + 1].sum())
+
+    def close(self):
+        """ Stop following terrain changes. """
+        self.place.un('terrain', self.on_terrain_changed)
+
+
 def check_index(func):
     """ Decorator to wrap a method with a coordinate check. """
     def fwrap(instance, x, y, *args):
@@ -62,20 +120,27 @@ def check_index(func):
 
 
 class Place(object):
-    """ A place is a fixed-size grid that holds terrain, items and beings. """
+    """ A place is a fixed-size grid that holds terrain, items and beings.
+
+    Terrain is stored compactly: 'palette' lists the distinct terrain types
+    used in the place, and 'terrain_ids' is a flat row-major array of palette
+    indices, so each tile costs two bytes instead of a pointer. """
 
     def __init__(self, width, height, name=None, default_terrain=None):
         self.width = width
         self.height = height
         self.name = name
-        self.terrain_map = []
-        for column in range(self.width):
-            self.terrain_map.append([default_terrain, ] * self.height)
+        self.palette = []
+        self.palette_ids = {}
+        default_id = self.get_terrain_id(default_terrain)
+        self.terrain_ids = array.array('H', [default_id]) * (width * height)
         self.items = collections.defaultdict(list)
         self.occupants = {}
-        self.explored = []
-        for x in range(self.width):
-            self.explored.append(array.array('b', '\0' * self.height))
+        # One bit per tile, packed along the rows as by numpy.packbits().
+        self.explored = numpy.zeros((height, (width + 7) // 8),
+                                    dtype=numpy.uint8)
+        self.hooks = collections.defaultdict(list)
+        self.transparency = None
 
     def onmap(self, xloc, yloc):
         """ Return True iff the x, y is on the map. This is used by the
@@ -83,30 +148,104 @@ class Place(object):
         return xloc >= 0 and yloc >= 0 and xloc < self.width and \
             yloc < self.height
 
+    def on(self, event, callback):
+        """ Add a callback on an event hook. The 'terrain' event is fired
+        with (x, y, width, height) of the changed region whenever terrain
+        changes. Place hooks are meant for runtime caches and are not
+        saved. """
+        self.hooks[event].append(callback)
+
+    def un(self, event, callback):
+        """ Remove a callback from an event hook. """
+        self.hooks[event].remove(callback)
+
+    def fire(self, event, *args):
+        """ Invoke the callbacks on an event hook. """
+        for callback in self.hooks[event]:
+            callback(*args)
+
     @check_index
     def blit_terrain_map(self, offx, offy, tmap):
-        """ Copy a TerrainMap over the sector at top left offset x, y.  """
-        dest_y = offy
-        src_y = 0
-        while dest_y < self.height and src_y < tmap.height:
-            dest_x = offx
-            src_x = 0
-            while dest_x < self.width and src_x < tmap.width:
-                self.set_terrain(dest_x, dest_y, tmap.get(src_x, src_y))
-                dest_x += 1
-                src_x += 1
-            dest_y += 1
-            src_y += 1
+        """ Copy a TerrainMap (or another Place) over the region at top left
+        offset x, y, clipped to this place. Whole rows are copied as array
+        slices; ids are only translated when the source palette differs from
+        ours. """
+        width = min(tmap.width, self.width - offx)
+        height = min(tmap.height, self.height - offy)
+        self._blit_terrain_ids(offx, offy, width, height, tmap)
+        self.fire('terrain', offx, offy, width, height)
+
+    def _blit_terrain_ids(self, offx, offy, width, height, tmap):
+        """ Do the copying for blit_terrain_map(). """
+        if width == self.width and height == self.height:
+            # Everything is overwritten, so adopt the source palette and ids.
+            self.palette = []
+            self.palette_ids = {}
+            for ter in tmap.palette:
+                self.get_terrain_id(ter)
+            if tmap.width == width:
+                self.terrain_ids = tmap.terrain_ids[:width * height]
+                return
+        remap = [self.get_terrain_id(ter) for ter in tmap.palette]
+        src = tmap.terrain_ids
+        dst = self.terrain_ids
+        if remap == range(len(remap)):
+            if width == tmap.width == self.width:
+                start = offy * self.width
+                dst[start:start + width * height] = src[:width * height]
+                return
+            for row in xrange(height):
+                src_start = row * tmap.width
+                dst_start = (offy + row) * self.width + offx
+                dst[dst_start:dst_start + width] = \
+                    src[src_start:src_start + width]
+        else:
+            for row in xrange(height):
+                src_start = row * tmap.width
+                dst_start = (offy + row) * self.width + offx
+                dst[dst_start:dst_start + width] = array.array(
+                    'H', [remap[i] for i in src[src_start:src_start + width]])
+
+    @check_index
+    def get_terrain_region(self, x, y, width, height):
+        """ Return a TerrainMap copy of the region with top left at x, y,
+        clipped to this place. """
+        width = min(width, self.width - x)
+        height = min(height, self.height - y)
+        tmap = terrainmap.TerrainMap(width=width, height=height,
+                                     palette=self.palette,
+                                     terrain_ids=array.array('H'))
+        if width == self.width:
+            start = y * self.width
+            tmap.terrain_ids.extend(self.terrain_ids[start:start +
+                                                     width * height])
+        else:
+            for row in xrange(y, y + height):
+                start = row * self.width + x
+                tmap.terrain_ids.extend(self.terrain_ids[start:start + width])
+        return tmap
+
+    def get_terrain_id(self, terrain):
+        """ Return the palette index of terrain, adding it to the palette if
+        this is the first time it is used in this place. """
+        try:
+            return self.palette_ids[terrain]
+        except KeyError:
+            terrain_id = len(self.palette)
+            self.palette.append(terrain)
+            self.palette_ids[terrain] = terrain_id
+            return terrain_id
 
     @check_index
     def get_terrain(self, x, y):
         """ Return terrain at x, y. """
-        return self.terrain_map[x][y]
+        return self.palette[self.terrain_ids[y * self.width + x]]
 
     @check_index
     def set_terrain(self, x, y, terrain):
         """ Set terrain at x, y. """
-        self.terrain_map[x][y] = terrain
+        self.terrain_ids[y * self.width + x] = self.get_terrain_id(terrain)
+        self.fire('terrain', x, y, 1, 1)
 
     @check_index
     def get_items(self, x, y):
@@ -157,12 +296,75 @@ class Place(object):
     @check_index
     def get_explored(self, x, y):
         """ Return if the tile has been seen (for FOW). """
-        return self.explored[x][y]
+        return bool(self.explored[y, x >> 3] & (0x80 >> (x & 7)))
 
     @check_index
     def set_explored(self, x, y, val):
         """ Set the tile as explored (for FOW). """
-        self.explored[x][y] = val
+        if val:
+            self.explored[y, x >> 3] |= 0x80 >> (x & 7)
+        else:
+            self.explored[y, x >> 3] &= ~(0x80 >> (x & 7)) & 0xff
+
+    def explore(self, left, top, visible):
+        """ Mark the True tiles of a 2d numpy bool array, indexed [y, x]
+        with its top left at left, top, as explored, all at once. Returns
+        True iff any of them had not been explored before. """
+        height, width = visible.shape
+        start = left >> 3
+        end = (left + width + 7) >> 3
+        shift = left - start * 8
+        bits = numpy.zeros((height, (end - start) * 8), dtype=bool)
+        bits[:, shift:shift + width] = visible
+        packed = numpy.packbits(bits, axis=1)
+        explored = self.explored[top:top + height, start:end]
+        if not (packed & ~explored).any():
+            return False
+        explored |= packed
+        return True
+
+    def get_explored_mask(self):
+        """ Return a 2d numpy bool array, indexed [y, x], of the explored
+        tiles. """
+        bits = numpy.unpackbits(self.explored, axis=1)
+        return bits[:, :self.width].astype(bool)
+
+    def get_transparency(self):
+        """ Return the Transparency of the place, building it on first
+        use. """
+        if self.transparency is None:
+            self.transparency = Transparency(self)
+        return self.transparency
+
+    def __getstate__(self):
+        """ Leave out the hooks and the transparency when saving. """
+        state = dict(self.__dict__)
+        del state['hooks']
+        del state['transparency']
+        return state
+
+    def __setstate__(self, state):
+        """ Restore the (unsaved) hooks and transparency, and convert games
+        saved with the old per-column terrain lists or explored arrays. """
+        self.__dict__.update(state)
+        self.hooks = collections.defaultdict(list)
+        self.transparency = None
+        if isinstance(self.explored, list):
+            columns = [numpy.frombuffer(column, dtype=numpy.int8)
+                       for column in self.explored]
+            mask = numpy.array(columns, dtype=bool).T.reshape(self.height,
+                                                              self.width)
+            self.explored = numpy.packbits(mask, axis=1)
+        if 'terrain_map' in state:
+            terrain_map = self.__dict__.pop('terrain_map')
+            self.palette = []
+            self.palette_ids = {}
+            self.terrain_ids = array.array('H', [0]) * (self.width *
+                                                        self.height)
+            for x, column in enumerate(terrain_map):
+                for y, terrain in enumerate(column):
+                    self.terrain_ids[y * self.width + x] = \
+                        self.get_terrain_id(terrain)
 
     def save(self, savefile):
         """ Save to an open file. """
@@ -184,8 +386,8 @@ class Sector(Place):
     sectors to form a whole map. """
 
     def __init__(self, **kwargs):
-        # XXX: move 31 to config.py
-        super(Sector, self).__init__(width=31, height=31, **kwargs)
+        super(Sector, self).__init__(width=config.SECTOR_SIZE,
+                                     height=config.SECTOR_SIZE, **kwargs)
 
 
 class World(object):
@@ -0,0 +1,10 @@
+"""
+libtcod, for the modules that can use it when it is there: 'libtcod' is the
+libtcodpy module, or None if it cannot be loaded.
+"""
+
+try:
+    import libtcodpy as libtcod
+except OSError:
+    # The shared library, or one it needs, is missing.
+    libtcod = None
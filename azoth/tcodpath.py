@@ -0,0 +1,138 @@
+"""
+A native backend for the path module, run by libtcod's C A* and Dijkstra.
+
+libtcod only knows whether a tile can be walked on, so it only takes the
+searches where every tile that matters costs the same; the rest, and
+everything when libtcod cannot be loaded, are left to the Python engine.
+Select it with config.PATH_BACKEND, or install() it directly.
+"""
+
+import logging
+import numpy
+import path
+import weakref
+from tcodlib import libtcod
+
+logger = logging.getLogger('tcodpath')
+
+# Whether libtcod could be loaded.
+available = libtcod is not None
+
+# libtcod distances are fixed point; unreachable tiles are left at the
+# largest distance there is.
+_UNREACHABLE_DISTANCE = 1e7
+
+
+class TcodMap(object):
+    """
+    A libtcod map mirroring the walkable tiles of a cost grid, for the
+    searches of the backend.
+
+    Every search wants a slightly different set of walkable tiles (its own
+    'allowed' tiles and 'blocked' occupants on top of the terrain), so the
+    map keeps a numpy copy of what it holds and sync() only sets the tiles
+    that differ from the last search.
+    """
+
+    def __init__(self, width, height):
+        self.map = libtcod.map_new(width, height)
+        libtcod.map_clear(self.map, False, True)
+        self.walkable = numpy.zeros((height, width), dtype=bool)
+        # Orthogonal moves only, like the rest of path.
+        self.astar = libtcod.path_new_using_map(self.map, 0.0)
+
+    def __del__(self):
+        if libtcod is not None:
+            libtcod.path_delete(self.astar)
+            libtcod.map_delete(self.map)
+
+    def sync(self, grid, src=None, blocked=(), allowed=None):
+        """ Make the walkable tiles those of the grid that are passable,
+        allowed and not blocked, plus src. """
+        walkable = path.cost_array(grid) >= 0
+        if allowed is not None:
+            walkable &= allowed
+        for x, y in blocked:
+            if 0 <= x < grid.width and 0 <= y < grid.height:
+                walkable[y, x] = False
+        if src is not None:
+            walkable[src[1], src[0]] = True
+        for y, x in zip(*numpy.nonzero(walkable != self.walkable)):
+            libtcod.map_set_properties(self.map, int(x), int(y), True,
+                                       bool(walkable[y, x]))
+        self.walkable = walkable
+
+
+class DijkstraField(path.FlowField):
+    """ A path.FlowField over a whole cost grid of uniform costs, computed by
+    libtcod's Dijkstra. """
+
+    def __init__(self, tmap, grid, dst):
+        self.grid = grid
+        self.dst = dst
+        self.radius = max(grid.width, grid.height)
+        self.version = grid.version
+        costs = path.cost_array(grid)
+        costs = costs[costs >= 0]
+        # Nothing is reachable on a grid without a passable tile anyway.
+        self.step = int(costs.max()) + 1 if costs.size else 1
+        tmap.sync(grid)
+        self.dijkstra = libtcod.dijkstra_new(tmap.map, 0.0)
+        libtcod.dijkstra_compute(self.dijkstra, dst[0], dst[1])
+
+    def __del__(self):
+        if libtcod is not None:
+            libtcod.dijkstra_delete(self.dijkstra)
+
+    def get(self, x, y):
+        if not self.grid.passable(x, y):
+            return path.INFINITY
+        distance = libtcod.dijkstra_get_distance(self.dijkstra, x, y)
+        if distance < 0 or distance >= _UNREACHABLE_DISTANCE:
+            return path.INFINITY
+        return int(round(distance)) * self.step
+
+
+class Backend(object):
+    """ The path.native backend. """
+
+    def __init__(self):
+        self.maps = weakref.WeakKeyDictionary()
+
+    def get_map(self, grid):
+        """ Return the TcodMap of a grid, making it on first use. """
+        try:
+            return self.maps[grid]
+        except KeyError:
+            tmap = TcodMap(grid.width, grid.height)
+            self.maps[grid] = tmap
+            return tmap
+
+    def find_uniform(self, grid, src, dst, blocked, allowed, max_depth):
+        tmap = self.get_map(grid)
+        tmap.sync(grid, src, blocked, allowed)
+        if not libtcod.path_compute(tmap.astar, src[0], src[1], dst[0],
+                                    dst[1]):
+            return []
+        size = libtcod.path_size(tmap.astar)
+        if size > max_depth:
+            return []
+        return [libtcod.path_get(tmap.astar, i) for i in xrange(size)]
+
+    def flow_field(self, grid, dst):
+        return DijkstraField(self.get_map(grid), grid, dst)
+
+
+def install():
+    """ Make libtcod the native backend of the path module. Returns False,
+    leaving the Python engine in charge, if libtcod is not available. """
+    if not available:
+        logger.warn('libtcod is not available; using the Python pathfinder')
+        return False
+    path.native = Backend()
+    return True
+
+
+def uninstall():
+    """ Go back to the Python engine alone. """
+    path.native = None
@@ -1,106 +1,395 @@
 """ Terrain map module. Includes the base TerrainMap class and some factory
 functions that will create an instance from various file formats. """
 
+import array
+import config
+import hashlib
+import json
+import logging
+import numpy
+import os
 import pygame
+import re
+import sys
 import terrain
 
 
 class TerrainMap(object):
-    """ The base terrain map class. Just a 2d array of terrain types. """
-    def __init__(self, terrain=None):
-        self.terrain = terrain
+    """ The base terrain map class. A 2d grid of terrain types, stored like
+    place.Place as a palette of terrain types plus a flat row-major array of
+    palette ids. It can be built either from a list of rows of terrain types
+    or directly from a palette and id array. """
+    def __init__(self, terrain=None, width=0, height=0, palette=(),
+                 terrain_ids=None):
+        self.palette = []
+        self.palette_ids = {}
+        for ter in palette:
+            self.get_terrain_id(ter)
+        if terrain is not None:
+            self.width = len(terrain[0])
+            self.height = len(terrain)
+            self.terrain_ids = array.array('H')
+            for row in terrain:
+                self.terrain_ids.extend([self.get_terrain_id(t) for t in row])
+        else:
+            self.width = width
+            self.height = height
+            if terrain_ids is None:
+                terrain_ids = array.array('H', [0]) * (width * height)
+            self.terrain_ids = terrain_ids
 
-    @property
-    def width(self):
-        """ The width of the map. """
-        return len(self.terrain[0])
-
-    @property
-    def height(self):
-        """ The height of the map. """
-        return len(self.terrain)
+    def get_terrain_id(self, ter):
+        """ Return the palette index of terrain, adding it to the palette if
+        needed. """
+        try:
+            return self.palette_ids[ter]
+        except KeyError:
+            terrain_id = len(self.palette)
+            self.palette.append(ter)
+            self.palette_ids[ter] = terrain_id
+            return terrain_id
 
     def get(self, xloc, yloc):
         """ Get terrain at location. """
-        if xloc < 0 or yloc < 0:
+        if xloc < 0 or yloc < 0 or xloc >= self.width or yloc >= self.height:
             raise IndexError(xloc, yloc)
-        return self.terrain[yloc][xloc]
+        return self.palette[self.terrain_ids[yloc * self.width + xloc]]
 
     def set(self, xloc, yloc, val):
         """ Set terrain at (xloc, yloc). """
-        if xloc < 0 or yloc < 0 or xloc >= self.width:
+        if xloc < 0 or yloc < 0 or xloc >= self.width or yloc >= self.height:
             raise IndexError(xloc, yloc)
-        return self.terrain[yloc].insert(xloc, val)
+        self.terrain_ids[yloc * self.width + xloc] = self.get_terrain_id(val)
+
+
+# Map the first character of nazghul's standard palette glyphs to terrains.
+NAZGHUL_GLYPHS = {
+    '|': terrain.HeavyForest,
+    't': terrain.Forest,
+    '.': terrain.Grass,
+    '-': terrain.Grass,
+    '/': terrain.Trail,
+    'r': terrain.RockWall,
+    '[': terrain.CounterTop,
+    ']': terrain.CounterTop,
+    '~': terrain.Water,
+    'b': terrain.Boulder,
+    'c': terrain.CobbleStone,
+    '%': terrain.Bog,
+    '@': terrain.CounterTop,
+    '&': terrain.FirePlace,
+    'w': terrain.Window,
+    }
 
 
 def translate_nazghul_glyph(glyph):
     """ Translate glyphs from standard palette to terrains. """
-    return {'|': terrain.HeavyForest,
-            't': terrain.Forest,
-            '.': terrain.Grass,
-            '-': terrain.Grass,
-            '/': terrain.Trail,
-            'r': terrain.RockWall,
-            '[': terrain.CounterTop,
-            ']': terrain.CounterTop,
-            '~': terrain.Water,
-            'b': terrain.Boulder,
-            'c': terrain.CobbleStone,
-            '%': terrain.Bog,
-            '@': terrain.CounterTop,
-            '&': terrain.FirePlace,
-            'w': terrain.Window,
-            }.get(glyph[0], terrain.Unmapped)
+    return NAZGHUL_GLYPHS.get(glyph[0], terrain.Unmapped)
 
 
-def load_from_nazghul_scm(fname):
-    """ Load a TerrainMap from a nazghul .scm file. This scans for (kern-mk-map
-    ...) and attempts to parse out the ASCII map representation."""
-
-    words = open(fname).read().split()
-    idx = words.index('(kern-mk-map')
-    words = words[idx + 1:]
-    idx = words.index('(list')
-    words = words[idx + 1:]
-    idx = words.index(')')
-    lines = ' '.join(words[:idx - 1]).split('" "')
-    tmap = []
+# Scheme tokens: whitespace and comments (dropped), complete strings, a
+# string left open at the end of the line, parens and (possibly quoted)
+# atoms.
+SCM_TOKEN = re.compile(r'(?P<skip>\s+|;.*)'
+                       r'|(?P<string>"(?:[^"\\]|\\.)*")'
+                       r'|(?P<open>"(?:[^"\\]|\\.)*$)'
+                       r"|[()]|'?[^\s()\";']+|'")
+
+
+def tokenize_scm(lines):
+    """ Generate the tokens of scheme source read from an iterable of lines
+    (such as an open file), without reading it all into memory. Strings are
+    generated with their surrounding double-quotes so they can be told apart
+    from atoms; comments are dropped. """
+    pending = ''
     for line in lines:
-        line = line.replace('"', '').split(' ')
-        while '' in line:
-            line.remove('')
-        line = [translate_nazghul_glyph(g) for g in line]
-        tmap.append(line)
-
-    # Note that tmap is in row, column order. The TerrainMap class reverses
-    # this in the accessors.
-    return TerrainMap(terrain=tmap)
-
-def translate_color(x):
-    return {
-        -16777088: terrain.Trail,
-         -16776961: terrain.Grass, # fixme:Lava,
-         -16760832: terrain.HeavyForest,
-         -16744448: terrain.Forest,
-         -16744320: terrain.Fields,
-         -16711936: terrain.Grass,
-         -12566464: terrain.Mountains,
-         -8388608: terrain.Sea,
-         -8388480: terrain.Bog,
-         -8355712: terrain.Hills,
-         -65536: terrain.Lake,
-         -65281: terrain.Grass, #fixme: towns
-         -256: terrain.Water,
-         -1: terrain.Mountains #fixme: peaks
-         }.get(x)
-
-def load_from_image(fname):
+        if pending:
+            line = pending + line
+            pending = ''
+        for match in SCM_TOKEN.finditer(line):
+            if match.lastgroup == 'skip':
+                continue
+            if match.lastgroup == 'open':
+                pending = match.group()
+                break
+            yield match.group()
+    if pending:
+        raise ValueError('unterminated string: {}'.format(pending[:20]))
+
+
+def _read_nazghul_map(tokens):
+    """ Read the rest of a (kern-mk-map 'tag width height palette (list
+    "row" ...)) form, after the 'kern-mk-map' token, and return (tag,
+    TerrainMap). Returns None if the form does not look like that, and
+    raises ValueError if its rows are not all the same width. """
+    tag = next(tokens).lstrip("'")
+    next(tokens)  # width
+    next(tokens)  # height
+    next(tokens)  # palette
+    if next(tokens) != '(' or next(tokens) != 'list':
+        return None
+    tmap = TerrainMap(terrain_ids=array.array('H'))
+    glyph_ids = {}
+    for token in tokens:
+        if token == ')':
+            break
+        row = token[1:-1].split()
+        if tmap.height and len(row) != tmap.width:
+            raise ValueError('row {} of {} is {} tiles wide, not {}'.format(
+                tmap.height, tag, len(row), tmap.width))
+        for glyph in row:
+            try:
+                terrain_id = glyph_ids[glyph]
+            except KeyError:
+                terrain_id = tmap.get_terrain_id(translate_nazghul_glyph(glyph))
+                glyph_ids[glyph] = terrain_id
+            tmap.terrain_ids.append(terrain_id)
+        tmap.width = len(row)
+        tmap.height += 1
+    return tag, tmap
+
+
+def iter_nazghul_maps(fname):
+    """ Generate (tag, TerrainMap) for every (kern-mk-map ...) form in a
+    nazghul .scm file, in a single streaming pass over the file. """
+    with open(fname) as sfile:
+        tokens = tokenize_scm(sfile)
+        prev = None
+        for token in tokens:
+            if token == 'kern-mk-map' and prev == '(':
+                result = _read_nazghul_map(tokens)
+                if result is None:
+                    logging.warn('{}: skipping unrecognized kern-mk-map'.
+                                 format(fname))
+                else:
+                    yield result
+            prev = token
+
+
+def load_from_nazghul_scm(fname):
+    """ Load a TerrainMap from a nazghul .scm file. This returns the first
+    (kern-mk-map ...) in the file; use iter_nazghul_maps() to get all of
+    them. """
+    for tag, tmap in iter_nazghul_maps(fname):
+        return tmap
+    raise ValueError('{} has no kern-mk-map'.format(fname))
+
+
+def compile_nazghul_directory(src_dir, dst_dir):
+    """ Compile every map in every .scm file under 'src_dir' (see
+    save_compiled()) into 'dst_dir', naming each file after the map's tag.
+    Returns the list of compiled filenames. Raises ValueError if two maps
+    have the same tag. """
+    if not os.path.isdir(dst_dir):
+        os.makedirs(dst_dir)
+    fnames = []
+    sources = {}
+    for dirpath, dirnames, filenames in os.walk(src_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if not filename.endswith('.scm'):
+                continue
+            sname = os.path.join(dirpath, filename)
+            for tag, tmap in iter_nazghul_maps(sname):
+                if tag in sources:
+                    raise ValueError('{}: map {} is already defined in {}'.
+                                     format(sname, tag, sources[tag]))
+                sources[tag] = sname
+                fname = os.path.join(dst_dir, tag + '.map')
+                save_compiled(tmap, fname)
+                fnames.append(fname)
+    return fnames
+
+
+# Map the 32-bit pixel values of the world map image (as signed ints) to
+# terrains.
+IMAGE_COLORS = {
+    -16777088: terrain.Trail,
+    -16776961: terrain.Grass,  # fixme:Lava,
+    -16760832: terrain.HeavyForest,
+    -16744448: terrain.Forest,
+    -16744320: terrain.Fields,
+    -16711936: terrain.Grass,
+    -12566464: terrain.Mountains,
+    -8388608: terrain.Sea,
+    -8388480: terrain.Bog,
+    -8355712: terrain.Hills,
+    -65536: terrain.Lake,
+    -65281: terrain.Grass,  # fixme: towns
+    -256: terrain.Water,
+    -1: terrain.Mountains  # fixme: peaks
+    }
+
+
+class UnknownColorsError(Exception):
+    """ The image has pixels with colors that do not map to any terrain. """
+    def __init__(self, fname, counts):
+        super(UnknownColorsError, self).__init__()
+        self.fname = fname
+        self.counts = counts
+
+    def __str__(self):
+        colors = ', '.join('{} ({} pixels)'.format(color, count) for
+                           color, count in sorted(self.counts.items()))
+        return '{} has unknown colors: {}'.format(self.fname, colors)
+
+
+def decode_pixels(pixels, colors=IMAGE_COLORS, default=None, fname=None):
+    """ Decode a 2d array of pixel values indexed [x][y] (as returned by
+    pygame.surfarray.pixels2d) into a TerrainMap, using 'colors' to map pixel
+    values to terrains. This runs as a single lookup-table pass over the
+    whole array. Pixels with unknown colors become 'default' if one is given,
+    otherwise they are all reported together in an UnknownColorsError. """
+    # Normalize to signed 32 bits and transpose to row-major (y, x) order.
+    pixels = numpy.asarray(pixels, dtype=numpy.uint32).view(numpy.int32).T
+    height, width = pixels.shape
+    tmap = TerrainMap(width=width, height=height, terrain_ids=array.array('H'))
+    keys = numpy.array(sorted(colors), dtype=numpy.int32)
+    lut = [tmap.get_terrain_id(colors[key]) for key in keys]
+    index = numpy.searchsorted(keys, pixels)
+    index[index == len(keys)] = 0
+    unknown = keys[index] != pixels
+    if unknown.any():
+        if default is None:
+            values, counts = numpy.unique(pixels[unknown], return_counts=True)
+            raise UnknownColorsError(fname, dict(zip(values.tolist(),
+                                                     counts.tolist())))
+        index[unknown] = len(lut)
+        lut.append(tmap.get_terrain_id(default))
+    lut = numpy.array(lut, dtype=numpy.uint16)
+    tmap.terrain_ids.fromstring(lut[index].tostring())
+    return tmap
+
+
+def load_from_image(fname, colors=IMAGE_COLORS, default=None):
+    """ Load a TerrainMap from an image file where each pixel is one tile. See
+    decode_pixels() for the meaning of 'colors' and 'default'. """
     surface = pygame.image.load(fname)
     pixels = pygame.surfarray.pixels2d(surface)
-    width, height = surface.get_size()
-    tmap = []
-    for y in xrange(height):
-        line = [translate_color(pixels[x][y]) for x in xrange(width)]
-        tmap.append(line)
-    return TerrainMap(terrain=tmap)
-    
+    return decode_pixels(pixels, colors=colors, default=default, fname=fname)
+
+
+# Bump this when the compiled format or any loader's output changes, so that
+# stale compiled maps are ignored.
+COMPILED_VERSION = 1
+
+COMPILED_MAGIC = 'AZMAP'
+
+
+class CompiledMapError(Exception):
+    """ A compiled map file is not in the expected format. """
+    def __init__(self, fname, reason):
+        super(CompiledMapError, self).__init__()
+        self.fname = fname
+        self.reason = reason
+
+    def __str__(self):
+        return '{}: {}'.format(self.fname, self.reason)
+
+
+def _terrain_name(ter):
+    """ Return the importable name of a terrain type, or '' for None. """
+    if ter is None:
+        return ''
+    return '{}.{}'.format(ter.__module__, ter.__name__)
+
+
+def _terrain_from_name(name):
+    """ Inverse of _terrain_name(). """
+    if not name:
+        return None
+    module_name, class_name = name.rsplit('.', 1)
+    __import__(module_name)
+    return getattr(sys.modules[module_name], class_name)
+
+
+def save_compiled(tmap, fname):
+    """ Save a TerrainMap in compiled form: a magic line, a JSON header line
+    with the dimensions and palette, then the raw little-endian id array. The
+    file is written under a temporary name and renamed into place so readers
+    never see a partial file. """
+    header = {'version': COMPILED_VERSION,
+              'width': tmap.width,
+              'height': tmap.height,
+              'palette': [_terrain_name(ter) for ter in tmap.palette]}
+    ids = tmap.terrain_ids
+    if sys.byteorder != 'little':
+        ids = array.array('H', ids)
+        ids.byteswap()
+    tmpname = fname + '.tmp'
+    with open(tmpname, 'wb') as cfile:
+        cfile.write(COMPILED_MAGIC + '\n')
+        cfile.write(json.dumps(header) + '\n')
+        ids.tofile(cfile)
+    os.rename(tmpname, fname)
+
+
+def load_compiled(fname):
+    """ Load a TerrainMap saved by save_compiled(). The id array is read with
+    a single bulk read, and checked against the palette. """
+    with open(fname, 'rb') as cfile:
+        if cfile.readline().rstrip('\n') != COMPILED_MAGIC:
+            raise CompiledMapError(fname, 'bad magic')
+        try:
+            header = json.loads(cfile.readline())
+            version = header.get('version')
+        except (ValueError, AttributeError):
+            raise CompiledMapError(fname, 'bad header')
+        if version != COMPILED_VERSION:
+            raise CompiledMapError(fname, 'wrong version')
+        try:
+            width = int(header['width'])
+            height = int(header['height'])
+            palette = [_terrain_from_name(name)
+                       for name in header['palette']]
+        except (KeyError, TypeError, ValueError, AttributeError,
+                ImportError):
+            raise CompiledMapError(fname, 'bad header')
+        ids = array.array('H')
+        try:
+            ids.fromfile(cfile, width * height)
+        except EOFError:
+            raise CompiledMapError(fname, 'truncated')
+    if sys.byteorder != 'little':
+        ids.byteswap()
+    if ids and numpy.frombuffer(ids, dtype=numpy.uint16).max() >= \
+            len(palette):
+        raise CompiledMapError(fname, 'terrain id out of palette')
+    return TerrainMap(width=width, height=height, palette=palette,
+                      terrain_ids=ids)
+
+
+def compiled_name(fname, loader, cache_dir=config.MAP_CACHE_DIRECTORY,
+                  **kwargs):
+    """ Return the compiled-map cache filename for loading 'fname' with
+    'loader'. The name is keyed by a hash of the source file contents, the
+    loader and its arguments. """
+    digest = hashlib.sha1()
+    digest.update('{}:{}:{}'.format(COMPILED_VERSION, loader.__name__,
+                                    sorted(kwargs.items())))
+    with open(fname, 'rb') as sfile:
+        digest.update(sfile.read())
+    return os.path.join(cache_dir, '{}-{}.map'.format(os.path.basename(fname),
+                                                      digest.hexdigest()))
+
+
+def load_cached(fname, loader=load_from_image,
+                cache_dir=config.MAP_CACHE_DIRECTORY, **kwargs):
+    """ Load a TerrainMap from 'fname' using 'loader', going through the
+    compiled-map cache. On a miss the map is loaded normally and the compiled
+    form is saved for next time; failing to save only logs a warning. """
+    cname = compiled_name(fname, loader, cache_dir=cache_dir, **kwargs)
+    try:
+        return load_compiled(cname)
+    except IOError:
+        pass
+    except CompiledMapError as exc:
+        logging.warn('ignoring {}'.format(exc))
+    tmap = loader(fname, **kwargs)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        save_compiled(tmap, cname)
+    except (IOError, OSError) as exc:
+        logging.warn('could not save compiled map: {}'.format(exc))
+    return tmap
@@ -0,0 +1,473 @@
+#!/usr/bin/python
+"""
+Pathfinding benchmarks.
+
+Runs fixed, seeded sets of (src, dst) queries through each of the
+pathfinders over the haxima worldmap and generated maze, cave and open-field
+maps, and saves the nodes expanded, wall time and path length of every query
+and the peak memory growth of every run as JSON, for comparing across
+commits:
+
+    $ ./bench.py --output before.json
+    $ git checkout ...
+    $ ./bench.py --output after.json
+
+Each (map, mode) run is done in a child process so that its memory can be
+measured on its own. Nodes are counted with path.SearchStats in a second,
+untimed pass, and are null for the pathfinders that do not take one. The
+libtcod modes are only offered where libtcod can be loaded.
+"""
+
+import argparse
+from azoth import config, executor, hpa, path, pathpool, place, tcodpath, \
+    terrain, terrainmap
+import collections
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import time
+import zlib
+
+MMODE = 'walk'
+
+# Movement costs for MMODE. The walls are those of build.py; the rest give
+# the worldmap and the open field some uneven ground.
+PASSABILITY = {
+    'wall': executor.PASS_NONE,
+    'boulder': executor.PASS_NONE,
+    'water': executor.PASS_NONE,
+    'trees': 1,
+    'forest': 2,
+    'hills': 2,
+    'sludge': 3,
+}
+
+
+def make_rules():
+    """ Return a Ruleset with the benchmark passabilities. """
+    rules = executor.Ruleset()
+    for pclass, cost in PASSABILITY.items():
+        rules.set_passability(MMODE, pclass, cost)
+    return rules
+
+
+def make_maze(rand, size):
+    """ Return a TerrainMap of a perfect maze with corridors one tile wide,
+    carved by a randomized depth-first search. """
+    rows = [[terrain.RockWall] * size for y in range(size)]
+    stack = [(1, 1)]
+    rows[1][1] = terrain.Grass
+    while stack:
+        x, y = stack[-1]
+        ways = [(dx, dy) for dx, dy in ((-2, 0), (2, 0), (0, -2), (0, 2))
+                if 0 < x + dx < size - 1 and 0 < y + dy < size - 1 and
+                rows[y + dy][x + dx] is terrain.RockWall]
+        if not ways:
+            stack.pop()
+            continue
+        dx, dy = rand.choice(ways)
+        rows[y + dy // 2][x + dx // 2] = terrain.Grass
+        rows[y + dy][x + dx] = terrain.Grass
+        stack.append((x + dx, y + dy))
+    return terrainmap.TerrainMap(rows)
+
+
+def make_cave(rand, size, fill=0.45, generations=4):
+    """ Return a TerrainMap of caverns grown from random noise by a cellular
+    automaton. """
+    walls = [[rand.random() < fill for x in range(size)] for y in range(size)]
+    for generation in range(generations):
+        grown = []
+        for y in range(size):
+            row = []
+            for x in range(size):
+                count = 0
+                for ny in range(y - 1, y + 2):
+                    for nx in range(x - 1, x + 2):
+                        if not (0 <= nx < size and 0 <= ny < size) or \
+                                walls[ny][nx]:
+                            count += 1
+                row.append(count >= 5)
+            grown.append(row)
+        walls = grown
+    return terrainmap.TerrainMap(
+        [[terrain.RockWall if wall else terrain.Grass for wall in row]
+         for row in walls])
+
+
+def make_open(rand, size):
+    """ Return a TerrainMap of grassland with scattered boulders and patches
+    of rough ground. """
+    rows = [[terrain.Grass] * size for y in range(size)]
+    for patch in range(size * size // 200):
+        ter = rand.choice((terrain.Forest, terrain.HeavyForest, terrain.Hills))
+        cx = rand.randrange(size)
+        cy = rand.randrange(size)
+        radius = rand.randint(1, 4)
+        for y in range(max(0, cy - radius), min(size, cy + radius + 1)):
+            for x in range(max(0, cx - radius), min(size, cx + radius + 1)):
+                rows[y][x] = ter
+    for boulder in range(size * size // 20):
+        rows[rand.randrange(size)][rand.randrange(size)] = terrain.Boulder
+    return terrainmap.TerrainMap(rows)
+
+
+def load_worldmap():
+    """ Return the haxima worldmap TerrainMap. """
+    mapfile = os.path.join(config.IMAGE_DIRECTORY, 'haxima', 'worldmap.png')
+    return terrainmap.load_cached(mapfile, terrainmap.load_from_image)
+
+
+GENERATORS = collections.OrderedDict([
+    ('maze', make_maze),
+    ('cave', make_cave),
+    ('open', make_open),
+])
+
+
+class Map(object):
+    """ A benchmark map: the same terrain as a Place, for the flat
+    pathfinders, and as a World of sectors, for the hierarchical one. """
+
+    def __init__(self, name, tmap):
+        self.name = name
+        self.place = place.Place(width=tmap.width, height=tmap.height,
+                                 name=name, default_terrain=terrain.Grass)
+        self.place.blit_terrain_map(0, 0, tmap)
+        size = config.SECTOR_SIZE
+        self.world = place.World((tmap.width + size - 1) // size,
+                                 (tmap.height + size - 1) // size,
+                                 default_terrain=terrain.RockWall)
+        for sx in range(self.world.width):
+            for sy in range(self.world.height):
+                region = self.place.get_terrain_region(
+                    sx * size, sy * size, min(size, tmap.width - sx * size),
+                    min(size, tmap.height - sy * size))
+                self.world.get_sector(sx, sy).blit_terrain_map(0, 0, region)
+
+
+def largest_region(grid):
+    """ Return the locations of the largest 4-connected region of passable
+    tiles of a cost grid. """
+    seen = set()
+    best = []
+    for y in range(grid.height):
+        for x in range(grid.width):
+            if (x, y) in seen or not grid.passable(x, y):
+                continue
+            region = [(x, y)]
+            seen.add((x, y))
+            for loc in region:
+                for dx, dy in path.directions:
+                    nxt = (loc[0] + dx, loc[1] + dy)
+                    if nxt not in seen and grid.passable(*nxt):
+                        seen.add(nxt)
+                        region.append(nxt)
+            if len(region) > len(best):
+                best = region
+    return best
+
+
+def make_queries(grid, seed, count):
+    """ Return 'count' (src, dst) pairs, seeded, that are connected. """
+    rand = random.Random(seed)
+    region = sorted(largest_region(grid))
+    return [(rand.choice(region), rand.choice(region)) for i in range(count)]
+
+
+def grid_callbacks(grid):
+    """ Return the 'neighbors' and 'heuristic' callbacks of path.find() over
+    a whole cost grid. """
+    def neighbors(loc):
+        for dx, dy in path.directions:
+            x = loc[0] + dx
+            y = loc[1] + dy
+            if grid.passable(x, y):
+                yield x, y
+
+    def heuristic(loc, dst):
+        return (path.manhattan(loc, dst),
+                grid.costs[loc[1] * grid.width + loc[0]] + 1)
+
+    return neighbors, heuristic
+
+
+def counted(stats):
+    """ Return the nodes expanded according to an optional
+    path.SearchStats. """
+    if stats is None:
+        return None
+    return stats.expanded
+
+
+def run_find(bench, rules, queries, stats):
+    """ The generic A* of path.find(), through callbacks. """
+    grid = rules.get_cost_grid(MMODE, bench.place)
+    neighbors, heuristic = grid_callbacks(grid)
+    for (src, dst), qstats in zip(queries, stats):
+        p = path.find(src, dst, neighbors, heuristic,
+                      max_depth=grid.width * grid.height, stats=qstats)
+        yield p, counted(qstats)
+
+
+def run_grid(bench, rules, queries, stats):
+    """ The flat-array A* that path.search_on_grid() falls back on, run
+    directly: search_on_grid() itself tries jump point search first where the
+    costs are uniform. """
+    grid = rules.get_cost_grid(MMODE, bench.place)
+    max_depth = grid.width * grid.height
+    for (src, dst), qstats in zip(queries, stats):
+        window = path._grid_window(grid, src, dst, (), None, max_depth)
+        p = []
+        if window is not None:
+            bounds, costs, walls = window
+            for done, p in path._search_grid(grid, src, dst, bounds, walls,
+                                             max_depth, None, qstats):
+                pass
+        yield p, counted(qstats)
+
+
+def run_find_on_grid(bench, rules, queries, stats):
+    """ path.find_on_grid(), which picks jump point search where the costs
+    are uniform. """
+    grid = rules.get_cost_grid(MMODE, bench.place)
+    for (src, dst), qstats in zip(queries, stats):
+        yield path.find_on_grid(grid, src, dst,
+                                max_depth=grid.width * grid.height,
+                                stats=qstats), counted(qstats)
+
+
+def run_jps(bench, rules, queries, stats):
+    """ path.jump_point_search(), which ignores costs other than walls. """
+    grid = rules.get_cost_grid(MMODE, bench.place)
+    walls = path.cost_array(grid) < 0
+    for (src, dst), qstats in zip(queries, stats):
+        yield path.jump_point_search(src, dst, walls,
+                                     max_depth=grid.width * grid.height,
+                                     stats=qstats), counted(qstats)
+
+
+def run_hpa(bench, rules, queries, stats):
+    """ hpa.SectorGraph over the World form of the map. """
+    graph = hpa.SectorGraph(bench.world, rules, MMODE)
+    for src, dst in queries:
+        yield graph.find(src, dst), None
+
+
+def run_replanner(bench, rules, queries, stats):
+    """ path.Replanner, kept from one query to the next. """
+    planner = path.Replanner(rules.get_cost_grid(MMODE, bench.place))
+    for src, dst in queries:
+        yield planner.find(src, dst), None
+
+
+def run_flow_field(bench, rules, queries, stats):
+    """ A path.FlowField over the whole map per query, walked downhill. """
+    grid = rules.get_cost_grid(MMODE, bench.place)
+    radius = grid.width + grid.height
+    for src, dst in queries:
+        yield walk(path.FlowField(grid, dst, radius), src, dst), None
+
+
+def walk(field, src, dst):
+    """ Return the path down a flow field from src to dst. """
+    p = []
+    loc = src
+    while loc != dst:
+        loc = field.next_step(loc)
+        if loc is None:
+            return []
+        p.append(loc)
+    return p
+
+
+def run_path_pool(bench, rules, queries, stats):
+    """ A pathpool.PathPool answering all the queries as one batch; each
+    query is charged an equal share of the time. """
+    grid = rules.get_cost_grid(MMODE, bench.place)
+    pool = pathpool.PathPool(rules, bench.place, [MMODE])
+    try:
+        for p in pool.find([(src, dst, MMODE) for src, dst in queries],
+                           max_depth=grid.width * grid.height):
+            yield p, None
+    finally:
+        pool.close()
+
+
+def run_libtcod(bench, rules, queries, stats):
+    """ path.find_on_grid() with the tcodpath backend installed. """
+    grid = rules.get_cost_grid(MMODE, bench.place)
+    tcodpath.install()
+    try:
+        for src, dst in queries:
+            yield path.find_on_grid(grid, src, dst,
+                                    max_depth=grid.width * grid.height), None
+    finally:
+        tcodpath.uninstall()
+
+
+def run_libtcod_field(bench, rules, queries, stats):
+    """ Like flow_field, with the whole-map fields made by libtcod's
+    Dijkstra. """
+    grid = rules.get_cost_grid(MMODE, bench.place)
+    radius = grid.width + grid.height
+    tcodpath.install()
+    try:
+        for src, dst in queries:
+            yield walk(path.flow_field(grid, dst, radius), src, dst), None
+    finally:
+        tcodpath.uninstall()
+
+
+# The modes that can count their nodes with a path.SearchStats; the others
+# ignore 'stats'.
+COUNTED = set(['find', 'grid', 'find_on_grid', 'jps'])
+
+MODES = collections.OrderedDict([
+    ('find', run_find),
+    ('grid', run_grid),
+    ('find_on_grid', run_find_on_grid),
+    ('jps', run_jps),
+    ('hpa', run_hpa),
+    ('replanner', run_replanner),
+    ('flow_field', run_flow_field),
+    ('path_pool', run_path_pool),
+])
+
+if tcodpath.available:
+    MODES['libtcod'] = run_libtcod
+    MODES['libtcod_field'] = run_libtcod_field
+
+
+def peak_kb():
+    """ Return the peak resident set size of this process in KB. """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run(bench, mode, queries, results):
+    """ Run the queries through one mode, putting the record of the run on
+    the 'results' queue. Meant to be the target of a child process. """
+    rules = make_rules()
+    grid = rules.get_cost_grid(MMODE, bench.place)
+    before = peak_kb()
+    records = []
+    start = time.time()
+    for (src, dst), (p, nodes) in zip(
+            queries, MODES[mode](bench, rules, queries, [None] * len(queries))):
+        now = time.time()
+        records.append({
+            'src': src,
+            'dst': dst,
+            'nodes': None,
+            'seconds': now - start,
+            'length': len(p),
+            'cost': sum(grid.costs[y * grid.width + x] + 1 for x, y in p),
+            'found': bool(p) or src == dst,
+        })
+        start = time.time()
+    if mode in COUNTED:
+        # Count in a second pass, to keep the instrumentation out of the
+        # timings.
+        stats = [path.SearchStats() for query in queries]
+        for record, (p, nodes) in zip(records,
+                                      MODES[mode](bench, rules, queries,
+                                                  stats)):
+            record['nodes'] = nodes
+    if mode == 'path_pool':
+        share = sum(record['seconds'] for record in records) / len(records)
+        for record in records:
+            record['seconds'] = share
+    results.put({
+        'map': bench.name,
+        'width': bench.place.width,
+        'height': bench.place.height,
+        'mode': mode,
+        'peak_kb': peak_kb() - before,
+        'queries': records,
+    })
+
+
+def git_revision():
+    """ Return the current commit, or None outside a git checkout. """
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                           stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summarize(run):
+    """ Return a one-line summary of a run. """
+    queries = run['queries']
+    nodes = [q['nodes'] for q in queries if q['nodes'] is not None]
+    return '{:<12} {:<13} {:>9.2f} {:>10} {:>8.1f} {:>6}/{:<4} {:>8}'.format(
+        run['map'], run['mode'],
+        1000 * sum(q['seconds'] for q in queries) / len(queries),
+        sum(nodes) // len(nodes) if nodes else '-',
+        sum(q['length'] for q in queries) / float(len(queries)),
+        sum(q['found'] for q in queries), len(queries), run['peak_kb'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pathfinding')
+    parser.add_argument('--output', metavar='file', default='bench.json',
+                        help='Where to save the results')
+    parser.add_argument('--queries', type=int, default=10,
+                        help='Queries per map')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[64, 128, 256],
+                        help='Sizes of the generated maps')
+    parser.add_argument('--maps', nargs='+',
+                        default=['worldmap'] + GENERATORS.keys(),
+                        choices=['worldmap'] + GENERATORS.keys())
+    parser.add_argument('--modes', nargs='+', default=MODES.keys(),
+                        choices=MODES.keys())
+    parser.add_argument('--seed', type=int, default=0)
+    cmdargs = parser.parse_args()
+
+    benches = []
+    if 'worldmap' in cmdargs.maps:
+        benches.append(Map('worldmap', load_worldmap()))
+    for kind in cmdargs.maps:
+        if kind in GENERATORS:
+            for size in cmdargs.sizes:
+                name = '{}-{}'.format(kind, size)
+                rand = random.Random(zlib.crc32(name) + cmdargs.seed)
+                benches.append(Map(name, GENERATORS[kind](rand, size)))
+
+    runs = []
+    print '{:<12} {:<13} {:>9} {:>10} {:>8} {:>11} {:>8}'.format(
+        'map', 'mode', 'ms/query', 'nodes', 'length', 'found', 'peak KB')
+    for bench in benches:
+        grid = make_rules().get_cost_grid(MMODE, bench.place)
+        queries = make_queries(grid, zlib.crc32(bench.name) + cmdargs.seed,
+                               cmdargs.queries)
+        for mode in cmdargs.modes:
+            results = multiprocessing.Queue()
+            child = multiprocessing.Process(target=run,
+                                            args=(bench, mode, queries,
+                                                  results))
+            child.start()
+            runs.append(results.get())
+            child.join()
+            print summarize(runs[-1])
+
+    with open(cmdargs.output, 'w') as output:
+        json.dump({
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'time': time.time(),
+            'seed': cmdargs.seed,
+            'mmode': MMODE,
+            'passability': PASSABILITY,
+            'runs': runs,
+        }, output, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,7 +11,7 @@ def generate():
     sesh = session.Session()
 
     mapfile = os.path.join(config.IMAGE_DIRECTORY, 'haxima', 'worldmap.png')
-    tmap = terrainmap.load_from_image(mapfile)
+    tmap = terrainmap.load_cached(mapfile, terrainmap.load_from_image)
     sesh.world = place.Place(name='world', width=tmap.width, height=tmap.height,
                              default_terrain=terrain.Grass)
     sesh.world.blit_terrain_map(0, 0, tmap)
@@ -0,0 +1,213 @@
+#!/usr/bin/python
+"""
+Field of view benchmarks.
+
+Computes the view from a fixed, seeded set of spots on the haxima worldmap
+with each of the fov algorithms at a few radii, and saves the time per view
+and, where libtcod can be loaded, how many tiles of each view agree with
+libtcod's, as JSON. A seeded random walk is then looked at through an
+fov.FovCache, for its hit rate and time per step, and a crowd of beings
+scattered over the map is asked who sees whom, once with a whole field of
+view per being and once through a perception.Perception:
+
+    $ ./fovbench.py --output fov.json
+"""
+
+import argparse
+from azoth import config, fov, perception, place, terrain
+import bench
+import json
+import platform
+import random
+import time
+
+
+def make_place():
+    """ Return the worldmap as a Place. """
+    tmap = bench.load_worldmap()
+    pla = place.Place(width=tmap.width, height=tmap.height, name='worldmap',
+                      default_terrain=terrain.Grass)
+    pla.blit_terrain_map(0, 0, tmap)
+    return pla
+
+
+def make_spots(transparent, seed, count):
+    """ Return 'count' seeded spots that do not block sight. """
+    rand = random.Random(seed)
+    ys, xs = transparent.nonzero()
+    return [(int(xs[i]), int(ys[i]))
+            for i in (rand.randrange(len(xs)) for n in range(count))]
+
+
+def run(transparent, name, spots, radius):
+    """ Return the views from each spot and the seconds it took. """
+    algo = fov.ALGORITHMS[name]
+    # Warm up, so libtcod's map is loaded before the clock starts.
+    algo(transparent, spots[0][0], spots[0][1], radius)
+    start = time.time()
+    views = [algo(transparent, x, y, radius) for x, y in spots]
+    return views, time.time() - start
+
+
+def make_walk(transparent, seed, start, steps):
+    """ Return a seeded random walk of 'steps' steps over the tiles that do
+    not block sight. """
+    rand = random.Random(seed)
+    height, width = transparent.shape
+    x, y = start
+    walk = [start]
+    for i in range(steps):
+        dx, dy = rand.choice([(0, 1), (0, -1), (1, 0), (-1, 0)])
+        if 0 <= x + dx < width and 0 <= y + dy < height and \
+                transparent[y + dy, x + dx]:
+            x += dx
+            y += dy
+        walk.append((x, y))
+    return walk
+
+
+def run_walk(pla, walk, radius):
+    """ Look from every spot of a walk through a fresh cache; return the
+    cache and the seconds it took. """
+    cache = fov.FovCache(pla.get_transparency(), config.FOV_CACHE_SIZE)
+    start = time.time()
+    for x, y in walk:
+        cache.compute(x, y, radius)
+    return cache, time.time() - start
+
+
+class Being(object):
+    """ Just enough of a being to be seen. """
+
+    def __init__(self, pla, xy):
+        self.xy = xy
+        pla.set_occupant(xy[0], xy[1], self)
+
+
+def run_crowd(pla, beings, radius):
+    """ Return the seconds it takes every being to find whom it sees: with a
+    view each, through a Perception, and through it again later in the same
+    turn; and the Perception, for its counts. """
+    clear = pla.get_transparency().clear
+    start = time.time()
+    for being in beings:
+        view = fov.compute(clear, being.xy[0], being.xy[1], radius)
+        [other for other in beings
+         if other is not being and view.is_visible(*other.xy)]
+    views = time.time() - start
+    seer = perception.Perception(pla)
+    start = time.time()
+    seer.visible(beings, radius)
+    batch = time.time() - start
+    start = time.time()
+    seer.visible(beings, radius)
+    shared = time.time() - start
+    return views, batch, shared, seer
+
+
+def agreement(views, reference):
+    """ Return the fraction of tiles on which two lists of views agree. """
+    same = sum((view.visible == other.visible).sum()
+               for view, other in zip(views, reference))
+    return float(same) / sum(view.visible.size for view in views)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark field of view')
+    parser.add_argument('--output', metavar='file', default='fov.json',
+                        help='Where to save the results')
+    parser.add_argument('--spots', type=int, default=500,
+                        help='Spots to look from')
+    parser.add_argument('--radii', type=int, nargs='+', default=[5, 11, 20])
+    parser.add_argument('--algorithms', nargs='+',
+                        default=sorted(fov.ALGORITHMS),
+                        choices=sorted(fov.ALGORITHMS))
+    parser.add_argument('--steps', type=int, default=2000,
+                        help='Steps of the cached walk')
+    parser.add_argument('--beings', type=int, default=500,
+                        help='Beings in the crowd')
+    parser.add_argument('--seed', type=int, default=0)
+    cmdargs = parser.parse_args()
+
+    pla = make_place()
+    transparent = pla.get_transparency().clear
+    spots = make_spots(transparent, cmdargs.seed, cmdargs.spots)
+    runs = []
+    print '{:<15} {:>6} {:>9} {:>9}'.format('algorithm', 'radius', 'ms/view',
+                                            'agree')
+    for radius in cmdargs.radii:
+        reference = None
+        if 'libtcod' in fov.ALGORITHMS:
+            reference = run(transparent, 'libtcod', spots, radius)[0]
+        for name in cmdargs.algorithms:
+            views, seconds = run(transparent, name, spots, radius)
+            agree = agreement(views, reference) if reference else None
+            runs.append({
+                'algorithm': name,
+                'radius': radius,
+                'seconds': seconds / len(spots),
+                'agreement': agree,
+            })
+            print '{:<15} {:>6} {:>9.3f} {:>9}'.format(
+                name, radius, 1000 * seconds / len(spots),
+                '-' if agree is None else '{:.4f}'.format(agree))
+
+    walks = []
+    walk = make_walk(transparent, cmdargs.seed, spots[0], cmdargs.steps)
+    print
+    print '{:<15} {:>6} {:>9} {:>9}'.format('walk', 'radius', 'ms/step',
+                                            'hits')
+    for radius in cmdargs.radii:
+        cache, seconds = run_walk(pla, walk, radius)
+        walks.append({
+            'algorithm': config.FOV_ALGORITHM,
+            'radius': radius,
+            'steps': len(walk),
+            'seconds': seconds / len(walk),
+            'hits': cache.hits,
+            'misses': cache.misses,
+            'compute_seconds': cache.seconds,
+        })
+        print '{:<15} {:>6} {:>9.3f} {:>9.4f}'.format(
+            config.FOV_ALGORITHM, radius, 1000 * seconds / len(walk),
+            cache.hits / float(len(walk)))
+
+    crowds = []
+    beings = [Being(pla, xy) for xy in set(
+        make_spots(transparent, cmdargs.seed + 1, cmdargs.beings))]
+    print
+    print '{:<8} {:>6} {:>11} {:>11} {:>11} {:>8}'.format(
+        'beings', 'radius', 'views ms', 'batch ms', 'shared ms', 'traced')
+    for radius in cmdargs.radii:
+        views, batch, shared, seer = run_crowd(pla, beings, radius)
+        crowds.append({
+            'beings': len(beings),
+            'radius': radius,
+            'views_seconds': views,
+            'batch_seconds': batch,
+            'shared_seconds': shared,
+            'traced': seer.traced,
+            'shared': seer.shared,
+            'culled': seer.culled,
+        })
+        print '{:<8} {:>6} {:>11.2f} {:>11.2f} {:>11.2f} {:>8}'.format(
+            len(beings), radius, 1000 * views, 1000 * batch, 1000 * shared,
+            seer.traced)
+
+    with open(cmdargs.output, 'w') as output:
+        json.dump({
+            'revision': bench.git_revision(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'time': time.time(),
+            'seed': cmdargs.seed,
+            'spots': cmdargs.spots,
+            'runs': runs,
+            'cache_size': config.FOV_CACHE_SIZE,
+            'walks': walks,
+            'crowds': crowds,
+        }, output, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,7 @@
 
 import argparse
 from azoth import baseobject, being, config, gui, session, sprite, \
-    terrain, weapon
+    tcodpath, terrain, weapon
 import build
 import inspect
 import json
@@ -32,6 +32,10 @@ if __name__ == "__main__":
         format='%(asctime)s|%(threadName)s|%(levelname)s|%(filename)s:'\
             '%(funcName)s:%(lineno)d|%(message)s')
 
+    # Pick the pathfinding engine.
+    if config.PATH_BACKEND == 'libtcod':
+        tcodpath.install()
+
     # Initialize pygame.
     pygame.init()
     pygame.display.set_caption('Azoth')
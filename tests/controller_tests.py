@@ -0,0 +1,51 @@
+import numpy
+import unittest
+from tools import eq_, ok_
+from azoth import baseobject, config, controller, place, session, terrain
+
+
+class PlayerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.session = session.Session()
+        self.place = place.Sector(name='field', default_terrain=terrain.Grass)
+        self.place.set_terrain(10, 5, terrain.RockWall)
+        self.place.explore(0, 0, numpy.ones((self.place.height,
+                                             self.place.width), dtype=bool))
+        self.subject = baseobject.BaseObject()
+        self.subject.mmode = 'walk'
+        self.session.hax2.put_being_on_map(self.subject, self.place, 0, 0)
+        self.player = controller.Player(self.subject, self.session)
+        self.stats = config.PATHFIND_STATS
+        config.PATHFIND_STATS = True
+
+    def tearDown(self):
+        config.PATHFIND_STATS = self.stats
+
+    def test_jump(self):
+        # Uniform ground is searched by jumping, in one go.
+        p = self.player.pathfind_to(20, 10)
+        eq_(30, len(p))
+        eq_(None, self.player.search)
+        ok_(self.player.stats.calls['jump'] > 0)
+
+    def test_weighted(self):
+        self.place.set_terrain(3, 3, terrain.Bog)
+        self.session.rules.set_passability('walk', 'sludge', 3)
+        self.player.pathfind_to(20, 10)
+        eq_(0, self.player.stats.calls['jump'])
+
+    def test_replan_explored(self):
+        pla = place.Sector(name='fog', default_terrain=terrain.Grass)
+        self.session.hax2.remove_being_from_map(self.subject)
+        self.session.hax2.put_being_on_map(self.subject, pla, 0, 0)
+        # A ring around an unexplored row.
+        ring = numpy.ones((3, 5), dtype=bool)
+        ring[1, 1:4] = False
+        pla.explore(0, 0, ring)
+        self.player.path = [(1, 0), (2, 0), (3, 0), (4, 0)]
+        eq_(8, len(self.player.replan((2, 0))))
+        # Newly explored tiles are used from the next replan on.
+        pla.explore(0, 1, numpy.ones((1, 5), dtype=bool))
+        eq_([(0, 1), (1, 1), (2, 1), (3, 1), (4, 1), (4, 0)],
+            self.player.replan((2, 0)))
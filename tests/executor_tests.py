@@ -1,6 +1,8 @@
 from tools import *
-from azoth import baseobject, being, executor, place, terrain, terrainmap
+from azoth import baseobject, being, config, executor, place, terrain, \
+    terrainmap
 from azoth.container import Bag
+import pickle
 import unittest
 
 
@@ -66,6 +68,92 @@ class Passability(unittest.TestCase):
                       self.obj, self.place, 6, 5)
 
 
+class CostGridTest(unittest.TestCase):
+
+    def setUp(self):
+        self.place = place.Place(3, 2, default_terrain=terrain.Grass)
+        self.rules = executor.Ruleset()
+        self.rules.set_passability('walk', 'wall', executor.PASS_NONE)
+        self.rules.set_passability('walk', 'sludge', 2)
+        self.grid = self.rules.get_cost_grid('walk', self.place)
+
+    def test_compiled(self):
+        eq_([0] * 6, list(self.grid.costs))
+        ok_(self.grid is self.rules.get_cost_grid('walk', self.place))
+        ok_(self.grid.passable(2, 1))
+        ok_(not self.grid.passable(3, 1))
+        assert_raises(place.OffMapError, self.grid.get, 0, 2)
+
+    def test_set_terrain(self):
+        version = self.grid.version
+        self.place.set_terrain(1, 1, terrain.RockWall)
+        self.place.set_terrain(2, 0, terrain.Bog)
+        eq_([0, 0, 2, 0, executor.PASS_NONE, 0], list(self.grid.costs))
+        ok_(not self.grid.passable(1, 1))
+        ok_(self.grid.version > version)
+
+    def test_blit(self):
+        tmap = terrainmap.TerrainMap(terrain=[[terrain.Bog, terrain.RockWall]])
+        self.place.blit_terrain_map(1, 1, tmap)
+        eq_([0, 0, 0, 0, 2, executor.PASS_NONE], list(self.grid.costs))
+
+    def test_set_passability(self):
+        self.place.set_terrain(0, 0, terrain.Water)
+        self.rules.set_passability('walk', 'water', executor.PASS_NONE)
+        ok_(not self.grid.passable(0, 0))
+        eq_(0, self.rules.get_cost_grid('fly', self.place).get(0, 0))
+
+    def test_flow_field(self):
+        field = self.rules.get_flow_field('walk', self.place, (2, 0), 5)
+        ok_(field is self.rules.get_flow_field('walk', self.place, (2, 0), 5))
+        eq_(3, field.get(0, 1))
+        moved = self.rules.get_flow_field('walk', self.place, (2, 1), 5)
+        ok_(moved is not field)
+        self.place.set_terrain(1, 1, terrain.RockWall)
+        changed = self.rules.get_flow_field('walk', self.place, (2, 1), 5)
+        ok_(changed is not moved)
+        eq_(4, changed.get(0, 1))
+
+    def test_flow_fields(self):
+        # Two targets in the same place keep a field each.
+        first = self.rules.get_flow_field('walk', self.place, (2, 0), 5)
+        second = self.rules.get_flow_field('walk', self.place, (0, 1), 5)
+        ok_(first is self.rules.get_flow_field('walk', self.place, (2, 0), 5))
+        ok_(second is self.rules.get_flow_field('walk', self.place, (0, 1),
+                                                5))
+        for x in range(config.FLOW_FIELD_CACHE_SIZE):
+            self.rules.get_flow_field('walk', self.place, (x % 3, 0), x + 6)
+        eq_(config.FLOW_FIELD_CACHE_SIZE, len(self.rules.fields))
+        ok_(first is not self.rules.get_flow_field('walk', self.place, (2, 0),
+                                                   5))
+
+    def test_regions(self):
+        regions = self.rules.get_regions('walk', self.place)
+        ok_(regions is self.rules.get_regions('walk', self.place))
+        ok_(regions.connected((0, 0), (2, 1)))
+        self.place.set_terrain(1, 0, terrain.RockWall)
+        self.place.set_terrain(1, 1, terrain.RockWall)
+        ok_(not regions.connected((0, 0), (2, 1)))
+
+    def test_perception(self):
+        seer = self.rules.get_perception(self.place)
+        ok_(seer is self.rules.get_perception(self.place))
+        ok_(seer.can_see((0, 0), (2, 1), 5))
+        self.rules.end_turn()
+        eq_({}, seer.seen)
+
+    def test_not_saved(self):
+        self.rules.get_flow_field('walk', self.place, (0, 0), 5)
+        self.rules.get_regions('walk', self.place)
+        self.rules.get_perception(self.place)
+        rules = pickle.loads(pickle.dumps(self.rules))
+        eq_({}, rules.grids)
+        eq_(0, len(rules.fields))
+        eq_({}, rules.regions)
+        eq_({}, rules.perceptions)
+        eq_(executor.PASS_NONE, rules.get_pclass_cost('walk', 'wall'))
+
+
 class Default(unittest.TestCase):
     def setUp(self):
         self.rules = executor.Ruleset()
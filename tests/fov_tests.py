@@ -0,0 +1,149 @@
+import numpy
+import random
+import unittest
+from tools import eq_, ok_
+from azoth import config, fov, place, terrain
+
+
+def clear(*rows):
+    """ Return the transparency of a map drawn with '#' for walls. """
+    return numpy.array([[c != '#' for c in row] for row in rows])
+
+
+def seen(view, transparent):
+    """ Draw what a view sees of a map: 'o' is visible, '.' is not. """
+    height, width = transparent.shape
+    return [''.join('o' if view.is_visible(x, y) else '.'
+                    for x in range(width)) for y in range(height)]
+
+
+class ShadowcastTest(unittest.TestCase):
+
+    def test_open(self):
+        transparent = clear(*['.' * 7] * 7)
+        view = fov.shadowcast(transparent, 3, 3, 2)
+        eq_(['.......',
+             '...o...',
+             '..ooo..',
+             '.ooooo.',
+             '..ooo..',
+             '...o...',
+             '.......'], seen(view, transparent))
+        eq_((1, 1), (view.left, view.top))
+        eq_((5, 5), view.visible.shape)
+
+    def test_walls(self):
+        transparent = clear('.......',
+                            '.......',
+                            '...#...',
+                            '.......',
+                            '.......')
+        view = fov.shadowcast(transparent, 3, 4, 4)
+        eq_(['.......',
+             '.oo.oo.',
+             'ooooooo',
+             'ooooooo',
+             'ooooooo'], seen(view, transparent))
+        view = fov.shadowcast(transparent, 3, 4, 4, light_walls=False)
+        ok_(not view.is_visible(3, 2))
+        ok_(view.is_visible(2, 2))
+
+    def test_corridor(self):
+        transparent = clear('#########',
+                            '.........',
+                            '#########')
+        view = fov.shadowcast(transparent, 0, 1, 10)
+        eq_(['ooooooooo',
+             'ooooooooo',
+             'ooooooooo'], seen(view, transparent))
+        view = fov.shadowcast(transparent, 0, 1, 10, light_walls=False)
+        eq_(['.........',
+             'ooooooooo',
+             '.........'], seen(view, transparent))
+
+    def test_edges(self):
+        transparent = clear(*['....'] * 4)
+        view = fov.shadowcast(transparent, 0, 0, 2)
+        eq_(['ooo.',
+             'oo..',
+             'o...',
+             '....'], seen(view, transparent))
+        ok_(not view.is_visible(-1, 0))
+
+    def test_symmetric_pillars(self):
+        rand = random.Random(0)
+        rows = [''.join('#' if rand.random() < 0.2 else '.'
+                        for x in range(21)) for y in range(21)]
+        transparent = clear(*rows)
+        transparent[10, 10] = True
+        # Rotating the map a quarter turn rotates the view with it.
+        view = fov.shadowcast(transparent, 10, 10, 8)
+        turned = fov.shadowcast(numpy.rot90(transparent).copy(), 10, 10, 8)
+        eq_(numpy.rot90(view.visible).tolist(), turned.visible.tolist())
+
+
+class ComputeTest(unittest.TestCase):
+
+    def test_algorithms(self):
+        ok_(fov.ALGORITHMS['shadowcast'] is fov.shadowcast)
+        transparent = clear('...', '...')
+        for name in fov.ALGORITHMS:
+            view = fov.compute(transparent, 0, 0, 1, algorithm=name)
+            ok_(view.is_visible(0, 0))
+            ok_(view.is_visible(1, 0))
+            ok_(not view.is_visible(2, 0))
+
+    def test_fallback(self):
+        transparent = clear('...')
+        view = fov.compute(transparent, 0, 0, 5, algorithm='nonesuch')
+        eq_([[True, True, True]], view.visible.tolist())
+        eq_('shadowcast', config.FOV_ALGORITHM)
+        eq_([[True, True, True]],
+            fov.compute(transparent, 0, 0, 5).visible.tolist())
+
+    @unittest.skipIf('libtcod_shadow' not in fov.ALGORITHMS,
+                     'libtcod is not available')
+    def test_like_libtcod(self):
+        rand = random.Random(1)
+        rows = [''.join('#' if rand.random() < 0.2 else '.'
+                        for x in range(40)) for y in range(40)]
+        transparent = clear(*rows)
+        transparent[20, 20] = True
+        view = fov.shadowcast(transparent, 20, 20, 11)
+        other = fov.compute(transparent, 20, 20, 11,
+                            algorithm='libtcod_shadow')
+        same = (view.visible == other.visible).sum()
+        ok_(same >= 0.95 * view.visible.size)
+
+
+class FovCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.place = place.Place(40, 20, default_terrain=terrain.Grass)
+        self.cache = fov.FovCache(self.place.get_transparency(), 2)
+
+    def test_hits(self):
+        view = self.cache.compute(5, 5, 3)
+        ok_(view is self.cache.compute(5, 5, 3))
+        ok_(view is not self.cache.compute(5, 5, 4))
+        ok_(view is not self.cache.compute(5, 5, 3, light_walls=False))
+        eq_((1, 3), (self.cache.hits, self.cache.misses))
+        eq_(1, self.cache.evictions)
+        # The least recently used view went first.
+        ok_(view is not self.cache.compute(5, 5, 3))
+        ok_(self.cache.seconds > 0)
+
+    def test_algorithm(self):
+        view = self.cache.compute(5, 5, 3)
+        ok_(view is not self.cache.compute(5, 5, 3, algorithm='nonesuch'))
+        ok_(view is self.cache.compute(5, 5, 3, algorithm='shadowcast'))
+
+    def test_terrain(self):
+        view = self.cache.compute(5, 5, 3)
+        # Out of reach.
+        self.place.set_terrain(35, 15, terrain.RockWall)
+        ok_(view is self.cache.compute(5, 5, 3))
+        self.place.set_terrain(6, 5, terrain.RockWall)
+        view = self.cache.compute(5, 5, 3)
+        ok_(not view.is_visible(7, 5))
+        eq_(1, self.cache.hits)
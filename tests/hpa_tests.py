@@ -0,0 +1,91 @@
+import unittest
+from tools import eq_, ok_
+from azoth import config, executor, hpa, path, place, terrain
+
+S = config.SECTOR_SIZE
+
+
+class SectorGraphTest(unittest.TestCase):
+
+    def setUp(self):
+        self.world = place.World(3, 2, default_terrain=terrain.Grass)
+        self.rules = executor.Ruleset()
+        self.rules.set_passability('walk', 'wall', executor.PASS_NONE)
+        self.rules.set_passability('walk', 'sludge', 3)
+        self.graph = hpa.SectorGraph(self.world, self.rules, 'walk')
+
+    def set_terrain(self, x, y, ter):
+        sector = self.world.get_sector(x // S, y // S)
+        sector.set_terrain(x % S, y % S, ter)
+
+    def passable(self, x, y):
+        if not (0 <= x < S * self.world.width and
+                0 <= y < S * self.world.height):
+            return False
+        grid = self.graph.get_grid(x // S, y // S)
+        return grid.passable(x % S, y % S)
+
+    def cost(self, x, y):
+        return self.graph._enter_cost((x, y))
+
+    def check_path(self, src, dst, p):
+        """ Assert p is a valid path and return its cost. """
+        prev = src
+        total = 0
+        for loc in p:
+            eq_(1, path.manhattan(prev, loc))
+            ok_(self.passable(*loc))
+            total += self.cost(*loc)
+            prev = loc
+        eq_(prev, dst)
+        return total
+
+    def flat_cost(self, src, dst):
+        """ Return the cost of the best path found by flat A*. """
+        def neighbors(loc):
+            for dx, dy in path.directions:
+                if self.passable(loc[0] + dx, loc[1] + dy):
+                    yield loc[0] + dx, loc[1] + dy
+        def heuristic(loc, dst):
+            return path.manhattan(loc, dst), self.cost(*loc)
+        p = path.find(src, dst, neighbors, heuristic, max_depth=10000)
+        return self.check_path(src, dst, p)
+
+    def test_open(self):
+        src = (1, 1)
+        dst = (3 * S - 2, 2 * S - 2)
+        p = self.graph.find(src, dst)
+        eq_(path.manhattan(src, dst), self.check_path(src, dst, p))
+
+    def test_same_sector(self):
+        p = self.graph.find((1, 1), (5, 1))
+        eq_([(2, 1), (3, 1), (4, 1), (5, 1)], p)
+
+    def test_walls(self):
+        # A wall down the middle of the first column of sectors, open only
+        # at the bottom, and a bog in the way.
+        for y in range(2 * S - 3):
+            self.set_terrain(S + 5, y, terrain.RockWall)
+        for x in range(S, 2 * S):
+            self.set_terrain(x, S + 3, terrain.Bog)
+        src = (2, 2)
+        dst = (2 * S + 4, 3)
+        cost = self.check_path(src, dst, self.graph.find(src, dst))
+        ok_(cost <= 1.2 * self.flat_cost(src, dst))
+
+    def test_unreachable(self):
+        for y in range(2 * S):
+            self.set_terrain(S, y, terrain.RockWall)
+        eq_([], self.graph.find((0, 0), (2 * S, 0)))
+
+    def test_invalidate(self):
+        src = (S - 3, 10)
+        dst = (S + 3, 10)
+        p = self.graph.find(src, dst)
+        ok_(len(p) <= 6 + hpa.TRANSITION_SPACING // 2)
+        # Wall off the border except at the top.
+        for y in range(1, S):
+            self.set_terrain(S - 1, y, terrain.RockWall)
+        p = self.graph.find(src, dst)
+        self.check_path(src, dst, p)
+        ok_((S - 1, 0) in p)
@@ -0,0 +1,30 @@
+import unittest
+from tools import eq_
+from azoth import lru
+
+
+class LRUTest(unittest.TestCase):
+
+    def test_evict(self):
+        table = lru.LRU(2)
+        table.put('a', 1)
+        table.put('b', 2)
+        eq_(1, table.lookup('a'))
+        table.put('c', 3)
+        # 'b' was the least recently used.
+        self.assertRaises(KeyError, table.lookup, 'b')
+        eq_([('a', 1), ('c', 3)], table.items())
+        eq_(1, table.evictions)
+        eq_(2, len(table))
+
+    def test_put_again(self):
+        table = lru.LRU(2)
+        table.put('a', 1)
+        table.put('b', 2)
+        table.put('a', 3)
+        table.put('c', 4)
+        eq_([('a', 3), ('c', 4)], table.items())
+        eq_(3, table.pop('a'))
+        eq_(None, table.pop('a'))
+        table.clear()
+        eq_(0, len(table))
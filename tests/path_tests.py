@@ -1,6 +1,9 @@
+import array
+import numpy
+import random
 import unittest
 from tools import eq_, ok_
-from azoth import path
+from azoth import executor, path, place, terrain
 
 class PathTest(unittest.TestCase):
 
@@ -164,3 +167,649 @@ class PathTest(unittest.TestCase):
         p = path.find((0, 0), (2, 2), self.neighbors8, self.heuristic)
         eq_(p, [(1, 1), (2, 2)])
         
+    def test_no_reexpansion(self):
+        self.map = ((0, 0, 0, 0, 0, 0),
+                    (0, 9, 9, 9, 9, 0),
+                    (0, 0, 0, 0, 9, 0),
+                    (9, 9, 9, 0, 9, 0),
+                    (0, 0, 0, 0, 0, 0),
+                    (0, 5, 5, 5, 5, 0))
+        expanded = []
+        def neighbors(loc):
+            expanded.append(loc)
+            return self.neighbors4(loc)
+        p = path.find((0, 2), (5, 5), neighbors, self.heuristic)
+        eq_(p[-1], (5, 5))
+        eq_(len(expanded), len(set(expanded)))
+
+
+class Grid(object):
+    """ A minimal cost grid for testing: 9 is impassable. """
+    def __init__(self, rows):
+        self.width = len(rows[0])
+        self.height = len(rows)
+        self.costs = array.array('h', [-1 if c == 9 else c for row in rows
+                                       for c in row])
+        self.version = 0
+
+    def passable(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height and \
+            self.costs[y * self.width + x] >= 0
+
+    @property
+    def walls(self):
+        return path.cost_array(self) < 0
+
+
+def random_rows(rand, width, height, walls=0.25, costs=(0,)):
+    return [[9 if rand.random() < walls else rand.choice(costs)
+             for x in range(width)] for y in range(height)]
+
+
+def check_path(grid, src, dst, p):
+    """ Assert p is a connected 4-neighbor path of passable tiles from src to
+    dst, and return its length. """
+    prev = src
+    for loc in p:
+        eq_(1, abs(loc[0] - prev[0]) + abs(loc[1] - prev[1]))
+        ok_(grid.passable(*loc))
+        prev = loc
+    eq_(prev, dst)
+    return len(p)
+
+
+class JumpPointSearchTest(unittest.TestCase):
+
+    def test_open(self):
+        grid = Grid([[0] * 20] * 20)
+        p = path.jump_point_search((0, 0), (19, 19), grid.walls)
+        eq_(38, check_path(grid, (0, 0), (19, 19), p))
+
+    def test_matches_astar(self):
+        rand = random.Random(1)
+        def neighbors(loc):
+            for dx, dy in path.directions:
+                if grid.passable(loc[0] + dx, loc[1] + dy):
+                    yield loc[0] + dx, loc[1] + dy
+        def heuristic(loc, dst):
+            return path.manhattan(loc, dst), 1
+        for trial in range(40):
+            grid = Grid(random_rows(rand, 16, 12))
+            walls = grid.walls
+            locs = [(x, y) for y in range(grid.height)
+                    for x in range(grid.width) if grid.passable(x, y)]
+            for n in range(10):
+                src = rand.choice(locs)
+                dst = rand.choice(locs)
+                jps = path.jump_point_search(src, dst, walls)
+                astar = path.find(src, dst, neighbors, heuristic)
+                eq_(len(astar), len(jps))
+                if jps:
+                    check_path(grid, src, dst, jps)
+
+    def test_unreachable(self):
+        grid = Grid([[0, 9, 0],
+                     [9, 0, 0]])
+        eq_([], path.jump_point_search((0, 0), (2, 1), grid.walls))
+        eq_([], path.jump_point_search((2, 1), (1, 0), grid.walls))
+
+    def test_max_depth(self):
+        grid = Grid([[0] * 10] * 10)
+        eq_([], path.jump_point_search((0, 0), (9, 9), grid.walls,
+                                       max_depth=17))
+        eq_(18, len(path.jump_point_search((0, 0), (9, 9), grid.walls,
+                                           max_depth=18)))
+
+
+class FindOnGridTest(unittest.TestCase):
+
+    def test_uniform(self):
+        grid = Grid([[0, 9, 0],
+                     [0, 0, 0],
+                     [0, 9, 0]])
+        ok_(path.is_uniform(path.cost_array(grid)))
+        eq_([(0, 1), (1, 1), (2, 1), (2, 2)],
+            path.find_on_grid(grid, (0, 0), (2, 2)))
+
+    def test_weighted(self):
+        grid = Grid([[0, 5, 0],
+                     [0, 5, 0],
+                     [0, 0, 0]])
+        ok_(not path.is_uniform(path.cost_array(grid)))
+        eq_([(0, 1), (0, 2), (1, 2), (2, 2), (2, 1), (2, 0)],
+            path.find_on_grid(grid, (0, 0), (2, 0)))
+
+    def test_blocked(self):
+        grid = Grid([[0, 0, 0],
+                     [0, 0, 0]])
+        eq_([(0, 1), (1, 1), (2, 1), (2, 0)],
+            path.find_on_grid(grid, (0, 0), (2, 0), blocked=[(1, 0)]))
+
+    def test_allowed(self):
+        grid = Grid([[0, 0, 0],
+                     [0, 0, 0]])
+        allowed = numpy.array([[True, False, True],
+                               [True, True, True]])
+        eq_([(0, 1), (1, 1), (2, 1), (2, 0)],
+            path.find_on_grid(grid, (0, 0), (2, 0), allowed=allowed))
+
+    def test_max_depth(self):
+        grid = Grid([[0] * 10] * 10)
+        eq_([], path.find_on_grid(grid, (0, 0), (9, 9), max_depth=5))
+
+
+class SearchTest(unittest.TestCase):
+
+    def test_slices(self):
+        grid = Grid(random_rows(random.Random(5), 40, 30, walls=0.2))
+        src = (0, 0)
+        dst = (39, 29)
+        grid.costs[0] = grid.costs[-1] = 0
+        results = list(path.search_on_grid(grid, src, dst, max_depth=1000,
+                                           batch=50))
+        ok_(len(results) > 2)
+        for done, p in results[:-1]:
+            ok_(not done)
+            if p:
+                check_path(grid, src, p[-1], p)
+        done, p = results[-1]
+        ok_(done)
+        eq_(len(path.find_on_grid(grid, src, dst, max_depth=1000)),
+            check_path(grid, src, dst, p))
+
+    def test_no_batch(self):
+        grid = Grid([[0] * 10] * 10)
+        results = list(path.search_on_grid(grid, (0, 0), (9, 9)))
+        eq_(1, len(results))
+        eq_(True, results[0][0])
+        eq_(18, len(results[0][1]))
+
+    def test_unreachable(self):
+        grid = Grid([[0, 9, 0]])
+        eq_([(True, [])],
+            list(path.search_on_grid(grid, (0, 0), (2, 0), batch=1)))
+        grid = Grid([[0, 9, 1]])
+        eq_([(False, []), (True, [])],
+            list(path.search_on_grid(grid, (0, 0), (2, 0), batch=1)))
+        eq_([(True, [])], list(path.search_on_grid(grid, (0, 0), (2, 0),
+                                                   max_depth=1)))
+
+    def test_jump_first(self):
+        # Uniform costs are searched by jumping, in one go if it fits in a
+        # slice, and a slice at a time if not.
+        grid = Grid(random_rows(random.Random(5), 40, 30, walls=0.2))
+        grid.costs[0] = grid.costs[-1] = 0
+        stats = path.SearchStats()
+        results = list(path.search_on_grid(grid, (0, 0), (39, 29),
+                                           max_depth=1000, batch=1000,
+                                           stats=stats))
+        eq_(1, len(results))
+        ok_(stats.calls['jump'] > 0)
+        expect = path.find_on_grid(grid, (0, 0), (39, 29), max_depth=1000)
+        eq_(expect, results[0][1])
+        results = list(path.search_on_grid(grid, (0, 0), (39, 29),
+                                           max_depth=1000, batch=5))
+        ok_(len(results) > 2)
+        eq_(len(expect), len(results[-1][1]))
+
+    def test_interleaved(self):
+        grid = Grid(random_rows(random.Random(7), 30, 30, walls=0.2,
+                                costs=(0, 1, 2)))
+        grid.costs[0] = grid.costs[-1] = 0
+        expect = path.find_on_grid(grid, (0, 0), (29, 29), max_depth=1000)
+        search = path.search_on_grid(grid, (0, 0), (29, 29), max_depth=1000,
+                                     batch=10)
+        next(search)
+        # A second search has to get buffers of its own.
+        eq_(expect, path.find_on_grid(grid, (0, 0), (29, 29),
+                                      max_depth=1000))
+        eq_(expect, list(search)[-1][1])
+        eq_(2, len(path._buffers[grid]))
+        eq_(expect, path.find_on_grid(grid, (0, 0), (29, 29),
+                                      max_depth=1000))
+        eq_(2, len(path._buffers[grid]))
+
+
+class SearchStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.grid = Grid([[0, 0, 0, 0],
+                          [0, 9, 9, 0],
+                          [0, 0, 0, 0]])
+        self.weighted = Grid([[0, 0, 0, 0],
+                              [0, 9, 9, 0],
+                              [0, 0, 0, 2]])
+
+    def test_find(self):
+        stats = path.SearchStats(explored=True)
+        tester = PathTest('test_1x1')
+        tester.map = [[0, 0, 0],
+                      [0, 9, 0],
+                      [0, 0, 0]]
+        p = path.find((0, 0), (2, 2), tester.neighbors4, tester.heuristic,
+                      stats=stats)
+        eq_(p, path.find((0, 0), (2, 2), tester.neighbors4,
+                         tester.heuristic))
+        ok_((2, 2) in stats.explored)
+        ok_((1, 1) not in stats.explored)
+        eq_(len(stats.explored), stats.expanded)
+        eq_(stats.expanded - 1, stats.calls['neighbors'])
+        ok_(stats.calls['heuristic'] >= stats.pushed)
+        ok_(stats.popped >= stats.expanded)
+        ok_(stats.times['total'] >= stats.times['heap'])
+
+    def test_grid(self):
+        stats = path.SearchStats(explored=True)
+        p = path.find_on_grid(self.weighted, (0, 0), (3, 2), stats=stats)
+        eq_(p, path.find_on_grid(self.weighted, (0, 0), (3, 2)))
+        eq_(len(stats.explored), stats.expanded)
+        ok_((3, 2) in stats.explored)
+        ok_(stats.pushed >= stats.expanded)
+
+    def test_reopened(self):
+        grid = Grid(random_rows(random.Random(2), 20, 20, walls=0.1,
+                                costs=(0, 1, 5)))
+        grid.costs[0] = grid.costs[-1] = 0
+        stats = path.SearchStats()
+        ok_(path.find_on_grid(grid, (0, 0), (19, 19), stats=stats))
+        ok_(stats.reopened)
+        ok_(stats.pushed - stats.reopened >= stats.expanded)
+        ok_(stats.popped - (stats.pushed - stats.reopened) <=
+            stats.reopened)
+
+    def test_jump_point_search(self):
+        stats = path.SearchStats(explored=True)
+        p = path.find_on_grid(self.grid, (0, 0), (3, 2), stats=stats)
+        eq_(5, len(p))
+        ok_(0 < stats.expanded < 8)
+        ok_((3, 2) in stats.explored)
+        ok_(stats.calls['jump'])
+
+    def test_slices(self):
+        stats = path.SearchStats()
+        results = list(path.search_on_grid(self.weighted, (0, 0), (3, 2),
+                                           batch=1, stats=stats))
+        eq_(stats.expanded, len(results))
+        eq_(None, stats.explored)
+
+
+class FlowFieldTest(unittest.TestCase):
+
+    def test_costs(self):
+        grid = Grid([[0, 9, 0],
+                     [0, 5, 0],
+                     [0, 0, 0]])
+        field = path.FlowField(grid, (2, 0), 10)
+        eq_(0, field.get(2, 0))
+        eq_(1, field.get(2, 1))
+        eq_(6, field.get(0, 0))
+        eq_(path.INFINITY, field.get(1, 0))
+        eq_(path.INFINITY, field.get(3, 0))
+
+    def test_descend(self):
+        rand = random.Random(2)
+        grid = Grid(random_rows(rand, 16, 12, costs=(0, 0, 2)))
+        locs = [(x, y) for y in range(grid.height)
+                for x in range(grid.width) if grid.passable(x, y)]
+        dst = rand.choice(locs)
+        field = path.FlowField(grid, dst, 20)
+        for src in locs:
+            if field.get(*src) == path.INFINITY:
+                continue
+            loc = src
+            cost = 0
+            while loc != dst:
+                loc = field.next_step(loc)
+                cost += grid.costs[loc[1] * grid.width + loc[0]] + 1
+            eq_(field.get(*src), cost)
+
+    def test_radius(self):
+        grid = Grid([[0] * 10] * 10)
+        field = path.FlowField(grid, (5, 5), 2)
+        eq_(4, field.get(3, 3))
+        eq_(path.INFINITY, field.get(2, 5))
+        eq_(None, field.next_step((2, 5)))
+
+    def test_blocked(self):
+        grid = Grid([[0, 0, 0],
+                     [0, 0, 0],
+                     [0, 0, 0]])
+        field = path.FlowField(grid, (2, 2), 10)
+        eq_((0, 1), field.next_step((0, 0), blocked=[(1, 0)]))
+        eq_(None, field.next_step((0, 0), blocked=[(1, 0), (0, 1)]))
+        eq_(None, field.next_step((1, 1), blocked=[(2, 1), (1, 2)]))
+
+
+class FakeNative(object):
+    """ A native backend that records what it is asked to do. """
+
+    def __init__(self, result):
+        self.result = result
+        self.calls = []
+
+    def find_uniform(self, grid, src, dst, blocked, allowed, max_depth):
+        self.calls.append((src, dst))
+        return self.result
+
+    def flow_field(self, grid, dst):
+        self.calls.append(dst)
+        return self.result
+
+
+class NativeTest(unittest.TestCase):
+
+    def tearDown(self):
+        path.native = None
+
+    def test_find_on_grid(self):
+        path.native = FakeNative(['native'])
+        grid = Grid([[0, 0, 0],
+                     [0, 9, 0]])
+        eq_(['native'], path.find_on_grid(grid, (0, 0), (2, 1)))
+        eq_([((0, 0), (2, 1))], path.native.calls)
+        # Not for weighted ground, nor when instrumented.
+        grid.costs[1] = 2
+        eq_(3, len(path.find_on_grid(grid, (0, 0), (2, 1))))
+        grid.costs[1] = 0
+        eq_(3, len(path.find_on_grid(grid, (0, 0), (2, 1),
+                                     stats=path.SearchStats())))
+        eq_(1, len(path.native.calls))
+
+    def test_fallback(self):
+        path.native = FakeNative(None)
+        grid = Grid([[0, 0, 0]])
+        eq_([(1, 0), (2, 0)], path.find_on_grid(grid, (0, 0), (2, 0)))
+        ok_(isinstance(path.flow_field(grid, (0, 0), 5), path.FlowField))
+        eq_(2, len(path.native.calls))
+
+    def test_flow_field(self):
+        path.native = FakeNative('native')
+        grid = Grid([[0] * 5] * 5)
+        eq_('native', path.flow_field(grid, (2, 2), 2))
+        # Only for fields over the whole grid.
+        ok_(isinstance(path.flow_field(grid, (2, 2), 1), path.FlowField))
+        eq_([(2, 2)], path.native.calls)
+
+
+class ReplannerTest(unittest.TestCase):
+
+    def cost(self, grid, p):
+        return sum(grid.costs[y * grid.width + x] + 1 for x, y in p)
+
+    def best_cost(self, grid, src, dst, blocked):
+        costs = numpy.array(path.cost_array(grid))
+        for x, y in blocked:
+            costs[y, x] = -1
+        return path.distance_fields(costs, [src])[0][dst[1], dst[0]]
+
+    def test_open(self):
+        grid = Grid([[0] * 10] * 10)
+        planner = path.Replanner(grid)
+        p = planner.find((0, 0), (9, 9))
+        eq_(18, check_path(grid, (0, 0), (9, 9), p))
+        eq_([], planner.find((9, 9), (9, 9)))
+
+    def test_follow_path(self):
+        grid = Grid(random_rows(random.Random(3), 20, 20, walls=0.1))
+        src = (0, 0)
+        dst = (19, 19)
+        grid.costs[0] = grid.costs[-1] = 0
+        planner = path.Replanner(grid)
+        p = planner.find(src, dst)
+        check_path(grid, src, dst, p)
+        expanded = len(planner.g)
+        for loc in p[:-1]:
+            eq_(p[p.index(loc) + 1:], planner.find(loc, dst))
+        eq_(expanded, len(planner.g))
+
+    def test_blocked(self):
+        grid = Grid([[0, 0, 0],
+                     [0, 0, 0]])
+        planner = path.Replanner(grid)
+        eq_([(1, 0), (2, 0)], planner.find((0, 0), (2, 0)))
+        eq_([(0, 1), (1, 1), (2, 1), (2, 0)],
+            planner.find((0, 0), (2, 0), blocked=[(1, 0)]))
+        eq_([], planner.find((0, 0), (2, 0), blocked=[(1, 0), (1, 1)]))
+        eq_([(1, 0), (2, 0)], planner.find((0, 0), (2, 0)))
+
+    def test_terrain_changed(self):
+        grid = Grid([[0, 0, 0],
+                     [0, 0, 0]])
+        planner = path.Replanner(grid)
+        eq_([(1, 0), (2, 0)], planner.find((0, 0), (2, 0)))
+        grid.costs[1] = 9
+        grid.version += 1
+        eq_([(0, 1), (1, 1), (2, 1), (2, 0)], planner.find((0, 0), (2, 0)))
+
+    def test_set_allowed(self):
+        grid = Grid([[0, 0, 0],
+                     [0, 0, 0]])
+        allowed = path.cost_array(grid) >= 0
+        allowed[1, 1] = False
+        planner = path.Replanner(grid, allowed)
+        eq_([], planner.find((0, 0), (2, 0), blocked=[(1, 0)]))
+        allowed = allowed.copy()
+        allowed[1, 1] = True
+        planner.set_allowed(allowed)
+        eq_([(0, 1), (1, 1), (2, 1), (2, 0)],
+            planner.find((0, 0), (2, 0), blocked=[(1, 0)]))
+        planner.set_allowed(None)
+        eq_([(1, 0), (2, 0)], planner.find((0, 0), (2, 0)))
+
+    def test_matches_fresh(self):
+        rand = random.Random(4)
+        for trial in range(20):
+            grid = Grid(random_rows(rand, 16, 12, costs=(0, 0, 3)))
+            locs = [(x, y) for y in range(grid.height)
+                    for x in range(grid.width) if grid.passable(x, y)]
+            src = rand.choice(locs)
+            dst = rand.choice(locs)
+            blocked = set()
+            planner = path.Replanner(grid)
+            for step in range(30):
+                p = planner.find(src, dst, blocked)
+                best = self.best_cost(grid, src, dst, blocked)
+                if src == dst:
+                    eq_([], p)
+                elif best == path.INFINITY:
+                    eq_([], p)
+                else:
+                    check_path(grid, src, dst, p)
+                    ok_(not blocked.intersection(p))
+                    eq_(best, self.cost(grid, p))
+                r = rand.random()
+                if r < 0.4 and p:
+                    src = p[0]
+                elif r < 0.8:
+                    dx, dy = rand.choice(path.directions)
+                    if grid.passable(dst[0] + dx, dst[1] + dy):
+                        dst = dst[0] + dx, dst[1] + dy
+                else:
+                    loc = rand.choice(locs)
+                    if loc != src:
+                        blocked.symmetric_difference_update([loc])
+
+
+class RegionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.place = place.Place(8, 6, default_terrain=terrain.Grass)
+        self.rules = executor.Ruleset()
+        self.rules.set_passability('walk', 'wall', executor.PASS_NONE)
+        for y in range(6):
+            self.place.set_terrain(4, y, terrain.RockWall)
+        self.grid = self.rules.get_cost_grid('walk', self.place)
+        self.regions = path.Regions(self.grid)
+
+    def check(self):
+        """ Assert the regions match those labelled from scratch, up to the
+        choice of labels. """
+        self.regions.refresh()
+        labels, bounds = path.label_regions(path.cost_array(self.grid) >= 0)
+        pairs = set(zip(labels.flat, self.regions.labels.flat))
+        eq_(len(pairs), len(set(labels.flat)))
+        eq_(len(pairs), len(set(self.regions.labels.flat)))
+        for label, box in enumerate(bounds[1:], 1):
+            ys, xs = numpy.nonzero(labels == label)
+            eq_((xs.min(), ys.min(), xs.max() + 1, ys.max() + 1), box)
+
+    def test_label_regions(self):
+        labels, bounds = path.label_regions(numpy.array(
+            [[1, 1, 0, 1],
+             [0, 1, 0, 1],
+             [1, 1, 0, 0],
+             [0, 0, 1, 1]], dtype=bool))
+        eq_([[1, 1, 0, 2],
+             [0, 1, 0, 2],
+             [1, 1, 0, 0],
+             [0, 0, 3, 3]], labels.tolist())
+        eq_([None, (0, 0, 2, 3), (3, 0, 4, 2), (2, 3, 4, 4)], bounds)
+
+    def test_connected(self):
+        ok_(self.regions.connected((0, 0), (3, 5)))
+        ok_(not self.regions.connected((0, 0), (5, 0)))
+        ok_(not self.regions.connected((0, 0), (4, 0)))
+        ok_(not self.regions.connected((0, 0), (-1, 0)))
+
+    def test_join(self):
+        self.place.set_terrain(4, 3, terrain.Grass)
+        ok_(self.regions.connected((0, 0), (7, 5)))
+        self.check()
+
+    def test_split(self):
+        for x in range(4):
+            self.place.set_terrain(x, 2, terrain.RockWall)
+        ok_(not self.regions.connected((0, 0), (0, 5)))
+        ok_(self.regions.connected((0, 3), (3, 5)))
+        self.check()
+
+    def test_random_changes(self):
+        rand = random.Random(4)
+        for i in range(50):
+            x = rand.randrange(8)
+            y = rand.randrange(6)
+            ter = rand.choice((terrain.Grass, terrain.RockWall))
+            self.place.set_terrain(x, y, ter)
+            if rand.random() < 0.5:
+                self.check()
+        self.check()
+
+    def test_passability(self):
+        self.place.set_terrain(4, 3, terrain.Water)
+        ok_(self.regions.connected((0, 0), (7, 5)))
+        self.rules.set_passability('walk', 'water', executor.PASS_NONE)
+        ok_(not self.regions.connected((0, 0), (7, 5)))
+        self.check()
+
+    def test_close(self):
+        self.regions.close()
+        self.place.set_terrain(4, 3, terrain.Grass)
+        eq_([], self.regions.dirty)
+        # Still caught, by the grid version.
+        ok_(self.regions.connected((0, 0), (7, 5)))
+
+
+class PathCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.place = place.Place(10, 10, default_terrain=terrain.Grass)
+        self.cache = path.PathCache(self.place, 2)
+        self.cache.put((1, 1), (3, 1), 'walk', [(2, 1), (3, 1)])
+
+    def test_hit(self):
+        p = self.cache.get((1, 1), (3, 1), 'walk')
+        eq_([(2, 1), (3, 1)], p)
+        p.pop()
+        eq_([(2, 1), (3, 1)], self.cache.get((1, 1), (3, 1), 'walk'))
+        eq_(None, self.cache.get((1, 1), (3, 1), 'fly'))
+        eq_((2, 1), (self.cache.hits, self.cache.misses))
+
+    def test_lru(self):
+        self.cache.put((5, 5), (5, 6), 'walk', [(5, 6)])
+        self.cache.get((1, 1), (3, 1), 'walk')
+        self.cache.put((7, 7), (7, 8), 'walk', [(7, 8)])
+        eq_(None, self.cache.get((5, 5), (5, 6), 'walk'))
+        ok_(self.cache.get((1, 1), (3, 1), 'walk'))
+        eq_(1, self.cache.evictions)
+
+    def test_invalidate(self):
+        self.place.set_terrain(2, 2, terrain.RockWall)
+        ok_(self.cache.get((1, 1), (3, 1), 'walk'))
+        self.place.set_terrain(3, 1, terrain.RockWall)
+        eq_(None, self.cache.get((1, 1), (3, 1), 'walk'))
+        eq_(1, self.cache.invalidations)
+
+    def test_explored(self):
+        self.place.set_explored(2, 1, True)
+        self.place.explore(0, 0, numpy.ones((3, 5), dtype=bool))
+        ok_(self.cache.get((1, 1), (3, 1), 'walk'))
+
+    def test_follower(self):
+        # The player stands at the start of its path, with a follower
+        # trailing it that keeps stepping in and out of the path's way.
+        self.place.set_occupant(1, 1, 'player')
+        self.place.set_occupant(0, 1, 'follower')
+        self.place.remove_occupant(0, 1)
+        self.place.set_occupant(2, 1, 'follower')
+        self.place.remove_occupant(2, 1)
+        self.place.set_occupant(1, 2, 'follower')
+        eq_([(2, 1), (3, 1)], self.cache.get((1, 1), (3, 1), 'walk'))
+        eq_(0, self.cache.invalidations)
+
+    def test_close(self):
+        self.cache.close()
+        self.place.set_terrain(2, 1, terrain.RockWall)
+        ok_(self.cache.get((1, 1), (3, 1), 'walk'))
+
+
+class FindInTimeTest(unittest.TestCase):
+
+    def setUp(self):
+        # A corridor one tile wide along y = 0, with a siding at (2, 1).
+        self.open = set([(x, 0) for x in range(6)] + [(2, 1)])
+        self.table = path.ReservationTable()
+
+    def neighbors(self, loc):
+        for dx, dy in path.directions:
+            nxt = (loc[0] + dx, loc[1] + dy)
+            if nxt in self.open:
+                yield nxt, 1
+
+    def goal(self, dst):
+        return lambda loc: path.manhattan(loc, dst)
+
+    def find(self, agent, src, dst, window=8):
+        locs = path.find_in_time(src, self.neighbors, self.goal(dst),
+                                 self.table, agent, window)
+        self.table.reserve(agent, locs)
+        return locs
+
+    def test_alone(self):
+        eq_([(0, 0), (1, 0), (2, 0), (3, 0)], self.find('a', (0, 0), (3, 0)))
+
+    def test_wait(self):
+        self.table.reserve('a', [(2, 0), (2, 0), (2, 0), (3, 0)])
+        eq_([(0, 0), (1, 0), (1, 0), (2, 0), (3, 0)],
+            self.find('b', (0, 0), (3, 0)))
+
+    def test_no_swap(self):
+        self.table.reserve('a', [(2, 0), (1, 0)])
+        ok_(not self.table.can_move('b', (1, 0), (2, 0), 0))
+        ok_(self.table.can_move('a', (2, 0), (1, 0), 0))
+
+    def test_step_aside(self):
+        # a heads east down the corridor while b, in its way, heads west.
+        a = self.find('a', (0, 0), (5, 0))
+        self.table.release('b', (3, 0), 0)
+        b = self.find('b', (3, 0), (0, 0), window=len(a) + 3)
+        cells = set()
+        for agent, locs in (('a', a), ('b', b)):
+            for t, loc in enumerate(locs):
+                ok_((loc, t) not in cells)
+                cells.add((loc, t))
+        eq_((0, 0), b[-1])
+        ok_((2, 1) in b)
+
+    def test_stuck(self):
+        self.table.reserve('a', [(1, 0)] * 10)
+        eq_((0, 0), self.find('b', (0, 0), (3, 0), window=4)[-1])
@@ -0,0 +1,52 @@
+import random
+import unittest
+from tools import eq_, ok_
+from azoth import executor, path, pathpool, place, terrain
+
+
+class PathPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.place = place.Place(30, 20, default_terrain=terrain.Grass)
+        rand = random.Random(6)
+        for i in range(150):
+            self.place.set_terrain(rand.randrange(30), rand.randrange(20),
+                                   terrain.RockWall)
+        self.rules = executor.Ruleset()
+        self.rules.set_passability('walk', 'wall', executor.PASS_NONE)
+        self.rules.set_passability('fly', 'wall', 3)
+        self.pool = pathpool.PathPool(self.rules, self.place, ['walk', 'fly'],
+                                      processes=2)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def serial(self, queries, blocked=()):
+        return [path.find_on_grid(self.rules.get_cost_grid(mmode, self.place),
+                                  src, dst, blocked=blocked)
+                for src, dst, mmode in queries]
+
+    def queries(self, n):
+        rand = random.Random(7)
+        return [((rand.randrange(30), rand.randrange(20)),
+                 (rand.randrange(30), rand.randrange(20)),
+                 rand.choice(['walk', 'fly'])) for i in range(n)]
+
+    def test_matches_serial(self):
+        queries = self.queries(40)
+        results = self.pool.find(queries)
+        eq_(self.serial(queries), results)
+        ok_(any(results))
+
+    def test_blocked(self):
+        queries = [((0, 0), (5, 0), 'fly')]
+        blocked = [(1, 0), (2, 1)]
+        eq_(self.serial(queries, blocked),
+            self.pool.find(queries, blocked=blocked))
+
+    def test_terrain_changed(self):
+        queries = [((0, 0), (29, 0), 'walk')]
+        self.pool.find(queries)
+        for y in range(20):
+            self.place.set_terrain(15, y, terrain.RockWall)
+        eq_([[]], self.pool.find(queries))
@@ -0,0 +1,78 @@
+import numpy
+import unittest
+from tools import eq_, ok_
+from azoth import perception, place, terrain
+
+
+class Being(object):
+    """ Just enough of a being to be seen. """
+
+    def __init__(self, pla, x, y):
+        self.xy = x, y
+        pla.set_occupant(x, y, self)
+
+
+class LineTest(unittest.TestCase):
+
+    def test_line(self):
+        eq_([(0, 0), (1, 0), (2, 1), (3, 1)],
+            list(perception.line((0, 0), (3, 1))))
+        eq_([(2, 2), (1, 1), (0, 0)], list(perception.line((2, 2), (0, 0))))
+        eq_([(1, 1)], list(perception.line((1, 1), (1, 1))))
+
+    def test_line_of_sight(self):
+        clear = numpy.ones((3, 5), dtype=bool)
+        clear[1, 2] = False
+        ok_(not perception.line_of_sight(clear, (0, 1), (4, 1)))
+        ok_(not perception.line_of_sight(clear, (4, 1), (0, 1)))
+        ok_(perception.line_of_sight(clear, (0, 0), (4, 0)))
+        # The ends themselves do not block.
+        ok_(perception.line_of_sight(clear, (2, 1), (4, 1)))
+
+    def test_symmetric(self):
+        clear = numpy.ones((4, 4), dtype=bool)
+        clear[1, 1] = False
+        for dst in [(3, 2), (2, 3), (3, 1)]:
+            eq_(perception.line_of_sight(clear, (0, 0), dst),
+                perception.line_of_sight(clear, dst, (0, 0)))
+
+
+class PerceptionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.place = place.Place(40, 10, default_terrain=terrain.Grass)
+        self.place.set_terrain(3, 1, terrain.RockWall)
+        self.seer = perception.Perception(self.place)
+        self.a = Being(self.place, 1, 1)
+        self.b = Being(self.place, 5, 1)
+        self.c = Being(self.place, 1, 4)
+        self.d = Being(self.place, 35, 1)
+
+    def test_batch(self):
+        eq_([False, True, False, True],
+            self.seer.batch([(self.a, self.b), (self.a, self.c),
+                             (self.a, self.d), (self.b, self.c)], 10))
+        eq_(3, self.seer.traced)
+        # The same pair, the other way round.
+        eq_([False], self.seer.batch([(self.b, self.a)], 10))
+        eq_((3, 1), (self.seer.traced, self.seer.shared))
+
+    def test_visible(self):
+        seen = self.seer.visible([self.a, self.b, self.d], 10)
+        eq_([self.c], seen[self.a])
+        eq_([self.c], seen[self.b])
+        eq_([], seen[self.d])
+        # d is too far from a and b to be looked at, and a, b and c from d.
+        eq_(5, self.seer.culled)
+
+    def test_end_turn(self):
+        self.seer.batch([(self.a, self.c)], 10)
+        self.seer.batch([(self.a, self.c)], 10)
+        self.seer.end_turn()
+        self.seer.batch([(self.a, self.c)], 10)
+        eq_((2, 1), (self.seer.traced, self.seer.shared))
+
+    def test_terrain(self):
+        eq_([False], self.seer.batch([(self.a, self.b)], 10))
+        self.place.set_terrain(3, 1, terrain.Grass)
+        eq_([True], self.seer.batch([(self.a, self.b)], 10))
@@ -1,6 +1,9 @@
 #from nose.tools import *
 from tools import *
 from azoth import place, terrain, terrainmap
+import array
+import cPickle
+import numpy
 import unittest
 import warnings
 
@@ -104,6 +107,46 @@ class Place(unittest.TestCase):
         self.place.set_explored(0, 0, False)
         eq_(False, self.place.get_explored(0, 0))
 
+    def test_explored_mask(self):
+        pla = place.Place(3, 2)
+        pla.set_explored(2, 1, True)
+        eq_([[False, False, False], [False, False, True]],
+            pla.get_explored_mask().tolist())
+
+    def test_explore(self):
+        pla = place.Place(20, 3)
+        visible = numpy.array([[True] * 11, [False] * 10 + [True]])
+        ok_(pla.explore(6, 1, visible))
+        mask = pla.get_explored_mask()
+        eq_(12, mask.sum())
+        ok_(mask[1, 6] and mask[1, 16] and mask[2, 16])
+        ok_(not mask[1, 5] and not mask[1, 17] and not mask[2, 15])
+        ok_(pla.get_explored(16, 2))
+        ok_(not pla.get_explored(15, 2))
+        # Nothing new.
+        ok_(not pla.explore(6, 1, visible[:1]))
+        ok_(pla.explore(0, 0, numpy.ones((3, 20), dtype=bool)))
+        eq_(60, pla.get_explored_mask().sum())
+        ok_(not pla.explore(0, 0, numpy.ones((3, 20), dtype=bool)))
+        pla.set_explored(9, 1, False)
+        ok_(not pla.get_explored(9, 1))
+        ok_(pla.get_explored(8, 1) and pla.get_explored(10, 1))
+        ok_(pla.explore(4, 0, numpy.ones((3, 10), dtype=bool)))
+        ok_(pla.get_explored(9, 1))
+
+    def test_legacy_explored(self):
+        pla = place.Place(10, 2)
+        state = dict(pla.__dict__)
+        state['explored'] = [array.array('b', '\0' * 2) for x in range(10)]
+        state['explored'][9][1] = 1
+        state['explored'][0][0] = 1
+        pla = place.Place.__new__(place.Place)
+        pla.__setstate__(state)
+        ok_(pla.get_explored(9, 1))
+        ok_(pla.get_explored(0, 0))
+        ok_(not pla.get_explored(0, 1))
+        eq_(2, pla.get_explored_mask().sum())
+
     def test_save_load(self):
         self.place.add_item(0, 0, 'a')
         self.place.set_occupant(0, 0, 'b')
@@ -115,6 +158,129 @@ class Place(unittest.TestCase):
         ok_(self.place.get_explored(0, 0))
 
 
+class TerrainTest(unittest.TestCase):
+
+    def setUp(self):
+        self.place = place.Place(3, 2, default_terrain=terrain.Grass)
+
+    def test_default(self):
+        eq_(terrain.Grass, self.place.get_terrain(2, 1))
+        eq_([terrain.Grass], self.place.palette)
+
+    def test_set(self):
+        self.place.set_terrain(2, 1, terrain.RockWall)
+        self.place.set_terrain(0, 1, terrain.RockWall)
+        eq_(terrain.RockWall, self.place.get_terrain(2, 1))
+        eq_(terrain.Grass, self.place.get_terrain(1, 1))
+        eq_([terrain.Grass, terrain.RockWall], self.place.palette)
+        eq_([0, 0, 0, 1, 0, 1], list(self.place.terrain_ids))
+
+    def test_offmap(self):
+        raises_(place.OffMapError, self.place.get_terrain, 3, 0)
+        raises_(place.OffMapError, self.place.set_terrain, 0, 2,
+                terrain.Grass)
+
+    def test_blit_clipped(self):
+        tmap = terrainmap.TerrainMap(terrain=[[terrain.Bog, terrain.Forest],
+                                              [terrain.Lake, terrain.Hills]])
+        self.place.blit_terrain_map(2, 1, tmap)
+        eq_(terrain.Bog, self.place.get_terrain(2, 1))
+        eq_(terrain.Grass, self.place.get_terrain(1, 1))
+        eq_(terrain.Grass, self.place.get_terrain(2, 0))
+
+    def test_blit_place(self):
+        src = place.Place(3, 2, default_terrain=terrain.Grass)
+        src.set_terrain(1, 1, terrain.Bog)
+        self.place.blit_terrain_map(0, 0, src)
+        eq_(list(src.terrain_ids), list(self.place.terrain_ids))
+        eq_(terrain.Bog, self.place.get_terrain(1, 1))
+
+    def test_get_terrain_region(self):
+        self.place.set_terrain(2, 1, terrain.Bog)
+        tmap = self.place.get_terrain_region(1, 0, 5, 5)
+        eq_((2, 2), (tmap.width, tmap.height))
+        eq_(terrain.Grass, tmap.get(0, 0))
+        eq_(terrain.Bog, tmap.get(1, 1))
+        raises_(place.OffMapError, self.place.get_terrain_region, 3, 0, 1, 1)
+
+    def test_legacy_state(self):
+        state = dict(self.place.__dict__)
+        del state['palette'], state['palette_ids'], state['terrain_ids']
+        state['terrain_map'] = [[terrain.Grass, terrain.Forest],
+                                [terrain.Grass, terrain.Grass],
+                                [terrain.Bog, terrain.Grass]]
+        pla = place.Place.__new__(place.Place)
+        pla.__setstate__(state)
+        eq_(terrain.Forest, pla.get_terrain(0, 1))
+        eq_(terrain.Bog, pla.get_terrain(2, 0))
+        ok_(not hasattr(pla, 'terrain_map'))
+
+
+class TransparencyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.place = place.Place(3, 2, default_terrain=terrain.Grass)
+        self.place.set_terrain(1, 0, terrain.RockWall)
+
+    def test_build(self):
+        trans = self.place.get_transparency()
+        ok_(trans is self.place.get_transparency())
+        eq_([[True, False, True], [True, True, True]], trans.clear.tolist())
+
+    def test_patch(self):
+        trans = self.place.get_transparency()
+        clear = trans.clear
+        self.place.set_terrain(2, 1, terrain.HeavyForest)
+        self.place.set_terrain(1, 0, terrain.Grass)
+        eq_(2, trans.version)
+        tmap = terrainmap.TerrainMap(terrain=[[terrain.RockWall],
+                                              [terrain.RockWall]])
+        self.place.blit_terrain_map(0, 0, tmap)
+        eq_(3, trans.version)
+        ok_(clear is trans.clear)
+        eq_([[False, True, True], [False, True, False]], clear.tolist())
+        # Replacing the whole map replaces the palette too.
+        src = place.Place(3, 2, default_terrain=terrain.RockWall)
+        src.set_terrain(0, 0, terrain.Grass)
+        self.place.blit_terrain_map(0, 0, src)
+        eq_([[True, False, False], [False, False, False]], clear.tolist())
+
+    def test_stale_palette(self):
+        # The None the place started out with stays in the palette.
+        pla = place.Place(2, 1)
+        pla.set_terrain(0, 0, terrain.Grass)
+        pla.set_terrain(1, 0, terrain.Grass)
+        ok_(None in pla.palette)
+        eq_([[True, True]], pla.get_transparency().clear.tolist())
+
+    def test_region_version(self):
+        pla = place.Place(40, 20, default_terrain=terrain.Grass)
+        trans = pla.get_transparency()
+        eq_(0, trans.region_version(0, 0, 40, 20))
+        pla.set_terrain(20, 5, terrain.RockWall)
+        eq_(0, trans.region_version(0, 0, 16, 20))
+        eq_(1, trans.region_version(16, 0, 17, 1))
+        eq_(1, trans.region_version(0, 0, 40, 20))
+        pla.blit_terrain_map(0, 0, terrainmap.TerrainMap(
+            terrain=[[terrain.Bog] * 17]))
+        eq_(1, trans.region_version(0, 0, 16, 20))
+        eq_(2, trans.region_version(16, 0, 17, 1))
+        eq_(0, trans.region_version(32, 0, 40, 20))
+
+    def test_close(self):
+        trans = self.place.get_transparency()
+        trans.close()
+        self.place.set_terrain(0, 0, terrain.RockWall)
+        eq_(0, trans.version)
+
+    def test_not_saved(self):
+        self.place.get_transparency()
+        pla = cPickle.loads(cPickle.dumps(self.place))
+        eq_(None, pla.transparency)
+        eq_([[True, False, True], [True, True, True]],
+            pla.get_transparency().clear.tolist())
+
+
 class WorldTest(unittest.TestCase):
 
     def test_init(self):
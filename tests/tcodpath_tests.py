@@ -0,0 +1,154 @@
+import array
+import random
+import unittest
+from tools import eq_, ok_
+from azoth import path, tcodpath
+from path_tests import Grid, random_rows
+
+
+class InstallTest(unittest.TestCase):
+
+    def tearDown(self):
+        tcodpath.uninstall()
+
+    def test_install(self):
+        eq_(tcodpath.available, tcodpath.install())
+        eq_(tcodpath.available, path.native is not None)
+        tcodpath.uninstall()
+        eq_(None, path.native)
+
+
+class FakeLibtcod(object):
+    """ Just enough of libtcodpy for the maps and fields of the backend:
+    Dijkstra distances are looked up in 'distances', and the handles freed
+    are recorded in 'deleted'. """
+
+    def __init__(self, distances):
+        self.distances = distances
+        self.deleted = []
+
+    def map_new(self, width, height):
+        return 'map'
+
+    def map_clear(self, tmap, transparent, walkable):
+        pass
+
+    def map_set_properties(self, tmap, x, y, transparent, walkable):
+        pass
+
+    def path_new_using_map(self, tmap, diagonal):
+        return 'astar'
+
+    def path_delete(self, astar):
+        self.deleted.append(astar)
+
+    def map_delete(self, tmap):
+        self.deleted.append(tmap)
+
+    def dijkstra_new(self, tmap, diagonal):
+        return 'dijkstra'
+
+    def dijkstra_compute(self, dijkstra, x, y):
+        pass
+
+    def dijkstra_get_distance(self, dijkstra, x, y):
+        return self.distances.get((x, y), -1.0)
+
+    def dijkstra_delete(self, dijkstra):
+        self.deleted.append(dijkstra)
+
+
+class FakeLibtcodTest(unittest.TestCase):
+
+    def setUp(self):
+        self.libtcod = tcodpath.libtcod
+        tcodpath.libtcod = FakeLibtcod({(1, 0): 1.0, (2, 0): 3.0,
+                                        (0, 1): 1e7})
+
+    def tearDown(self):
+        tcodpath.libtcod = self.libtcod
+
+    def test_scaling(self):
+        grid = Grid([[0, 0, 0],
+                     [0, 9, 0]])
+        tmap = tcodpath.TcodMap(grid.width, grid.height)
+        field = tcodpath.DijkstraField(tmap, grid, (0, 0))
+        eq_(1, field.step)
+        eq_(1, field.get(1, 0))
+        eq_(3, field.get(2, 0))
+        # Unreached, unreachable and impassable.
+        eq_(path.INFINITY, field.get(2, 1))
+        eq_(path.INFINITY, field.get(0, 1))
+        eq_(path.INFINITY, field.get(1, 1))
+        # Each step costs the tiles' cost plus one.
+        grid.costs[:] = array.array('h', [2, 2, 2, 2, -1, 2])
+        field = tcodpath.DijkstraField(tmap, grid, (0, 0))
+        eq_(3, field.step)
+        eq_(9, field.get(2, 0))
+
+    def test_all_walls(self):
+        grid = Grid([[9, 9],
+                     [9, 9]])
+        tmap = tcodpath.TcodMap(grid.width, grid.height)
+        field = tcodpath.DijkstraField(tmap, grid, (0, 0))
+        eq_(path.INFINITY, field.get(1, 0))
+
+    def test_delete(self):
+        fake = tcodpath.libtcod
+        tmap = tcodpath.TcodMap(2, 1)
+        field = tcodpath.DijkstraField(tmap, Grid([[0, 0]]), (0, 0))
+        del field
+        eq_(['dijkstra'], fake.deleted)
+        del tmap
+        eq_(['dijkstra', 'astar', 'map'], fake.deleted)
+
+
+@unittest.skipIf(not tcodpath.available, 'libtcod is not available')
+class BackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = tcodpath.Backend()
+        self.grid = Grid(random_rows(random.Random(3), 30, 20, walls=0.25))
+        self.grid.costs[0] = 0
+
+    def find(self, src, dst, blocked=(), allowed=None, max_depth=100):
+        return self.backend.find_uniform(self.grid, src, dst, blocked,
+                                         allowed, max_depth)
+
+    def test_same_lengths(self):
+        rand = random.Random(1)
+        for i in range(20):
+            dst = (rand.randrange(30), rand.randrange(20))
+            expect = path.find_on_grid(self.grid, (0, 0), dst)
+            p = self.find((0, 0), dst)
+            eq_(len(expect), len(p))
+            prev = (0, 0)
+            for loc in p:
+                eq_(1, path.manhattan(prev, loc))
+                ok_(self.grid.passable(*loc))
+                prev = loc
+
+    def test_blocked_and_allowed(self):
+        grid = self.grid = Grid([[0, 0, 0],
+                                 [0, 0, 0]])
+        eq_([(0, 1), (1, 1), (2, 1), (2, 0)],
+            self.find((0, 0), (2, 0), blocked=[(1, 0)]))
+        # The blocked tile is walkable again for the next search.
+        eq_([(1, 0), (2, 0)], self.find((0, 0), (2, 0)))
+        allowed = path.cost_array(grid) >= 0
+        allowed[1, 1] = False
+        eq_([], self.find((0, 0), (2, 0), blocked=[(1, 0)],
+                          allowed=allowed))
+
+    def test_max_depth(self):
+        self.grid = Grid([[0] * 10])
+        eq_([], self.find((0, 0), (9, 0), max_depth=8))
+        eq_(9, len(self.find((0, 0), (9, 0), max_depth=9)))
+
+    def test_flow_field(self):
+        field = self.backend.flow_field(self.grid, (0, 0))
+        radius = max(self.grid.width, self.grid.height)
+        expect = path.FlowField(self.grid, (0, 0), radius)
+        for y in range(self.grid.height):
+            for x in range(self.grid.width):
+                eq_(expect.get(x, y), field.get(x, y))
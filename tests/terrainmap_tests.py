@@ -1,8 +1,13 @@
-from nose.tools import eq_
-from azoth import terrainmap
+from nose.tools import assert_raises, eq_, ok_
+from azoth import terrain, terrainmap
+import numpy
+import os
+import shutil
+import tempfile
 import unittest
 
 scm_path = "../haxima/scm/"
+image_path = "../data/images/haxima/"
 
 class TestBasic(unittest.TestCase):
 
@@ -17,6 +22,10 @@ class TestBasic(unittest.TestCase):
         self.terrainmap.set(0, 0, 'g')
         eq_('g', self.terrainmap.get(0, 0))
 
+    def test_offmap(self):
+        assert_raises(IndexError, self.terrainmap.get, 1, 0)
+        assert_raises(IndexError, self.terrainmap.set, 0, 1, 'g')
+
 class Nazghul(unittest.TestCase):
 
     def test_gregors_hut(self):
@@ -28,3 +37,162 @@ class Nazghul(unittest.TestCase):
         tmap = terrainmap.load_from_nazghul_scm(scm_path + "glasdrin.scm")
         eq_(tmap.width, 31)
         eq_(tmap.height, 31)
+
+    def test_tokenize(self):
+        lines = ['(a "b ; c" ; comment\n', "'tag \"two\n", 'lines" x)\n']
+        eq_(['(', 'a', '"b ; c"', "'tag", '"two\nlines"', 'x', ')'],
+            list(terrainmap.tokenize_scm(lines)))
+
+    def test_many_maps(self):
+        src_dir = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(src_dir, 'two.scm'), 'w') as sfile:
+                sfile.write('''; two maps
+(kern-mk-map 'm_one 2 1 pal_expanded (list ".. ~~ "))
+(kern-mk-map 'm_two 1 2 pal_expanded
+  (list
+    "rr" ; wall
+    "bb"
+  ))
+''')
+            maps = list(terrainmap.iter_nazghul_maps(os.path.join(src_dir,
+                                                                  'two.scm')))
+            eq_(['m_one', 'm_two'], [tag for tag, tmap in maps])
+            eq_((2, 1), (maps[0][1].width, maps[0][1].height))
+            eq_(terrain.Water, maps[0][1].get(1, 0))
+            eq_((1, 2), (maps[1][1].width, maps[1][1].height))
+            eq_(terrain.Boulder, maps[1][1].get(0, 1))
+            dst_dir = os.path.join(src_dir, 'compiled')
+            fnames = terrainmap.compile_nazghul_directory(src_dir, dst_dir)
+            eq_([os.path.join(dst_dir, 'm_one.map'),
+                 os.path.join(dst_dir, 'm_two.map')], fnames)
+            eq_(terrain.RockWall, terrainmap.load_compiled(fnames[1]).get(0, 0))
+        finally:
+            shutil.rmtree(src_dir)
+
+    def test_bad_maps(self):
+        src_dir = tempfile.mkdtemp()
+        try:
+            sname = os.path.join(src_dir, 'ragged.scm')
+            with open(sname, 'w') as sfile:
+                sfile.write('(kern-mk-map \'m_ragged 2 2 pal_expanded '
+                            '(list "rr rr" "bb"))\n')
+            assert_raises(ValueError, list,
+                          terrainmap.iter_nazghul_maps(sname))
+            os.remove(sname)
+            for name in ('a.scm', 'b.scm'):
+                with open(os.path.join(src_dir, name), 'w') as sfile:
+                    sfile.write('(kern-mk-map \'m_same 1 1 pal_expanded '
+                                '(list ".."))\n')
+            assert_raises(ValueError, terrainmap.compile_nazghul_directory,
+                          src_dir, os.path.join(src_dir, 'compiled'))
+        finally:
+            shutil.rmtree(src_dir)
+
+
+class Image(unittest.TestCase):
+
+    def test_worldmap(self):
+        tmap = terrainmap.load_from_image(image_path + "worldmap.png")
+        eq_(tmap.width, 576)
+        eq_(tmap.height, 576)
+        ok_(None not in tmap.palette)
+
+    def test_decode(self):
+        # pixels are indexed [x][y]
+        pixels = numpy.array([[-1, -256], [-256, -65536]]).astype(numpy.uint32)
+        tmap = terrainmap.decode_pixels(pixels)
+        eq_(terrain.Mountains, tmap.get(0, 0))
+        eq_(terrain.Water, tmap.get(1, 0))
+        eq_(terrain.Water, tmap.get(0, 1))
+        eq_(terrain.Lake, tmap.get(1, 1))
+
+    def test_unknown_colors(self):
+        pixels = numpy.array([[-1, 7], [7, 9]])
+        try:
+            terrainmap.decode_pixels(pixels, fname='test')
+        except terrainmap.UnknownColorsError as exc:
+            eq_({7: 2, 9: 1}, exc.counts)
+        else:
+            ok_(False)
+        tmap = terrainmap.decode_pixels(pixels, default=terrain.Unmapped)
+        eq_(terrain.Mountains, tmap.get(0, 0))
+        eq_(terrain.Unmapped, tmap.get(1, 1))
+
+
+class Compiled(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_save_load(self):
+        tmap = terrainmap.load_from_nazghul_scm(scm_path + "glasdrin.scm")
+        fname = os.path.join(self.cache_dir, 'glasdrin.map')
+        terrainmap.save_compiled(tmap, fname)
+        tmap2 = terrainmap.load_compiled(fname)
+        eq_((tmap.width, tmap.height), (tmap2.width, tmap2.height))
+        eq_(tmap.palette, tmap2.palette)
+        eq_(tmap.terrain_ids, tmap2.terrain_ids)
+
+    def test_load_cached(self):
+        fname = scm_path + "gregors-hut.scm"
+        loader = terrainmap.load_from_nazghul_scm
+        cname = terrainmap.compiled_name(fname, loader,
+                                         cache_dir=self.cache_dir)
+        tmap = terrainmap.load_cached(fname, loader, cache_dir=self.cache_dir)
+        ok_(os.path.exists(cname))
+        tmap2 = terrainmap.load_cached(fname, loader, cache_dir=self.cache_dir)
+        eq_(tmap.palette, tmap2.palette)
+        eq_(tmap.terrain_ids, tmap2.terrain_ids)
+
+    def test_corrupt_cache(self):
+        fname = scm_path + "gregors-hut.scm"
+        loader = terrainmap.load_from_nazghul_scm
+        cname = terrainmap.compiled_name(fname, loader,
+                                         cache_dir=self.cache_dir)
+        with open(cname, 'wb') as cfile:
+            cfile.write('garbage')
+        assert_raises(terrainmap.CompiledMapError, terrainmap.load_compiled,
+                      cname)
+        tmap = terrainmap.load_cached(fname, loader, cache_dir=self.cache_dir)
+        eq_(tmap.width, 32)
+        eq_(tmap.width, terrainmap.load_compiled(cname).width)
+
+    def test_bad_headers(self):
+        cname = os.path.join(self.cache_dir, 'bad.map')
+        version = terrainmap.COMPILED_VERSION
+        headers = [
+            '[1, 2]',
+            '{{"version": {}}}'.format(version),
+            '{{"version": {}, "width": 1, "height": 1}}'.format(version),
+            '{{"version": {}, "width": "x", "height": 1, '
+            '"palette": []}}'.format(version),
+            '{{"version": {}, "width": 1, "height": 1, '
+            '"palette": ["azoth.terrain.Nonesuch"]}}'.format(version),
+            '{{"version": {}, "width": 1, "height": 1, '
+            '"palette": ["nonesuch.Grass"]}}'.format(version),
+            '{{"version": {}, "width": 1, "height": 1, '
+            '"palette": ["Grass"]}}'.format(version),
+        ]
+        for header in headers:
+            with open(cname, 'wb') as cfile:
+                cfile.write(terrainmap.COMPILED_MAGIC + '\n' + header + '\n' +
+                            '\0\0')
+            assert_raises(terrainmap.CompiledMapError,
+                          terrainmap.load_compiled, cname)
+
+    def test_bad_ids(self):
+        cname = os.path.join(self.cache_dir, 'bad.map')
+        tmap = terrainmap.TerrainMap(terrain=[[terrain.Grass,
+                                               terrain.RockWall]])
+        terrainmap.save_compiled(tmap, cname)
+        eq_(terrain.RockWall, terrainmap.load_compiled(cname).get(1, 0))
+        # Point the last tile past the end of the palette.
+        with open(cname, 'r+b') as cfile:
+            cfile.seek(-2, os.SEEK_END)
+            cfile.write('\x02\0')
+        assert_raises(terrainmap.CompiledMapError,
+                      terrainmap.load_compiled, cname)